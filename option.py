@@ -1,19 +1,30 @@
 # __author:wtxhpx1991
 
 
-from WindPy import *
 import pandas as pd
 import numpy as np
 from scipy.stats import norm
+from scipy.special import ndtr
 import datetime as dt
 import matplotlib.pyplot as plt
-import bisect
+from collections import deque, OrderedDict
+import math
+import os
+import importlib.util
+import threading
+import hashlib
+import inspect
+import shutil
+import pickle
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import multiprocessing
+from multiprocessing import shared_memory
 
 plt.style.use('ggplot')
 from mpl_toolkits.mplot3d import Axes3D
 
-w.start()
-global ContractSetData
 global UnderlyingSecurity
 global DividendRate
 global InterestRate
@@ -22,14 +33,17 @@ InterestRate = 0.025
 DividendRate = 0.00
 
 
-def ContractSet(exchange="sse", windcode=UnderlyingSecurity, status="all"):
+def ContractSet(exchange="sse", windcode=UnderlyingSecurity, status="all", Provider=None):
     '''
-    获取期权合约数据集，写在OptionContract类外面，赋值给全局变量ContractSetData，避免频繁调用w.wset函数。
+    获取期权合约数据集，由OptionContext在第一次使用时调用并缓存，避免频繁调用w.wset函数。
+    :param Provider: 数据接口，默认使用当前运行环境GetContext()的数据接口
     :return: 返回期权合约数据集，pandas.dataframe
     '''
+    if Provider is None:
+        Provider = GetContext().Provider
     parameter = "exchange=" + exchange + ";" + "windcode=" + windcode + ";" + "status=" + status
     ExchangeLabel = "." + windcode.split(".")[1]  # 判断交易所标签，如"510050.SH"->".SH"
-    OptionContractNameRawData = w.wset("optioncontractbasicinfo", parameter)
+    OptionContractNameRawData = Provider.wset("optioncontractbasicinfo", parameter)
     OptionContractNameData = pd.DataFrame(OptionContractNameRawData.Data).T
     OptionContractNameData.columns = OptionContractNameRawData.Fields
     OptionContractNameData.index = OptionContractNameData['wind_code'].map(lambda x: str(x) + ExchangeLabel)
@@ -37,7 +51,559 @@ def ContractSet(exchange="sse", windcode=UnderlyingSecurity, status="all"):
     return OptionContractNameData
 
 
-ContractSetData = ContractSet()
+class ProviderResult:
+    '''
+    数据接口返回结果，属性与WindPy返回的WindData一致：ErrorCode、Codes、Fields、Times、Data，可以pickle保存
+    '''
+
+    def __init__(self, Data, Fields=None, Codes=None, Times=None, ErrorCode=0):
+        self.Data = Data
+        self.Fields = Fields
+        self.Codes = Codes
+        self.Times = Times
+        self.ErrorCode = ErrorCode
+
+    @classmethod
+    def FromWindData(cls, WindData):
+        '''
+        由WindData转换
+        :param WindData:
+        :return: ProviderResult
+        '''
+        return cls(Data=WindData.Data, Fields=getattr(WindData, "Fields", None), Codes=getattr(WindData, "Codes", None),
+                   Times=getattr(WindData, "Times", None), ErrorCode=getattr(WindData, "ErrorCode", 0))
+
+
+class ProviderError(RuntimeError):
+    '''
+    数据接口返回非0错误码
+    '''
+
+    def __init__(self, ErrorCode, Message=""):
+        super().__init__("数据接口返回错误码" + str(ErrorCode) + ":" + Message)
+        self.ErrorCode = ErrorCode
+
+
+class MarketDataProvider:
+    '''
+    行情数据接口基类，方法与WindPy的w对象同名同参数：wset、wsi、wsd、tdays，返回对象需具有Data、Fields、Codes、Times属性
+    1-WindProvider:wind终端
+    2-RecordingProvider:包装其他数据接口，把每次请求结果保存到本地，用于录制回放数据
+    3-ReplayProvider:从本地目录回放录制的数据，可注入延迟，无需wind终端和网络
+    '''
+
+    def wset(self, TableName, Options=""):
+        raise NotImplementedError
+
+    def wsi(self, Codes, Fields, BeginTime, EndTime, Options=""):
+        raise NotImplementedError
+
+    def wsd(self, Codes, Fields, BeginTime, EndTime, Options=""):
+        raise NotImplementedError
+
+    def tdays(self, BeginTime, EndTime, Options=""):
+        raise NotImplementedError
+
+
+class WindProvider(MarketDataProvider):
+    '''
+    wind终端数据接口，第一次请求时才执行from WindPy import w; w.start()
+    '''
+
+    def __init__(self, Wind=None):
+        '''
+        :param Wind: 已启动的wind接口对象，不传则第一次请求时启动
+        '''
+        self._Wind = Wind
+        self._Lock = threading.Lock()
+
+    @property
+    def Wind(self):
+        if self._Wind is None:
+            with self._Lock:
+                if self._Wind is None:
+                    from WindPy import w
+                    w.start()
+                    self._Wind = w
+        return self._Wind
+
+    def wset(self, TableName, Options=""):
+        return self.Wind.wset(TableName, Options)
+
+    def wsi(self, Codes, Fields, BeginTime, EndTime, Options=""):
+        return self.Wind.wsi(Codes, Fields, BeginTime, EndTime, Options)
+
+    def wsd(self, Codes, Fields, BeginTime, EndTime, Options=""):
+        return self.Wind.wsd(Codes, Fields, BeginTime, EndTime, Options)
+
+    def tdays(self, BeginTime, EndTime, Options=""):
+        return self.Wind.tdays(BeginTime, EndTime, Options)
+
+
+class RecordingProvider(MarketDataProvider):
+    '''
+    录制数据接口，请求转发给Provider，并把结果按请求参数保存到RecordDir，供ReplayProvider回放
+    '''
+
+    def __init__(self, Provider, RecordDir):
+        '''
+        :param Provider: 实际请求数据的接口，如WindProvider()
+        :param RecordDir: 录制目录
+        '''
+        self.Provider = Provider
+        self.RecordDir = RecordDir
+
+    @classmethod
+    def RecordPath(cls, RecordDir, Method, Args):
+        '''
+        返回请求对应的录制文件路径，RecordDir/方法名/请求参数的sha1.pkl
+        :param RecordDir:
+        :param Method: wset、wsi、wsd、tdays
+        :param Args: 请求参数tuple
+        :return:
+        '''
+        Key = hashlib.sha1(repr(tuple(str(x) for x in Args)).encode("utf-8")).hexdigest()
+        return os.path.join(RecordDir, Method, Key + ".pkl")
+
+    def Record(self, Method, *Args):
+        result = ProviderResult.FromWindData(getattr(self.Provider, Method)(*Args))
+        path = self.RecordPath(self.RecordDir, Method, Args)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(result, f)
+        os.replace(path + ".tmp", path)
+        return result
+
+    def wset(self, TableName, Options=""):
+        return self.Record("wset", TableName, Options)
+
+    def wsi(self, Codes, Fields, BeginTime, EndTime, Options=""):
+        return self.Record("wsi", Codes, Fields, BeginTime, EndTime, Options)
+
+    def wsd(self, Codes, Fields, BeginTime, EndTime, Options=""):
+        return self.Record("wsd", Codes, Fields, BeginTime, EndTime, Options)
+
+    def tdays(self, BeginTime, EndTime, Options=""):
+        return self.Record("tdays", BeginTime, EndTime, Options)
+
+
+class ReplayProvider(MarketDataProvider):
+    '''
+    回放数据接口，从RecordingProvider录制的目录读取结果，请求参数必须与录制时完全一致，未录制的请求抛出KeyError
+    *交易日历例外：TradeCalendarIndex默认请求到"今天之后400天"，参数每天都不同，未录制的区间从录制的全部交易日历中截取
+    可通过Latency注入每次请求的延迟（秒），模拟wind接口耗时，用于无网络环境下的性能测试
+    '''
+
+    def __init__(self, RecordDir, Latency=0.0):
+        '''
+        :param RecordDir: 录制目录
+        :param Latency: 每次请求的延迟，秒
+        '''
+        self.RecordDir = RecordDir
+        self.Latency = Latency
+        self._TradeDays = None
+
+    def Replay(self, Method, *Args):
+        if self.Latency:
+            time.sleep(self.Latency)
+        path = RecordingProvider.RecordPath(self.RecordDir, Method, Args)
+        if not os.path.exists(path):
+            raise KeyError("回放数据中没有该请求:" + Method + repr(Args))
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def wset(self, TableName, Options=""):
+        return self.Replay("wset", TableName, Options)
+
+    def wsi(self, Codes, Fields, BeginTime, EndTime, Options=""):
+        return self.Replay("wsi", Codes, Fields, BeginTime, EndTime, Options)
+
+    def wsd(self, Codes, Fields, BeginTime, EndTime, Options=""):
+        return self.Replay("wsd", Codes, Fields, BeginTime, EndTime, Options)
+
+    def tdays(self, BeginTime, EndTime, Options=""):
+        try:
+            return self.Replay("tdays", BeginTime, EndTime, Options)
+        except KeyError:
+            pass
+        BeginDate = pd.Timestamp(BeginTime).date()
+        EndDate = pd.Timestamp(EndTime).date()
+        Times = [x for x in self.RecordedTradeDays() if BeginDate <= pd.Timestamp(x).date() <= EndDate]
+        if not Times:
+            raise KeyError("回放数据中没有该区间的交易日:" + repr((BeginTime, EndTime, Options)))
+        return ProviderResult(Data=[Times], Times=Times)
+
+    def RecordedTradeDays(self):
+        '''
+        录制的全部交易日历合并去重，按日期排序
+        :return: list，元素类型同录制结果的Times
+        '''
+        if self._TradeDays is None:
+            TradeDays = {}
+            Directory = os.path.join(self.RecordDir, "tdays")
+            for x in sorted(os.listdir(Directory)) if os.path.isdir(Directory) else []:
+                if x.endswith(".pkl"):
+                    with open(os.path.join(Directory, x), "rb") as f:
+                        for Day in pickle.load(f).Times or []:
+                            TradeDays.setdefault(pd.Timestamp(Day).date(), Day)
+            self._TradeDays = [TradeDays[x] for x in sorted(TradeDays)]
+        return self._TradeDays
+
+
+def DefaultProvider():
+    '''
+    默认数据接口：设置了环境变量OPTIONALERT_REPLAY_DIR时回放该目录（OPTIONALERT_REPLAY_LATENCY为延迟秒数），
+    设置了OPTIONALERT_RECORD_DIR时请求wind并录制，否则直接请求wind
+    :return: MarketDataProvider
+    '''
+    if os.environ.get("OPTIONALERT_REPLAY_DIR"):
+        return ReplayProvider(os.environ["OPTIONALERT_REPLAY_DIR"],
+                              Latency=float(os.environ.get("OPTIONALERT_REPLAY_LATENCY", 0)))
+    if os.environ.get("OPTIONALERT_RECORD_DIR"):
+        return RecordingProvider(WindProvider(), os.environ["OPTIONALERT_RECORD_DIR"])
+    return WindProvider()
+
+
+class OptionContext:
+    '''
+    运行环境，统一管理数据接口（默认wind）、期权合约数据集和交易日历，OptionContract、OptionMinuteData、OptionPlot等类共用同一个运行环境。
+    *数据接口、合约数据集和交易日历都在第一次使用时才初始化，import本模块不再调用w.start()和w.wset
+    *合约数据集可以直接传入，也可以从快照文件读取（SaveSnapshot生成），进程池子进程、单元测试等无需连接wind
+    *数据接口可替换为ReplayProvider回放录制数据，见DefaultProvider
+    *默认运行环境通过GetContext()获取，SetContext()替换；环境变量OPTIONALERT_CONTRACT_SNAPSHOT可指定默认快照文件
+    *运行环境按标的区分，合约数据集和标的行情都取自self.Underlying；ForUnderlying()生成其他标的的运行环境，
+    与当前环境共用数据接口和交易日历
+    '''
+
+    def __init__(self, ContractSetData=None, SnapshotPath=None, Provider=None, TradeDays=None, Underlying=None,
+                 TradeCalendarIndex=None):
+        '''
+        :param ContractSetData: 期权合约数据集，pd.DataFrame，格式同ContractSet()，不传则第一次使用时加载
+        :param SnapshotPath: 合约数据集快照文件路径，文件存在时优先从快照加载
+        :param Provider: 数据接口MarketDataProvider，不传则第一次使用时由DefaultProvider()创建
+        :param TradeDays: 交易日列表，用于预加载交易日历，不传则第一次使用时向数据接口请求
+        :param Underlying: 标的代码，如"510050.SH"，默认模块变量UnderlyingSecurity
+        :param TradeCalendarIndex: 交易日历索引，传入则与其他运行环境共用，不再重复加载
+        '''
+        self._ContractSetData = ContractSetData
+        self.SnapshotPath = SnapshotPath
+        self._Provider = Provider
+        self.Underlying = UnderlyingSecurity if Underlying is None else Underlying
+        self._TradeCalendarIndex = TradeCalendarIndex
+        self._ContractIndex = None
+        self._TradeDays = TradeDays
+        self._Lock = threading.RLock()
+
+    @property
+    def Provider(self):
+        '''
+        数据接口，默认wind，第一次请求时才连接
+        :return: MarketDataProvider
+        '''
+        if self._Provider is None:
+            with self._Lock:
+                if self._Provider is None:
+                    self._Provider = DefaultProvider()
+        return self._Provider
+
+    @property
+    def ContractSetData(self):
+        '''
+        期权合约数据集，第一次使用时从快照或wind加载
+        :return: pd.DataFrame
+        '''
+        if self._ContractSetData is None:
+            with self._Lock:
+                if self._ContractSetData is None:
+                    if self.SnapshotPath is not None and os.path.exists(self.SnapshotPath):
+                        self._ContractSetData = pd.read_pickle(self.SnapshotPath)
+                    else:
+                        self._ContractSetData = ContractSet(exchange=self.Exchange, windcode=self.Underlying,
+                                                            Provider=self.Provider)
+        return self._ContractSetData
+
+    @property
+    def Exchange(self):
+        '''
+        标的所在交易所，用于请求合约数据集，如"510050.SH"->"sse"，"159919.SZ"->"szse"
+        :return: str
+        '''
+        return "szse" if self.Underlying.upper().endswith(".SZ") else "sse"
+
+    @property
+    def TradeCalendarIndex(self):
+        '''
+        交易日历索引，同一运行环境共用一份
+        :return: TradeCalendarIndex
+        '''
+        if self._TradeCalendarIndex is None:
+            with self._Lock:
+                if self._TradeCalendarIndex is None:
+                    self._TradeCalendarIndex = TradeCalendarIndex(Context=self, TradeDays=self._TradeDays)
+        return self._TradeCalendarIndex
+
+    @property
+    def ContractIndex(self):
+        '''
+        合约数据集的挂牌区间索引，合约数据集Reload后重建
+        :return: ContractIndex
+        '''
+        if self._ContractIndex is None:
+            with self._Lock:
+                if self._ContractIndex is None:
+                    self._ContractIndex = ContractIndex(self.ContractSetData)
+        return self._ContractIndex
+
+    def SaveSnapshot(self, SnapshotPath=None):
+        '''
+        保存合约数据集快照，供其他进程通过SnapshotPath预加载
+        :param SnapshotPath: 默认self.SnapshotPath
+        :return: 快照文件路径
+        '''
+        SnapshotPath = self.SnapshotPath if SnapshotPath is None else SnapshotPath
+        self.ContractSetData.to_pickle(SnapshotPath)
+        return SnapshotPath
+
+    def ForUnderlying(self, Underlying, ContractSetData=None, SnapshotPath=None):
+        '''
+        生成标的Underlying的运行环境，与当前环境共用数据接口和交易日历，合约数据集单独加载
+        :param Underlying: 标的代码，如"510300.SH"
+        :param ContractSetData: 该标的的期权合约数据集，不传则第一次使用时加载
+        :param SnapshotPath: 该标的的合约数据集快照文件路径
+        :return: OptionContext
+        '''
+        if Underlying == self.Underlying and ContractSetData is None and SnapshotPath is None:
+            return self
+        return OptionContext(ContractSetData=ContractSetData, SnapshotPath=SnapshotPath, Provider=self.Provider,
+                             Underlying=Underlying, TradeCalendarIndex=self.TradeCalendarIndex)
+
+    def Reload(self):
+        '''
+        清空已加载的合约数据集，下次使用时重新加载，用于盘中新挂牌合约
+        :return:
+        '''
+        with self._Lock:
+            self._ContractSetData = None
+            self._ContractIndex = None
+
+
+_Context = OptionContext(SnapshotPath=os.environ.get("OPTIONALERT_CONTRACT_SNAPSHOT"))
+
+
+def GetContext():
+    '''
+    返回当前默认运行环境
+    :return: OptionContext
+    '''
+    return _Context
+
+
+def SetContext(Context):
+    '''
+    替换默认运行环境，例如注入测试用合约数据集或子进程从快照初始化
+    :param Context: OptionContext
+    :return:
+    '''
+    global _Context
+    _Context = Context
+
+
+def __getattr__(name):
+    '''
+    兼容原来的全局变量option.ContractSetData，访问时才加载
+    '''
+    if name == "ContractSetData":
+        return GetContext().ContractSetData
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+class ContractSnapshot:
+    '''
+    某一日正挂牌交易的合约，按到期月份、执行价格预先分组，查询垂直、水平、T型合约时直接取字典
+    *ChainGrid为当日期权链网格OptionChainGrid，用于相邻合约查询
+    '''
+
+    def __init__(self, Data):
+        '''
+        :param Data: 当日挂牌合约，pd.DataFrame，行顺序与ContractSetData一致
+        '''
+        self.Data = Data
+        self.WindCodes = frozenset(Data.index)
+        self.ByLimitMonth = {Key: Group for Key, Group in Data.groupby("limit_month", sort=False)}
+        self.ByExercisePrice = {Key: Group for Key, Group in Data.groupby("exercise_price", sort=False)}
+        self._ChainGrid = None
+
+    def __contains__(self, WindCode):
+        return WindCode in self.WindCodes
+
+    @property
+    def ChainGrid(self):
+        '''
+        当日期权链网格，第一次使用时建立
+        :return: OptionChainGrid
+        '''
+        if self._ChainGrid is None:
+            self._ChainGrid = OptionChainGrid(self.Data)
+        return self._ChainGrid
+
+
+class OptionChainGrid:
+    '''
+    某一日的期权链网格，把 到期月份×执行价格×认购认沽 映射为整数合约序号（与Data行号一致），并反向映射。
+    相邻合约存为整数数组，缺失为-1，价差、蝶式、平价等计算直接用数组取值，不需要merge。
+    *StrikeUp、StrikeDown：同一到期月份、同一方向中执行价格相邻的合约（只在该月份实际挂牌的执行价格中找）
+    *NextExpiry、PrevExpiry：同一执行价格、同一方向在相邻到期月份的合约，相邻月份没有该执行价格时为-1
+    *Opposite：同一到期月份、同一执行价格的另一方向合约
+    # Grid = OptionContract.GetChainGridByGivenDate("2019-10-08")
+    # Spread = Price - Grid.Take(Price, Grid.StrikeUp)
+    '''
+
+    Directions = ("认购", "认沽")
+    Neighbours = ("StrikeUp", "StrikeDown", "NextExpiry", "PrevExpiry", "Opposite")
+
+    def __init__(self, Data):
+        '''
+        :param Data: 当日挂牌合约，pd.DataFrame，index为wind_code，含limit_month、exercise_price、call_or_put
+        '''
+        self.Data = Data
+        self.WindCodes = Data.index.to_numpy()
+        self.LimitMonths = np.sort(Data["limit_month"].unique())
+        self.ExercisePrices = np.sort(Data["exercise_price"].unique())
+        self.MonthPosition = np.searchsorted(self.LimitMonths, Data["limit_month"].to_numpy())
+        self.PricePosition = np.searchsorted(self.ExercisePrices, Data["exercise_price"].to_numpy())
+        self.DirectionPosition = np.where(Data["call_or_put"].to_numpy() == self.Directions[0], 0, 1)
+        Shape = (len(self.LimitMonths), len(self.ExercisePrices), len(self.Directions))
+        self.Slots = np.full(Shape, -1, dtype=np.int64)
+        # 同一格子有多个合约时保留第一个
+        Reverse = np.arange(len(Data.index))[::-1]
+        self.Slots[self.MonthPosition[Reverse], self.PricePosition[Reverse], self.DirectionPosition[Reverse]] = Reverse
+        self._Positions = pd.Index(self.WindCodes)
+
+        # 沿执行价格方向，每个位置之后（之前）最近的已挂牌执行价格
+        Present = self.Slots >= 0
+        Strikes = np.arange(Shape[1])[None, :, None]
+        NextPresent = np.minimum.accumulate(np.where(Present, Strikes, Shape[1])[:, ::-1, :], axis=1)[:, ::-1, :]
+        PrevPresent = np.maximum.accumulate(np.where(Present, Strikes, -1), axis=1)
+        NextPresent = np.concatenate([NextPresent, np.full((Shape[0], 1, Shape[2]), Shape[1])], axis=1)
+        PrevPresent = np.concatenate([np.full((Shape[0], 1, Shape[2]), -1), PrevPresent], axis=1)
+        Month, Price, Direction = self.MonthPosition, self.PricePosition, self.DirectionPosition
+        self.StrikeUp = self.SlotAt(Month, NextPresent[Month, Price + 1, Direction], Direction)
+        self.StrikeDown = self.SlotAt(Month, PrevPresent[Month, Price, Direction], Direction)
+        self.NextExpiry = self.SlotAt(Month + 1, Price, Direction)
+        self.PrevExpiry = self.SlotAt(Month - 1, Price, Direction)
+        self.Opposite = self.SlotAt(Month, Price, 1 - Direction)
+
+    def SlotAt(self, Month, Price, Direction):
+        '''
+        按网格位置取合约序号，位置越界或没有合约时为-1
+        :return: np.ndarray，int64
+        '''
+        Month, Price, Direction = np.broadcast_arrays(np.asarray(Month), np.asarray(Price), np.asarray(Direction))
+        Shape = self.Slots.shape
+        Valid = (Month >= 0) & (Month < Shape[0]) & (Price >= 0) & (Price < Shape[1])
+        result = np.full(Month.shape, -1, dtype=np.int64)
+        result[Valid] = self.Slots[Month[Valid], Price[Valid], Direction[Valid]]
+        return result
+
+    def Slot(self, LimitMonth, ExercisePrice, Direction="认购"):
+        '''
+        到期月份、执行价格、方向对应的合约序号，没有该合约时为-1
+        '''
+        Month = int(np.searchsorted(self.LimitMonths, LimitMonth))
+        Price = int(np.searchsorted(self.ExercisePrices, ExercisePrice))
+        if Month >= len(self.LimitMonths) or self.LimitMonths[Month] != LimitMonth or Price >= len(
+                self.ExercisePrices) or self.ExercisePrices[Price] != ExercisePrice:
+            return -1
+        return int(self.Slots[Month, Price, self.Directions.index(Direction)])
+
+    def Position(self, WindCodes):
+        '''
+        wind_code对应的合约序号，当日未挂牌的为-1
+        :param WindCodes: wind_code数组
+        :return: np.ndarray，int64
+        '''
+        return self._Positions.get_indexer(np.atleast_1d(np.asarray(WindCodes, dtype=object)))
+
+    def Take(self, Values, Slots):
+        '''
+        按合约序号取值，序号为-1处为nan
+        :param Values: 与Data行顺序一致的数值数组
+        :param Slots: 合约序号数组，如StrikeUp、Opposite
+        :return: np.ndarray，float64
+        '''
+        Values = np.asarray(Values, dtype=np.float64)
+        Slots = np.asarray(Slots)
+        return np.where(Slots >= 0, Values[np.maximum(Slots, 0)], np.nan)
+
+    def Neighbour(self, WindCodes, Name):
+        '''
+        查询合约的相邻合约
+        :param WindCodes: wind_code数组
+        :param Name: Neighbours之一，如"StrikeUp"
+        :return: np.ndarray，wind_code，没有相邻合约或当日未挂牌的为None
+        '''
+        Positions = self.Position(WindCodes)
+        Slots = np.where(Positions >= 0, getattr(self, Name)[np.maximum(Positions, 0)], -1)
+        return np.where(Slots >= 0, self.WindCodes[np.maximum(Slots, 0)], None)
+
+
+class ContractIndex:
+    '''
+    合约数据集的挂牌区间索引，挂牌日期、摘牌日期存为整数序号数组（datetime.date.toordinal），按挂牌日期排序后用np.searchsorted定位，
+    不再每次查询都strptime并对整个合约数据集做布尔筛选。
+    *某一日的挂牌合约ContractSnapshot按日期缓存，回测中同一交易日重复查询直接返回
+    *通过GetContext().ContractIndex获取，合约数据集Reload后随之重建
+    '''
+
+    def __init__(self, ContractSetData):
+        '''
+        :param ContractSetData: 期权合约数据集，pd.DataFrame，格式同ContractSet()
+        '''
+        self.ContractSetData = ContractSetData
+        ListedOrdinals = TradeCalendarIndex.ToOrdinal(ContractSetData["listed_date"])
+        # 按挂牌日期排序，挂牌日期相同的保持原来的行顺序
+        self.ListedOrder = np.argsort(ListedOrdinals, kind="stable")
+        self.ListedOrdinals = ListedOrdinals[self.ListedOrder]
+        self.ExpireOrdinals = TradeCalendarIndex.ToOrdinal(ContractSetData["expire_date"])[self.ListedOrder]
+        self._Snapshots = {}
+        self._Lock = threading.RLock()
+
+    def ListedPositions(self, Ordinal):
+        '''
+        给定日期正挂牌交易的合约在ContractSetData中的行号，升序
+        :param Ordinal: 日期序号
+        :return: np.ndarray
+        '''
+        Right = np.searchsorted(self.ListedOrdinals, Ordinal, side="right")
+        return np.sort(self.ListedOrder[:Right][self.ExpireOrdinals[:Right] >= Ordinal])
+
+    def Snapshot(self, GivenDate):
+        '''
+        给定日期正挂牌交易的合约
+        :param GivenDate: "%Y-%m-%d"或datetime.date
+        :return: ContractSnapshot
+        '''
+        Ordinal = int(TradeCalendarIndex.ToOrdinal(GivenDate)[0])
+        Snapshot = self._Snapshots.get(Ordinal)
+        if Snapshot is None:
+            with self._Lock:
+                Snapshot = self._Snapshots.get(Ordinal)
+                if Snapshot is None:
+                    Snapshot = ContractSnapshot(self.ContractSetData.iloc[self.ListedPositions(Ordinal)])
+                    self._Snapshots[Ordinal] = Snapshot
+        return Snapshot
+
+    def ListedBetween(self, StartDate, EndDate):
+        '''
+        给定日期之间挂牌的合约（不含起始日期，含终止日期）
+        :param StartDate: "%Y-%m-%d"
+        :param EndDate: "%Y-%m-%d"
+        :return: pd.DataFrame，行顺序与ContractSetData一致
+        '''
+        StartOrdinal, EndOrdinal = TradeCalendarIndex.ToOrdinal([StartDate, EndDate])
+        Left = np.searchsorted(self.ListedOrdinals, StartOrdinal, side="right")
+        Right = np.searchsorted(self.ListedOrdinals, EndOrdinal, side="right")
+        return self.ContractSetData.iloc[np.sort(self.ListedOrder[Left:Right])]
 
 
 class OptionContract:
@@ -53,17 +619,16 @@ class OptionContract:
         :param wind_code:
         :return: 返回期权合约信息，pandas.series
         '''
-        return ContractSetData.loc[wind_code, :]
+        return GetContext().ContractSetData.loc[wind_code, :]
 
     @classmethod
     def GetListedContractOnGivenDate(cls, GivenDate):
         '''
-        返回指定日期正挂牌交易的合约
+        返回指定日期正挂牌交易的合约，由GetContext().ContractIndex按日期缓存，返回结果不要直接修改
         :param GivingDate:给定日期%Y-%m-%d
         :return:返回期权合约数据集，pandas.dataframe
         '''
-        return ContractSetData[(ContractSetData["listed_date"] <= dt.datetime.strptime(GivenDate, "%Y-%m-%d")) & (
-                ContractSetData["expire_date"] >= dt.datetime.strptime(GivenDate, "%Y-%m-%d"))]
+        return GetContext().ContractIndex.Snapshot(GivenDate).Data
 
     @classmethod
     def GetListedContractAfterGivenDate(cls, GivenDate):
@@ -72,6 +637,7 @@ class OptionContract:
         :param GivingDate:给定日期%Y-%m-%d
         :return:返回期权合约数据集，pandas.dataframe
         '''
+        ContractSetData = GetContext().ContractSetData
         return ContractSetData[ContractSetData["listed_date"] >= dt.datetime.strptime(GivenDate, "%Y-%m-%d")]
 
     @classmethod
@@ -84,10 +650,8 @@ class OptionContract:
         :return:返回期权合约数据集，pandas.dataframe
         '''
         ListedContractOnStartDate = cls.GetListedContractOnGivenDate(StartDate)
-        ListedContractInTimeInterval = ContractSetData[
-            (ContractSetData["listed_date"] > dt.datetime.strptime(StartDate, "%Y-%m-%d")) & (
-                    ContractSetData["listed_date"] <= dt.datetime.strptime(EndDate, "%Y-%m-%d"))]
-        return ListedContractOnStartDate.append(ListedContractInTimeInterval)
+        ListedContractInTimeInterval = GetContext().ContractIndex.ListedBetween(StartDate, EndDate)
+        return pd.concat([ListedContractOnStartDate, ListedContractInTimeInterval])
 
     @classmethod
     def GetVerticalContractByGivenDate(cls, wind_code, GivenDate):
@@ -97,12 +661,11 @@ class OptionContract:
         :param GivenDate:例如'2019-04-01'
         :return:
         '''
-        ListedContractOnGivenDate = cls.GetListedContractOnGivenDate(GivenDate)
-        if wind_code in list(ListedContractOnGivenDate.index):
-            # 判断，如果合约在指定日期仍挂牌交易，返回该合约信息ContractInformationOnGivenDate，并基于该信息查询垂直合约列表
-            ContractInformationOnGivenDate = ListedContractOnGivenDate.loc[wind_code, :]
-            ContractLimitMonth = ContractInformationOnGivenDate['limit_month']  # 返回合约到期月份
-            return ListedContractOnGivenDate[ListedContractOnGivenDate['limit_month'] == ContractLimitMonth]
+        Snapshot = GetContext().ContractIndex.Snapshot(GivenDate)
+        if wind_code in Snapshot:
+            # 判断，如果合约在指定日期仍挂牌交易，取其到期月份，直接从按到期月份分组的字典中取垂直合约列表
+            ContractLimitMonth = Snapshot.Data.at[wind_code, 'limit_month']  # 返回合约到期月份
+            return Snapshot.ByLimitMonth[ContractLimitMonth]
         else:
             print("该合约在" + GivenDate + "已经摘牌")
 
@@ -114,15 +677,23 @@ class OptionContract:
         :param GivenDate:例如'2019-04-01'
         :return:
         '''
-        ListedContractOnGivenDate = cls.GetListedContractOnGivenDate(GivenDate)
-        if wind_code in list(ListedContractOnGivenDate.index):
-            # 判断，如果合约在指定日期仍挂牌交易，返回该合约信息ContractInformationOnGivenDate，并基于该信息查询水平合约列表
-            ContractInformationOnGivenDate = ListedContractOnGivenDate.loc[wind_code, :]
-            ContractExercisePrice = ContractInformationOnGivenDate['exercise_price']  # 返回合约执行价格
-            return ListedContractOnGivenDate[ListedContractOnGivenDate['exercise_price'] == ContractExercisePrice]
+        Snapshot = GetContext().ContractIndex.Snapshot(GivenDate)
+        if wind_code in Snapshot:
+            # 判断，如果合约在指定日期仍挂牌交易，取其执行价格，直接从按执行价格分组的字典中取水平合约列表
+            ContractExercisePrice = Snapshot.Data.at[wind_code, 'exercise_price']  # 返回合约执行价格
+            return Snapshot.ByExercisePrice[ContractExercisePrice]
         else:
             print("该合约在" + GivenDate + "已经摘牌")
 
+    @classmethod
+    def GetChainGridByGivenDate(cls, GivenDate):
+        '''
+        返回指定日期的期权链网格，相邻执行价格、相邻到期月份、认购认沽对应合约都以整数数组给出
+        :param GivenDate:例如'2019-04-01'
+        :return: OptionChainGrid
+        '''
+        return GetContext().ContractIndex.Snapshot(GivenDate).ChainGrid
+
     @classmethod
     def GetTTableContractByGivenDate(cls, wind_code, GivenDate):
         '''
@@ -131,16 +702,13 @@ class OptionContract:
         :param GivenDate:
         :return:
         '''
-        ListedContractOnGivenDate = cls.GetListedContractOnGivenDate(GivenDate)
-        if wind_code in list(ListedContractOnGivenDate.index):
-            # 判断，如果合约在指定日期仍挂牌交易，返回该合约信息ContractInformationOnGivenDate，并基于该信息查询T型合约列表
-            ContractInformationOnGivenDate = ListedContractOnGivenDate.loc[wind_code, :]
-            ContractLimitMonth = ContractInformationOnGivenDate['limit_month']  # 返回合约到期月份
-            ListedContractOnGivenDateResult = ListedContractOnGivenDate[
-                ListedContractOnGivenDate['limit_month'] == ContractLimitMonth]
-            ContractExercisePrice = ContractInformationOnGivenDate['exercise_price']  # 返回合约执行价格
-            TempResult = pd.concat([ListedContractOnGivenDateResult, ListedContractOnGivenDate[
-                ListedContractOnGivenDate['exercise_price'] == ContractExercisePrice]])
+        Snapshot = GetContext().ContractIndex.Snapshot(GivenDate)
+        if wind_code in Snapshot:
+            # 判断，如果合约在指定日期仍挂牌交易，合并同到期月份及同执行价格的合约
+            ContractLimitMonth = Snapshot.Data.at[wind_code, 'limit_month']  # 返回合约到期月份
+            ContractExercisePrice = Snapshot.Data.at[wind_code, 'exercise_price']  # 返回合约执行价格
+            TempResult = pd.concat([Snapshot.ByLimitMonth[ContractLimitMonth],
+                                    Snapshot.ByExercisePrice[ContractExercisePrice]])
             return TempResult.drop_duplicates().sort_index()  # 去重并排序
 
 
@@ -150,6 +718,8 @@ class TradeCalendar:
     1-返回起始日期至终止日期的交易日历TradeCalendarStartToEnd
     2-返回给定日期前后一段时间的交易日历
     3-返回起始日期至终止日期的交易日天数
+    4-整列计算年化到期时间TimeToExpiryForArray
+    交易日历由运行环境中的TradeCalendarIndex缓存，只向wind请求一次
     '''
 
     # def __init__(self, StartDate, EndDate):
@@ -193,12 +763,12 @@ class TradeCalendar:
     @classmethod
     def TradeCalendarStartToEnd(cls, StartDate, EndDate):
         '''
-        输入起始日期和终止日期，获取期间交易日历
+        输入起始日期和终止日期，获取期间交易日历，从运行环境中缓存的交易日历索引截取，不再每次调用w.tdays
         :param StartDate:"%Y-%m-%d"
         :param EndDate:"%Y-%m-%d"
         :return:返回日历数据，list格式，每一个元素为datetime.date格式
         '''
-        return w.tdays(StartDate, EndDate, "").Times
+        return GetContext().TradeCalendarIndex.TradeCalendarStartToEnd(StartDate, EndDate)
 
     @classmethod
     def TradeCalendarBeforeToAfter(cls, IntervalDays):
@@ -221,36 +791,17 @@ class TradeCalendar:
         :param EndDate:
         :return:
         '''
-        trade_calendar = cls.TradeCalendarStartToEnd(StartDate, EndDate)
-        StartDateFormat = dt.datetime.strptime(StartDate, "%Y-%m-%d").date()
-        EndDateFormat = dt.datetime.strptime(EndDate, "%Y-%m-%d").date()
-        try:
-            StartDateIndex = trade_calendar.index(StartDateFormat)
-            EndDateIndex = trade_calendar.index(EndDateFormat)
-        except ValueError:
-            for x in trade_calendar:
-                if x >= dt.datetime.strptime(StartDate, "%Y-%m-%d").date():
-                    StartDateIndex = trade_calendar.index(x)
-                    break
-            EndDateIndex = len(trade_calendar) - 1
-        return EndDateIndex - StartDateIndex + 1
+        return cls.TradeDaysCount1(StartDate, EndDate)
 
     @classmethod
     def TradeDaysCount1(cls, StartDate, EndDate):
         '''
-        使用bisect包计算起始日期至终止日期的交易日天数
+        使用交易日历索引（np.searchsorted）计算起始日期至终止日期的交易日天数
         :param StartDate:
         :param EndDate:
         :return:
         '''
-        trade_calendar = cls.TradeCalendarStartToEnd(StartDate, EndDate)
-        StartDateFormat = dt.datetime.strptime(StartDate, "%Y-%m-%d").date()
-        EndDateFormat = dt.datetime.strptime(EndDate, "%Y-%m-%d").date()
-        StartDateIndexLeft = bisect.bisect_left(trade_calendar, StartDateFormat)
-        # StartDateIndexRight = bisect.bisect_right(trade_calendar, StartDateFormat)
-        # EndDateIndexLeft = bisect.bisect_left(trade_calendar, EndDateFormat)
-        EndDateIndexRight = bisect.bisect_right(trade_calendar, EndDateFormat)
-        return EndDateIndexRight - StartDateIndexLeft
+        return int(GetContext().TradeCalendarIndex.TradeDaysCountForArray(StartDate, EndDate)[0])
 
     @classmethod
     def TradeDaysCountForApply(cls, ArrLike, StartDate, EndDate):
@@ -261,36 +812,17 @@ class TradeCalendar:
         :param EndDate:
         :return:
         '''
-        trade_calendar = cls.TradeCalendarStartToEnd(ArrLike[StartDate], ArrLike[EndDate])
-        StartDateFormat = dt.datetime.strptime(ArrLike[StartDate], "%Y-%m-%d").date()
-        EndDateFormat = dt.datetime.strptime(ArrLike[EndDate], "%Y-%m-%d").date()
-        try:
-            StartDateIndex = trade_calendar.index(StartDateFormat)
-            EndDateIndex = trade_calendar.index(EndDateFormat)
-        except ValueError:
-            for x in trade_calendar:
-                if x >= dt.datetime.strptime(ArrLike[StartDate], "%Y-%m-%d").date():
-                    StartDateIndex = trade_calendar.index(x)
-                    break
-            EndDateIndex = len(trade_calendar) - 1
-        return EndDateIndex - StartDateIndex + 1
+        return cls.TradeDaysCount1(ArrLike[StartDate], ArrLike[EndDate])
 
     @classmethod
     def TradeDaysCountForApply1(cls, ArrLike, StartDate, EndDate):
         '''
-        使用bisect包计算起始日期至终止日期的交易日天数
+        使用交易日历索引计算起始日期至终止日期的交易日天数
         :param StartDate:
         :param EndDate:
         :return:
         '''
-        trade_calendar = cls.TradeCalendarStartToEnd(ArrLike[StartDate], ArrLike[EndDate])
-        StartDateFormat = dt.datetime.strptime(ArrLike[StartDate], "%Y-%m-%d").date()
-        EndDateFormat = dt.datetime.strptime(ArrLike[EndDate], "%Y-%m-%d").date()
-        StartDateIndexLeft = bisect.bisect_left(trade_calendar, StartDateFormat)
-        # StartDateIndexRight = bisect.bisect_right(trade_calendar, StartDateFormat)
-        # EndDateIndexLeft = bisect.bisect_left(trade_calendar, EndDateFormat)
-        EndDateIndexRight = bisect.bisect_right(trade_calendar, EndDateFormat)
-        return EndDateIndexRight - StartDateIndexLeft
+        return cls.TradeDaysCount1(ArrLike[StartDate], ArrLike[EndDate])
 
     @classmethod
     def TradeDaysCountAnnualized(cls, StartDate, EndDate):
@@ -313,6 +845,360 @@ class TradeCalendar:
         '''
         return cls.TradeDaysCount1(ArrLike[StartDate], ArrLike[EndDate]) / 252
 
+    @classmethod
+    def TimeToExpiryForArray(cls, StartDateTimes, EndDates, Intraday=False):
+        '''
+        整列计算年化到期时间，见TradeCalendarIndex.TimeToExpiryForArray
+        :param StartDateTimes: 交易时间数组
+        :param EndDates: 到期日数组
+        :param Intraday: 是否扣除当天已经过去的交易时间
+        :return: np.ndarray
+        '''
+        return GetContext().TradeCalendarIndex.TimeToExpiryForArray(StartDateTimes, EndDates, Intraday=Intraday)
+
+
+class TradeCalendarIndex:
+    '''
+    交易日历索引，只向wind请求一次交易日历并缓存在内存中，日期存为整数序号数组（datetime.date.toordinal），
+    区间交易日天数和年化到期时间都用np.searchsorted整列计算，不再每行调用w.tdays。
+    *请求的日期超出已加载区间时自动扩展区间重新加载
+    *通过GetContext().TradeCalendarIndex获取，同一运行环境共用一份
+    '''
+
+    EpochOrdinal = dt.date(1970, 1, 1).toordinal()
+    # 交易时段09:30-11:30、13:00-15:00，用于计算日内剩余时间
+    SessionMinutes = 240
+    MorningOpenMinute = 9 * 60 + 30
+    AfternoonOpenMinute = 13 * 60
+
+    def __init__(self, Context=None, TradeDays=None, StartDate="2015-01-01", EndDate=None):
+        '''
+        :param Context: 运行环境OptionContext，用于获取数据接口，默认GetContext()
+        :param TradeDays: 交易日列表，传入则不需要向wind请求，只在查询超出其范围时才请求
+        :param StartDate: 默认加载区间起始日期，50ETF期权2015年2月上市
+        :param EndDate: 默认加载区间终止日期，默认今天之后400天
+        '''
+        self.Context = Context
+        self.StartDate = StartDate
+        self.EndDate = EndDate
+        self.Ordinals = None
+        self.LoadedStartOrdinal = None
+        self.LoadedEndOrdinal = None
+        self._Lock = threading.RLock()
+        if TradeDays is not None:
+            self.Ordinals = np.array(sorted(x.toordinal() for x in TradeDays), dtype=np.int64)
+            self.LoadedStartOrdinal = int(self.Ordinals[0])
+            self.LoadedEndOrdinal = int(self.Ordinals[-1])
+
+    def Load(self, StartOrdinal, EndOrdinal):
+        '''
+        向wind请求交易日历
+        :param StartOrdinal: 起始日期序号
+        :param EndOrdinal: 终止日期序号
+        :return:
+        '''
+        Context = GetContext() if self.Context is None else self.Context
+        TradeDays = Context.Provider.tdays(dt.date.fromordinal(StartOrdinal).strftime("%Y-%m-%d"),
+                                           dt.date.fromordinal(EndOrdinal).strftime("%Y-%m-%d"), "").Times
+        self.Ordinals = np.array([x.toordinal() for x in TradeDays], dtype=np.int64)
+        self.LoadedStartOrdinal = StartOrdinal
+        self.LoadedEndOrdinal = EndOrdinal
+
+    def IsLoaded(self, StartOrdinal, EndOrdinal):
+        '''
+        判断[StartOrdinal, EndOrdinal]是否在已加载区间内
+        :param StartOrdinal:
+        :param EndOrdinal:
+        :return: bool
+        '''
+        return self.Ordinals is not None and self.LoadedStartOrdinal <= StartOrdinal and \
+               EndOrdinal <= self.LoadedEndOrdinal
+
+    def EnsureRange(self, StartOrdinal, EndOrdinal):
+        '''
+        保证[StartOrdinal, EndOrdinal]在已加载区间内，否则扩展区间重新加载
+        :param StartOrdinal:
+        :param EndOrdinal:
+        :return:
+        '''
+        if self.IsLoaded(StartOrdinal, EndOrdinal):
+            return
+        with self._Lock:
+            if self.IsLoaded(StartOrdinal, EndOrdinal):
+                return
+            DefaultStartOrdinal = dt.datetime.strptime(self.StartDate, "%Y-%m-%d").date().toordinal()
+            if self.EndDate is None:
+                DefaultEndOrdinal = (dt.date.today() + dt.timedelta(days=400)).toordinal()
+            else:
+                DefaultEndOrdinal = dt.datetime.strptime(self.EndDate, "%Y-%m-%d").date().toordinal()
+            if self.Ordinals is not None:
+                DefaultStartOrdinal = min(DefaultStartOrdinal, self.LoadedStartOrdinal)
+                DefaultEndOrdinal = max(DefaultEndOrdinal, self.LoadedEndOrdinal)
+            self.Load(min(StartOrdinal, DefaultStartOrdinal), max(EndOrdinal, DefaultEndOrdinal))
+
+    @classmethod
+    def ToDateTime64(cls, Dates):
+        '''
+        将日期转为np.datetime64数组，支持"%Y-%m-%d"字符串、datetime.date、datetime.datetime、pd.Timestamp及其数组
+        :param Dates:
+        :return: np.ndarray，datetime64
+        '''
+        if isinstance(Dates, (pd.Series, pd.Index)) and pd.api.types.is_datetime64_any_dtype(Dates.dtype):
+            return Dates.to_numpy()
+        return pd.to_datetime(np.atleast_1d(np.asarray(Dates, dtype=object))).to_numpy()
+
+    @classmethod
+    def ToOrdinal(cls, Dates):
+        '''
+        将日期转为整数序号数组，与datetime.date.toordinal一致，空值返回-1
+        :param Dates:
+        :return: np.ndarray，int64
+        '''
+        Values = cls.ToDateTime64(Dates)
+        result = Values.astype("datetime64[D]").astype(np.int64) + cls.EpochOrdinal
+        result[np.isnat(Values)] = -1
+        return result
+
+    def TradeCalendarStartToEnd(self, StartDate, EndDate):
+        '''
+        返回起始日期至终止日期期间交易日历
+        :param StartDate:"%Y-%m-%d"
+        :param EndDate:"%Y-%m-%d"
+        :return:list，每一个元素为datetime.date格式
+        '''
+        StartOrdinal, EndOrdinal = self.ToOrdinal([StartDate, EndDate])
+        self.EnsureRange(StartOrdinal, EndOrdinal)
+        Left = np.searchsorted(self.Ordinals, StartOrdinal, side="left")
+        Right = np.searchsorted(self.Ordinals, EndOrdinal, side="right")
+        return [dt.date.fromordinal(int(x)) for x in self.Ordinals[Left:Right]]
+
+    def TradeDaysCountForArray(self, StartDates, EndDates):
+        '''
+        整列计算起始日期至终止日期期间（首尾均含）的交易日天数，结果同TradeCalendar.TradeDaysCount1
+        :param StartDates: 起始日期数组
+        :param EndDates: 终止日期数组
+        :return: np.ndarray，float64，日期为空的返回nan
+        '''
+        StartOrdinals = self.ToOrdinal(StartDates)
+        EndOrdinals = self.ToOrdinal(EndDates)
+        Valid = (StartOrdinals >= 0) & (EndOrdinals >= 0)
+        if Valid.any():
+            self.EnsureRange(int(StartOrdinals[Valid].min()), int(EndOrdinals[Valid].max()))
+        else:
+            return np.full(np.broadcast(StartOrdinals, EndOrdinals).shape, np.nan)
+        Left = np.searchsorted(self.Ordinals, StartOrdinals, side="left")
+        Right = np.searchsorted(self.Ordinals, EndOrdinals, side="right")
+        return np.where(Valid, Right - Left, np.nan)
+
+    def TimeToExpiryForArray(self, StartDateTimes, EndDates, AnnualDays=252, Intraday=False):
+        '''
+        整列计算年化到期时间（交易日天数/AnnualDays）
+        :param StartDateTimes: 交易时间数组，如分钟数据的datetime字段
+        :param EndDates: 到期日数组，如exercise_date字段
+        :param AnnualDays: 年化天数，默认252
+        :param Intraday: 是否扣除当天已经过去的交易时间，按09:30-11:30、13:00-15:00共240分钟计算；默认False，当天按整天计
+        :return: np.ndarray，float64
+        '''
+        StartDateTimes = self.ToDateTime64(StartDateTimes)
+        result = self.TradeDaysCountForArray(StartDateTimes, EndDates)
+        if Intraday:
+            Minutes = (StartDateTimes - StartDateTimes.astype("datetime64[D]")).astype("timedelta64[m]").astype(
+                np.int64)
+            ElapsedMinutes = np.clip(Minutes - self.MorningOpenMinute, 0, self.SessionMinutes // 2) + np.clip(
+                Minutes - self.AfternoonOpenMinute, 0, self.SessionMinutes // 2)
+            result = result - ElapsedMinutes / self.SessionMinutes
+        return result / AnnualDays
+
+
+# 可选的numba编译内核，安装了numba时OptionGreeksMethod.Backend="numba"可启用，未安装时自动退回numpy向量化实现
+# 内核逐行计算，公式及运算顺序与OptionGreeksMethod中XXXXForArray的numpy实现一致
+NUMBA_AVAILABLE = importlib.util.find_spec("numba") is not None
+if NUMBA_AVAILABLE:
+    import numba
+
+
+def JitKernel(Parallel=False):
+    '''
+    numba可用时编译为nopython内核（除零按numpy规则返回inf/nan），否则原样返回python函数（不会被调用）
+    :param Parallel: 是否对prange循环多线程并行
+    '''
+
+    def Decorator(Function):
+        if NUMBA_AVAILABLE:
+            return numba.njit(parallel=Parallel, cache=True, error_model="numpy")(Function)
+        return Function
+
+    return Decorator
+
+
+if NUMBA_AVAILABLE:
+    prange = numba.prange
+else:
+    prange = range
+
+
+@JitKernel()
+def KernelNormCdf(x):
+    '''
+    标准正态分布函数，与scipy.special.ndtr的算法一致
+    '''
+    y = x * 0.7071067811865476
+    z = abs(y)
+    if z < 0.7071067811865476:
+        return 0.5 + 0.5 * math.erf(y)
+    result = 0.5 * math.erfc(z)
+    if y > 0:
+        result = 1 - result
+    return result
+
+
+@JitKernel()
+def KernelNormPdf(x):
+    '''
+    标准正态分布密度，与scipy.stats.norm.pdf一致
+    '''
+    return math.exp(-x ** 2 / 2.0) / 2.5066282746310002
+
+
+@JitKernel()
+def KernelD1D2(UnderlyingPrice, ExercisePrice, Time, InterestRate, DividendRate, Volatility):
+    '''
+    单行d1、d2，同D1D2ForArray
+    '''
+    dt = Volatility * math.sqrt(Time)
+    d1 = (math.log(UnderlyingPrice / ExercisePrice) + (
+            InterestRate - DividendRate + 0.5 * (Volatility ** 2)) * Time) / dt
+    d2 = d1 - dt
+    return d1, d2, dt
+
+
+@JitKernel(Parallel=True)
+def KernelEuropeanPrice(IsCall, UnderlyingPrice, ExercisePrice, Time, InterestRate, DividendRate, Volatility):
+    '''
+    欧式期权价格内核，同EuropeanPriceForArray，参数均为等长一维数组
+    '''
+    result = np.empty(UnderlyingPrice.shape[0])
+    for i in prange(UnderlyingPrice.shape[0]):
+        d1, d2, dt = KernelD1D2(UnderlyingPrice[i], ExercisePrice[i], Time[i], InterestRate[i], DividendRate[i],
+                                Volatility[i])
+        sign = 1.0 if IsCall[i] else -1.0
+        result[i] = sign * (math.exp(-DividendRate[i] * Time[i]) * UnderlyingPrice[i] * KernelNormCdf(
+            sign * d1) - ExercisePrice[i] * math.exp(-InterestRate[i] * Time[i]) * KernelNormCdf(sign * d2))
+    return result
+
+
+@JitKernel(Parallel=True)
+def KernelImpliedVolatility(IsCall, UnderlyingPrice, ExercisePrice, Time, InterestRate, DividendRate, Target,
+                            Tolerance, MaxIteration, VolatilityLow, VolatilityHigh, StatusCodes):
+    '''
+    隐含波动率内核，同ImpliedVolatilityForArray，逐行做带区间保护的牛顿迭代，各行独立并行
+    :param StatusCodes: (收敛,未收敛,低于下界,高于上界,输入无效)状态码
+    :return: (隐含波动率, 状态)
+    '''
+    Rows = Target.shape[0]
+    Volatility = np.full(Rows, np.nan)
+    Status = np.empty(Rows, dtype=np.int8)
+    for i in prange(Rows):
+        S, K, T, r, q, Price = UnderlyingPrice[i], ExercisePrice[i], Time[i], InterestRate[i], DividendRate[i], \
+                               Target[i]
+        Status[i] = StatusCodes[4]
+        if not (np.isfinite(S) and np.isfinite(K) and np.isfinite(T) and np.isfinite(r) and np.isfinite(
+                q) and np.isfinite(Price) and S > 0 and K > 0 and T > 0):
+            continue
+        # 无套利边界
+        DiscountUnderlying = S * math.exp(-q * T)
+        DiscountExercise = K * math.exp(-r * T)
+        if IsCall[i]:
+            LowerBound = max(DiscountUnderlying - DiscountExercise, 0.0)
+            UpperBound = DiscountUnderlying
+        else:
+            LowerBound = max(DiscountExercise - DiscountUnderlying, 0.0)
+            UpperBound = DiscountExercise
+        if Price <= LowerBound:
+            Volatility[i] = VolatilityLow
+            Status[i] = StatusCodes[2]
+            continue
+        if Price >= UpperBound:
+            Volatility[i] = VolatilityHigh
+            Status[i] = StatusCodes[3]
+            continue
+        Status[i] = StatusCodes[1]
+        # Corrado-Miller初值
+        CallTarget = Price if IsCall[i] else Price + DiscountUnderlying - DiscountExercise
+        Moneyness = DiscountUnderlying - DiscountExercise
+        Temp = CallTarget - Moneyness / 2
+        Sigma = math.sqrt(2 * np.pi) / (DiscountUnderlying + DiscountExercise) * (
+                Temp + math.sqrt(max(Temp ** 2 - Moneyness ** 2 / np.pi, 0.0))) / math.sqrt(T)
+        if not (np.isfinite(Sigma) and Sigma > 0):
+            Sigma = 0.3
+        Sigma = min(max(Sigma, VolatilityLow), VolatilityHigh)
+        Low = VolatilityLow
+        High = VolatilityHigh
+        sign = 1.0 if IsCall[i] else -1.0
+        Converged = False
+        for _ in range(MaxIteration):
+            d1, d2, dt = KernelD1D2(S, K, T, r, q, Sigma)
+            Diff = sign * (DiscountUnderlying * KernelNormCdf(sign * d1) - DiscountExercise * KernelNormCdf(
+                sign * d2)) - Price
+            Vega = DiscountUnderlying * KernelNormPdf(d1) * math.sqrt(T)
+            # 价格关于波动率单调递增，据此收缩区间
+            if Diff > 0:
+                High = Sigma
+            if Diff < 0:
+                Low = Sigma
+            Newton = Sigma - Diff / Vega
+            if Diff == 0 or abs(Newton - Sigma) <= Tolerance or High - Low <= Tolerance:
+                Volatility[i] = Sigma
+                Status[i] = StatusCodes[0]
+                Converged = True
+                break
+            if np.isfinite(Newton) and Low < Newton < High:
+                Sigma = Newton
+            else:
+                Sigma = (Low + High) / 2
+        # 未收敛的行返回最后一次迭代值
+        if not Converged:
+            Volatility[i] = Sigma
+    return Volatility, Status
+
+
+@JitKernel(Parallel=True)
+def KernelGreeks(IsCall, UnderlyingPrice, ExercisePrice, Time, InterestRate, DividendRate, Volatility, Selected):
+    '''
+    希腊字母内核，同GreeksForArray，Selected为长度9的bool数组，依次对应GREEKS_ALL，只计算选中的希腊字母
+    :return: np.ndarray，形状(9,行数)，未选中的行不赋值
+    '''
+    Rows = UnderlyingPrice.shape[0]
+    result = np.empty((9, Rows))
+    for i in prange(Rows):
+        S, K, T, r, Vol = UnderlyingPrice[i], ExercisePrice[i], Time[i], InterestRate[i], Volatility[i]
+        d1, d2, dt = KernelD1D2(S, K, T, r, DividendRate[i], Vol)
+        SqrtTime = math.sqrt(T)
+        nd1_partial = KernelNormPdf(d1)
+        DiscountExercise = K * math.exp(-r * T)
+        nd2 = KernelNormCdf(d2)
+        Vega = S * nd1_partial * SqrtTime
+        if Selected[0]:
+            result[0, i] = KernelNormCdf(d1) - (0.0 if IsCall[i] else 1.0)
+        if Selected[1]:
+            result[1, i] = nd1_partial / (S * dt)
+        if Selected[2]:
+            result[2, i] = Vega
+        if Selected[3]:
+            result[3, i] = -S * nd1_partial * Vol / (2 * SqrtTime) - (1.0 if IsCall[i] else -1.0) * r * \
+                           DiscountExercise * nd2
+        if Selected[4]:
+            result[4, i] = (nd2 if IsCall[i] else nd2 - 1) * DiscountExercise * T
+        if Selected[5]:
+            result[5, i] = Vega * d1 * d2 / Vol
+        if Selected[6]:
+            result[6, i] = -nd1_partial * d2 / Vol
+        if Selected[7]:
+            result[7, i] = -nd1_partial * (2 * r * T - d2 * dt) / (2 * T * dt)
+        if Selected[8]:
+            result[8, i] = Vega * (r * d1 / dt - (1 + d1 * d2) / (2 * T))
+    return result
+
 
 class OptionGreeksMethod:
     '''
@@ -369,9 +1255,52 @@ class OptionGreeksMethod:
     14.2-看涨期权CallVetaValueForApply
     14.3-看跌期权PutVetaValue
     14.4-看跌期权PutVetaValueForApply
+    15-向量化定价，整列一次计算，不再逐行apply
+    15.1-认购认沽标识CallOrPutMaskForArray
+    15.2-d1、d2计算D1D2ForArray
+    15.3-欧式期权价格EuropeanPriceForArray
+    15.4-欧式期权价格EuropeanPriceForDataFrame
+    16-向量化隐含波动率，带区间保护的牛顿法，整列一次求解
+    16.1-隐含波动率ImpliedVolatilityForArray
+    16.2-隐含波动率ImpliedVolatilityForDataFrame
+    17-向量化希腊字母，共用d1、d2等中间量，一次计算任意希腊字母组合
+    17.1-希腊字母GreeksForArray
+    17.2-希腊字母GreeksForDataFrame
+    18-计算后端Backend，"numba"时15.3、16.1、17.1改用numba编译的并行内核KernelXXXX，未安装numba时自动使用numpy实现
+    18.1-是否使用numba内核UseNumba
     其中，XXXXForApply类函数增加了ArrLike参数，用于对pandas.dataframe格式数据使用apply方法；
     不带call或者put说明对看涨或者看跌期权都是一个样子的，不做区分，可以直接用来清洗数据。
     '''
+    # 向量化隐含波动率求解状态
+    IV_STATUS_CONVERGED = 0  # 收敛
+    IV_STATUS_NOT_CONVERGED = 1  # 达到最大迭代次数仍未收敛
+    IV_STATUS_BELOW_LOWER_BOUND = 2  # 价格不高于内在价值，违反无套利下界
+    IV_STATUS_ABOVE_UPPER_BOUND = 3  # 价格不低于无套利上界
+    IV_STATUS_INVALID_INPUT = 4  # 输入含空值或非正的价格、期限
+    # 向量化希腊字母，GREEKS_DEFAULT为ComputeGreeksForListedContract默认计算的希腊字母
+    GREEKS_DEFAULT = ("Delta", "Gamma", "Vega", "Theta", "Rho")
+    GREEKS_ALL = ("Delta", "Gamma", "Vega", "Theta", "Rho", "Vomma", "Vanna", "Charm", "Veta")
+    # 计算后端，"numpy"或"numba"，默认取环境变量OPTIONALERT_BACKEND
+    Backend = os.environ.get("OPTIONALERT_BACKEND", "numpy")
+
+    @classmethod
+    def UseNumba(cls):
+        '''
+        18.1-是否使用numba内核：Backend为"numba"且已安装numba
+        :return: bool
+        '''
+        if cls.Backend not in ("numpy", "numba"):
+            raise ValueError("不支持的计算后端:" + str(cls.Backend))
+        return cls.Backend == "numba" and NUMBA_AVAILABLE
+
+    @classmethod
+    def BroadcastForKernel(cls, IsCall, *Arrays):
+        '''
+        按numpy规则广播参数，并展平为连续的一维数组，供numba内核使用
+        :return: (形状, IsCall, *Arrays)
+        '''
+        Arrays = np.broadcast_arrays(np.asarray(IsCall, dtype=bool), *[np.asarray(x, dtype=np.float64) for x in Arrays])
+        return (Arrays[0].shape,) + tuple(np.ascontiguousarray(x).ravel() for x in Arrays)
 
     @classmethod
     def EuropeanCallPrice(cls, UnderlyingPrice, ExercisePrice, Time, InterestRate, DividendRate, Volatility):
@@ -1542,33 +2471,1028 @@ class OptionGreeksMethod:
                                     ArrLike[DividendRate],
                                     ArrLike[Volatility])
 
+    @classmethod
+    def CallOrPutMaskForArray(cls, Direction):
+        '''
+        15.1-认购认沽标识CallOrPutMaskForArray，将call_or_put字段转为布尔数组，认购为True，认沽为False
+        :param Direction: call_or_put字段，取值"认购"/"认沽"，list/np.ndarray/pd.Series均可
+        :return: np.ndarray，bool
+        '''
+        return np.asarray(Direction) == "认购"
 
-class OptionMinuteData(OptionContract, TradeCalendar, OptionGreeksMethod):
-    '''
-    分钟级交易数据类，通过wind接口导入分钟级行情数据，并做格式化处理
-    1-获取起始日期至终止日期指定合约数据
-    2-获取起始日期至终止日期所有曾挂牌交易过的合约数据
-    3-获取起始日期至终止日期标的ETF交易数据
-    4-匹配现货标的交易数据
-    5-计算greeks，默认计算Delta,Gamma,Vega,Theta,Rho。其余的Vomma,Vanna,Charm,Veta自行修改代码既可。
+    @classmethod
+    def D1D2ForArray(cls, UnderlyingPrice, ExercisePrice, Time, InterestRate, DividendRate, Volatility):
+        '''
+        15.2-向量化计算d1、d2，D1D2ForArray，所有参数均可为标量或等长数组，按numpy规则广播
+        :param UnderlyingPrice:
+        :param ExercisePrice:
+        :param Time:
+        :param InterestRate:
+        :param DividendRate:
+        :param Volatility:
+        :return: (d1, d2, dt)，其中dt=Volatility*sqrt(Time)
+        '''
+        UnderlyingPrice = np.asarray(UnderlyingPrice, dtype=np.float64)
+        ExercisePrice = np.asarray(ExercisePrice, dtype=np.float64)
+        Time = np.asarray(Time, dtype=np.float64)
+        Volatility = np.asarray(Volatility, dtype=np.float64)
+        dt = Volatility * np.sqrt(Time)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            d1 = (np.log(UnderlyingPrice / ExercisePrice) + (
+                    InterestRate - DividendRate + 0.5 * (Volatility ** 2)) * Time) / dt
+        d2 = d1 - dt
+        return d1, d2, dt
+
+    @classmethod
+    def EuropeanPriceForArray(cls, IsCall, UnderlyingPrice, ExercisePrice, Time, InterestRate, DividendRate,
+                              Volatility):
+        '''
+        15.3-向量化欧式期权价格计算EuropeanPriceForArray，一次计算整个期权链，认购认沽通过IsCall区分
+        认购：exp(-qT)*S*N(d1)-K*exp(-rT)*N(d2)
+        认沽：K*exp(-rT)*N(-d2)-exp(-qT)*S*N(-d1)
+        两者统一写成sign*(exp(-qT)*S*N(sign*d1)-K*exp(-rT)*N(sign*d2))，认购sign=1，认沽sign=-1
+        :param IsCall: bool数组，可由CallOrPutMaskForArray生成
+        :param UnderlyingPrice:
+        :param ExercisePrice:
+        :param Time:
+        :param InterestRate:
+        :param DividendRate:
+        :param Volatility:
+        :return: np.ndarray
+        '''
+        if cls.UseNumba():
+            Shape, *Arrays = cls.BroadcastForKernel(IsCall, UnderlyingPrice, ExercisePrice, Time, InterestRate,
+                                                    DividendRate, Volatility)
+            return KernelEuropeanPrice(*Arrays).reshape(Shape)
+        Time = np.asarray(Time, dtype=np.float64)
+        d1, d2, dt = cls.D1D2ForArray(UnderlyingPrice, ExercisePrice, Time, InterestRate, DividendRate, Volatility)
+        sign = np.where(IsCall, 1.0, -1.0)
+        result = sign * (np.exp(-DividendRate * Time) * UnderlyingPrice * ndtr(sign * d1) - ExercisePrice * np.exp(
+            -InterestRate * Time) * ndtr(sign * d2))
+        return result
+
+    @classmethod
+    def EuropeanPriceForDataFrame(cls, DataFrame, Direction, UnderlyingPrice, ExercisePrice, Time, InterestRate,
+                                  DividendRate, Volatility):
+        '''
+        15.4-向量化欧式期权价格计算EuropeanPriceForDataFrame，参数为字段名，用法同XXXXForApply，但不需要apply逐行调用
+        :param DataFrame: pd.DataFrame
+        :param Direction: 认购认沽字段名，如"call_or_put"
+        :param UnderlyingPrice:
+        :param ExercisePrice:
+        :param Time:
+        :param InterestRate:
+        :param DividendRate:
+        :param Volatility:
+        :return: pd.Series，索引与DataFrame一致
+        '''
+        result = cls.EuropeanPriceForArray(cls.CallOrPutMaskForArray(DataFrame[Direction]),
+                                           DataFrame[UnderlyingPrice].to_numpy(dtype=np.float64),
+                                           DataFrame[ExercisePrice].to_numpy(dtype=np.float64),
+                                           DataFrame[Time].to_numpy(dtype=np.float64),
+                                           DataFrame[InterestRate].to_numpy(dtype=np.float64),
+                                           DataFrame[DividendRate].to_numpy(dtype=np.float64),
+                                           DataFrame[Volatility].to_numpy(dtype=np.float64))
+        return pd.Series(result, index=DataFrame.index)
+
+    @classmethod
+    def ImpliedVolatilityForArray(cls, IsCall, UnderlyingPrice, ExercisePrice, Time, InterestRate, DividendRate,
+                                  Target, Tolerance=1e-6, MaxIteration=50, VolatilityLow=0.00001, VolatilityHigh=2,
+                                  ReturnStatus=False):
+        '''
+        16.1-向量化隐含波动率计算ImpliedVolatilityForArray，整列一次求解，替代逐行二分法
+        *初值采用Corrado-Miller近似，认沽期权先按平价关系换算成认购价格再取初值
+        *迭代采用带区间保护的牛顿法：每步用vega做牛顿更新，若更新值跳出当前区间[VolatilityLow,VolatilityHigh]则改为二分
+        *不满足无套利边界的行不参与迭代：低于内在价值（含等于）取VolatilityLow，高于上界（认购exp(-qT)*S，认沽exp(-rT)*K）取VolatilityHigh，
+        与原二分法的结果保持一致，下游仍可用ImpliedVolatility>=0.0001剔除
+        :param IsCall: bool数组，可由CallOrPutMaskForArray生成
+        :param UnderlyingPrice:
+        :param ExercisePrice:
+        :param Time:
+        :param InterestRate:
+        :param DividendRate:
+        :param Target: 期权价格
+        :param Tolerance: 波动率误差容忍度，牛顿步长|(理论价格-Target)/vega|或求解区间宽度不超过Tolerance视为收敛
+        :param MaxIteration: 最大迭代次数
+        :param VolatilityLow: 波动率下限
+        :param VolatilityHigh: 波动率上限
+        :param ReturnStatus: 是否同时返回求解状态
+        :return: 隐含波动率，np.ndarray；ReturnStatus=True时返回(隐含波动率, 状态)，状态取值见IV_STATUS_XXXX
+        '''
+        IsCall, UnderlyingPrice, ExercisePrice, Time, InterestRate, DividendRate, Target = [
+            np.asarray(x, dtype=np.float64) for x in np.broadcast_arrays(
+                IsCall, UnderlyingPrice, ExercisePrice, Time, InterestRate, DividendRate, Target)]
+        IsCall = IsCall.astype(bool)
+        if cls.UseNumba():
+            Shape, *Arrays = cls.BroadcastForKernel(IsCall, UnderlyingPrice, ExercisePrice, Time, InterestRate,
+                                                    DividendRate, Target)
+            StatusCodes = np.array([cls.IV_STATUS_CONVERGED, cls.IV_STATUS_NOT_CONVERGED,
+                                    cls.IV_STATUS_BELOW_LOWER_BOUND, cls.IV_STATUS_ABOVE_UPPER_BOUND,
+                                    cls.IV_STATUS_INVALID_INPUT], dtype=np.int8)
+            Volatility, Status = KernelImpliedVolatility(*Arrays, float(Tolerance), int(MaxIteration),
+                                                         float(VolatilityLow), float(VolatilityHigh), StatusCodes)
+            if ReturnStatus:
+                return Volatility.reshape(Shape), Status.reshape(Shape)
+            return Volatility.reshape(Shape)
+        Volatility = np.full(Target.shape, np.nan)
+        Status = np.full(Target.shape, cls.IV_STATUS_INVALID_INPUT, dtype=np.int8)
+        with np.errstate(invalid="ignore"):
+            Valid = np.isfinite(UnderlyingPrice) & np.isfinite(ExercisePrice) & np.isfinite(Time) & np.isfinite(
+                InterestRate) & np.isfinite(DividendRate) & np.isfinite(Target) & (UnderlyingPrice > 0) & (
+                            ExercisePrice > 0) & (Time > 0)
+        # 无套利边界
+        DiscountUnderlying = UnderlyingPrice * np.exp(-DividendRate * Time)
+        DiscountExercise = ExercisePrice * np.exp(-InterestRate * Time)
+        LowerBound = np.where(IsCall, np.maximum(DiscountUnderlying - DiscountExercise, 0),
+                              np.maximum(DiscountExercise - DiscountUnderlying, 0))
+        UpperBound = np.where(IsCall, DiscountUnderlying, DiscountExercise)
+        BelowLowerBound = Valid & (Target <= LowerBound)
+        AboveUpperBound = Valid & (Target >= UpperBound)
+        Volatility[BelowLowerBound] = VolatilityLow
+        Status[BelowLowerBound] = cls.IV_STATUS_BELOW_LOWER_BOUND
+        Volatility[AboveUpperBound] = VolatilityHigh
+        Status[AboveUpperBound] = cls.IV_STATUS_ABOVE_UPPER_BOUND
+        Index = np.flatnonzero(Valid & ~BelowLowerBound & ~AboveUpperBound)
+        Status[Index] = cls.IV_STATUS_NOT_CONVERGED
+        # Corrado-Miller初值
+        CallTarget = np.where(IsCall[Index], Target[Index],
+                              Target[Index] + DiscountUnderlying[Index] - DiscountExercise[Index])
+        Moneyness = DiscountUnderlying[Index] - DiscountExercise[Index]
+        Temp = CallTarget - Moneyness / 2
+        with np.errstate(invalid="ignore"):
+            Sigma = np.sqrt(2 * np.pi) / (DiscountUnderlying[Index] + DiscountExercise[Index]) * (
+                    Temp + np.sqrt(np.maximum(Temp ** 2 - Moneyness ** 2 / np.pi, 0))) / np.sqrt(Time[Index])
+        Sigma = np.where(np.isfinite(Sigma) & (Sigma > 0), Sigma, 0.3)
+        Sigma = np.clip(Sigma, VolatilityLow, VolatilityHigh)
+        Low = np.full(Index.shape, float(VolatilityLow))
+        High = np.full(Index.shape, float(VolatilityHigh))
+        for _ in range(MaxIteration):
+            if not len(Index):
+                break
+            d1, d2, dt = cls.D1D2ForArray(UnderlyingPrice[Index], ExercisePrice[Index], Time[Index],
+                                          InterestRate[Index], DividendRate[Index], Sigma)
+            sign = np.where(IsCall[Index], 1.0, -1.0)
+            Price = sign * (DiscountUnderlying[Index] * ndtr(sign * d1) - DiscountExercise[Index] * ndtr(sign * d2))
+            Diff = Price - Target[Index]
+            Vega = DiscountUnderlying[Index] * norm.pdf(d1) * np.sqrt(Time[Index])
+            # 价格关于波动率单调递增，据此收缩区间
+            High = np.where(Diff > 0, Sigma, High)
+            Low = np.where(Diff < 0, Sigma, Low)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                Newton = Sigma - Diff / Vega
+            # 牛顿步长（即波动率误差）或区间宽度小于容忍度视为收敛
+            Converged = (Diff == 0) | (np.abs(Newton - Sigma) <= Tolerance) | (High - Low <= Tolerance)
+            Volatility[Index[Converged]] = Sigma[Converged]
+            Status[Index[Converged]] = cls.IV_STATUS_CONVERGED
+            Sigma = np.where(np.isfinite(Newton) & (Newton > Low) & (Newton < High), Newton, (Low + High) / 2)
+            Keep = ~Converged
+            Index, Sigma, Low, High = Index[Keep], Sigma[Keep], Low[Keep], High[Keep]
+        # 未收敛的行返回最后一次迭代值
+        Volatility[Index] = Sigma
+        if ReturnStatus:
+            return Volatility, Status
+        return Volatility
+
+    @classmethod
+    def ImpliedVolatilityForDataFrame(cls, DataFrame, Direction, UnderlyingPrice, ExercisePrice, Time, InterestRate,
+                                      DividendRate, Target, Tolerance=1e-6, MaxIteration=50, ReturnStatus=False):
+        '''
+        16.2-向量化隐含波动率计算ImpliedVolatilityForDataFrame，参数为字段名，用法同ImpliedVolatilityForApply
+        :param DataFrame: pd.DataFrame
+        :param Direction: 认购认沽字段名，如"call_or_put"
+        :param UnderlyingPrice:
+        :param ExercisePrice:
+        :param Time:
+        :param InterestRate:
+        :param DividendRate:
+        :param Target:
+        :param Tolerance: 波动率误差容忍度
+        :param MaxIteration: 最大迭代次数
+        :param ReturnStatus: 是否同时返回求解状态
+        :return: pd.Series；ReturnStatus=True时返回(隐含波动率, 状态)两个pd.Series
+        '''
+        Volatility, Status = cls.ImpliedVolatilityForArray(cls.CallOrPutMaskForArray(DataFrame[Direction]),
+                                                           DataFrame[UnderlyingPrice].to_numpy(dtype=np.float64),
+                                                           DataFrame[ExercisePrice].to_numpy(dtype=np.float64),
+                                                           DataFrame[Time].to_numpy(dtype=np.float64),
+                                                           DataFrame[InterestRate].to_numpy(dtype=np.float64),
+                                                           DataFrame[DividendRate].to_numpy(dtype=np.float64),
+                                                           DataFrame[Target].to_numpy(dtype=np.float64),
+                                                           Tolerance=Tolerance, MaxIteration=MaxIteration,
+                                                           ReturnStatus=True)
+        if ReturnStatus:
+            return pd.Series(Volatility, index=DataFrame.index), pd.Series(Status, index=DataFrame.index)
+        return pd.Series(Volatility, index=DataFrame.index)
+
+    @classmethod
+    def GreeksForArray(cls, IsCall, UnderlyingPrice, ExercisePrice, Time, InterestRate, DividendRate, Volatility,
+                       Greeks=None):
+        '''
+        17.1-向量化希腊字母计算GreeksForArray，d1、d2、N(d1)、N'(d1)等中间量每行只算一次，按需返回任意希腊字母
+        各希腊字母公式与6-14中的Call/PutXXXXValue一致
+        :param IsCall: bool数组，可由CallOrPutMaskForArray生成
+        :param UnderlyingPrice:
+        :param ExercisePrice:
+        :param Time:
+        :param InterestRate:
+        :param DividendRate:
+        :param Volatility:
+        :param Greeks: 需要计算的希腊字母，取自GREEKS_ALL，默认GREEKS_DEFAULT
+        :return: dict，键为希腊字母名称，值为np.ndarray
+        '''
+        if Greeks is None:
+            Greeks = cls.GREEKS_DEFAULT
+        UnknownGreeks = set(Greeks) - set(cls.GREEKS_ALL)
+        if UnknownGreeks:
+            raise ValueError("不支持的希腊字母:" + ",".join(sorted(UnknownGreeks)))
+        if cls.UseNumba():
+            Shape, *Arrays = cls.BroadcastForKernel(IsCall, UnderlyingPrice, ExercisePrice, Time, InterestRate,
+                                                    DividendRate, Volatility)
+            Selected = np.array([x in Greeks for x in cls.GREEKS_ALL])
+            result = KernelGreeks(*Arrays, Selected)
+            return {x: result[cls.GREEKS_ALL.index(x)].reshape(Shape) for x in Greeks}
+        UnderlyingPrice = np.asarray(UnderlyingPrice, dtype=np.float64)
+        ExercisePrice = np.asarray(ExercisePrice, dtype=np.float64)
+        Time = np.asarray(Time, dtype=np.float64)
+        InterestRate = np.asarray(InterestRate, dtype=np.float64)
+        Volatility = np.asarray(Volatility, dtype=np.float64)
+        IsCall = np.asarray(IsCall, dtype=bool)
+        d1, d2, dt = cls.D1D2ForArray(UnderlyingPrice, ExercisePrice, Time, InterestRate, DividendRate, Volatility)
+        SqrtTime = np.sqrt(Time)
+        nd1_partial = norm.pdf(d1)
+        result = {}
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if "Delta" in Greeks:
+                result["Delta"] = ndtr(d1) - np.where(IsCall, 0.0, 1.0)
+            if "Gamma" in Greeks:
+                result["Gamma"] = nd1_partial / (UnderlyingPrice * dt)
+            if "Vega" in Greeks or "Vomma" in Greeks or "Veta" in Greeks:
+                Vega = UnderlyingPrice * nd1_partial * SqrtTime
+                if "Vega" in Greeks:
+                    result["Vega"] = Vega
+                if "Vomma" in Greeks:
+                    result["Vomma"] = Vega * d1 * d2 / Volatility
+                if "Veta" in Greeks:
+                    result["Veta"] = Vega * (InterestRate * d1 / dt - (1 + d1 * d2) / (2 * Time))
+            if "Theta" in Greeks or "Rho" in Greeks:
+                DiscountExercise = ExercisePrice * np.exp(-InterestRate * Time)
+                nd2 = ndtr(d2)
+                if "Theta" in Greeks:
+                    result["Theta"] = -UnderlyingPrice * nd1_partial * Volatility / (2 * SqrtTime) - np.where(
+                        IsCall, 1.0, -1.0) * InterestRate * DiscountExercise * nd2
+                if "Rho" in Greeks:
+                    result["Rho"] = np.where(IsCall, nd2, nd2 - 1) * DiscountExercise * Time
+            if "Vanna" in Greeks:
+                result["Vanna"] = -nd1_partial * d2 / Volatility
+            if "Charm" in Greeks:
+                result["Charm"] = -nd1_partial * (2 * InterestRate * Time - d2 * dt) / (2 * Time * dt)
+        return {x: result[x] for x in Greeks}
+
+    @classmethod
+    def GreeksForDataFrame(cls, DataFrame, Direction, UnderlyingPrice, ExercisePrice, Time, InterestRate,
+                           DividendRate, Volatility, Greeks=None):
+        '''
+        17.2-向量化希腊字母计算GreeksForDataFrame，参数为字段名，用法同XXXXValueForApply
+        :param DataFrame: pd.DataFrame
+        :param Direction: 认购认沽字段名，如"call_or_put"
+        :param UnderlyingPrice:
+        :param ExercisePrice:
+        :param Time:
+        :param InterestRate:
+        :param DividendRate:
+        :param Volatility:
+        :param Greeks: 需要计算的希腊字母，取自GREEKS_ALL，默认GREEKS_DEFAULT
+        :return: pd.DataFrame，每个希腊字母一列，索引与DataFrame一致
+        '''
+        result = cls.GreeksForArray(cls.CallOrPutMaskForArray(DataFrame[Direction]),
+                                    DataFrame[UnderlyingPrice].to_numpy(dtype=np.float64),
+                                    DataFrame[ExercisePrice].to_numpy(dtype=np.float64),
+                                    DataFrame[Time].to_numpy(dtype=np.float64),
+                                    DataFrame[InterestRate].to_numpy(dtype=np.float64),
+                                    DataFrame[DividendRate].to_numpy(dtype=np.float64),
+                                    DataFrame[Volatility].to_numpy(dtype=np.float64),
+                                    Greeks=Greeks)
+        return pd.DataFrame(result, index=DataFrame.index)
+
+
+class ParallelGreeksEngine:
+    '''
+    多进程分片计算隐含波动率和希腊字母，用于全年分钟数据回测
+    *按合约(wind_code)或交易日(trade_date)把行分成若干分片，同一合约/交易日的行落在同一分片，交给进程池计算
+    *数值字段打包成一块共享内存传给子进程，子进程把结果写回另一块共享内存，不再pickle整个DataFrame
+    *结果按原始行顺序还原，与单进程的ComputeGreeksForListedContract完全一致
+    *进程池用spawn方式启动：numba的并行线程层不支持fork，父进程用过numba内核后fork出的子进程会卡死
+    1-分片Shards
+    2-子进程计算ComputeShard
+    3-并行计算Compute
+    '''
+
+    # 共享内存输入块的行顺序
+    INPUT_FIELDS = ("IsCall", "UnderlyingPrice", "ExercisePrice", "Time", "InterestRate", "DividendRate", "Target")
+    SHARD_BY = ("row", "wind_code", "trade_date")
+
+    def __init__(self, Workers=None, ChunkSize=200000, ShardBy="wind_code"):
+        '''
+        :param Workers: 进程数，默认os.cpu_count()
+        :param ChunkSize: 每个分片的目标行数，同一合约/交易日不拆开，分片可能略大于ChunkSize
+        :param ShardBy: 分片依据，"wind_code"按合约，"trade_date"按交易日，"row"按行顺序切块
+        '''
+        if ShardBy not in self.SHARD_BY:
+            raise ValueError("不支持的分片方式:" + str(ShardBy))
+        self.Workers = os.cpu_count() if Workers is None else Workers
+        self.ChunkSize = ChunkSize
+        self.ShardBy = ShardBy
+
+    def Shards(self, DataFrame):
+        '''
+        1-分片，返回(行排列, [(起始位置,终止位置)])，行排列使同一合约/交易日的行相邻
+        :param DataFrame: 格式同ComputeGreeksForListedContract的输入
+        :return: (np.ndarray, list)
+        '''
+        Rows = len(DataFrame.index)
+        if self.ShardBy == "row":
+            Order = np.arange(Rows)
+            Boundaries = np.arange(0, Rows + 1)
+        else:
+            if self.ShardBy == "trade_date":
+                Keys = pd.to_datetime(DataFrame["datetime"]).to_numpy().astype("datetime64[D]")
+            else:
+                Keys = DataFrame["wind_code"].to_numpy()
+            Codes, Inverse = np.unique(Keys, return_inverse=True)
+            Order = np.argsort(Inverse, kind="stable")
+            # 每个合约/交易日组的起始位置，分片只在组边界切开
+            Boundaries = np.concatenate(([0], np.cumsum(np.bincount(Inverse.ravel(), minlength=len(Codes)))))
+        result = []
+        Start = 0
+        while Start < Rows:
+            End = Boundaries[np.searchsorted(Boundaries, Start + self.ChunkSize, side="right") - 1]
+            if End <= Start:
+                End = Boundaries[np.searchsorted(Boundaries, Start, side="right")]
+            result.append((int(Start), int(End)))
+            Start = End
+        return Order, result
+
+    @classmethod
+    def AttachSharedMemory(cls, Name):
+        '''
+        子进程按名字挂载共享内存，不交给resource_tracker管理，由父进程负责释放
+        '''
+        try:
+            return shared_memory.SharedMemory(name=Name, track=False)
+        except TypeError:
+            # python3.13以前没有track参数
+            return shared_memory.SharedMemory(name=Name)
+
+    @classmethod
+    def ComputeShard(cls, InputName, OutputName, Rows, Greeks, Start, End, Tolerance, MaxIteration, Backend):
+        '''
+        2-子进程计算一个分片，从共享内存读取[Start,End)行，结果写回输出共享内存
+        输出块第0行为ImpliedVolatility，其后按Greeks顺序排列
+        :param Backend: 父进程的计算后端OptionGreeksMethod.Backend，spawn出的子进程不继承类属性
+        :return: 分片行数
+        '''
+        OptionGreeksMethod.Backend = Backend
+        InputMemory = cls.AttachSharedMemory(InputName)
+        OutputMemory = cls.AttachSharedMemory(OutputName)
+        try:
+            Input = np.ndarray((len(cls.INPUT_FIELDS), Rows), dtype=np.float64, buffer=InputMemory.buf)
+            Output = np.ndarray((len(Greeks) + 1, Rows), dtype=np.float64, buffer=OutputMemory.buf)
+            IsCall, UnderlyingPrice, ExercisePrice, Time, InterestRate, DividendRate, Target = Input[:, Start:End]
+            IsCall = IsCall.astype(bool)
+            Volatility = OptionGreeksMethod.ImpliedVolatilityForArray(IsCall, UnderlyingPrice, ExercisePrice, Time,
+                                                                      InterestRate, DividendRate, Target,
+                                                                      Tolerance=Tolerance, MaxIteration=MaxIteration)
+            GreeksData = OptionGreeksMethod.GreeksForArray(IsCall, UnderlyingPrice, ExercisePrice, Time, InterestRate,
+                                                           DividendRate, Volatility, Greeks=Greeks)
+            Output[0, Start:End] = Volatility
+            for i, x in enumerate(Greeks):
+                Output[i + 1, Start:End] = GreeksData[x]
+            del Input, Output, IsCall, UnderlyingPrice, ExercisePrice, Time, InterestRate, DividendRate, Target
+        finally:
+            InputMemory.close()
+            OutputMemory.close()
+        return End - Start
+
+    def Compute(self, DataFrame, Greeks=None, Tolerance=1e-6, MaxIteration=50):
+        '''
+        3-并行计算隐含波动率和希腊字母，字段名固定为wind格式，同ComputeGreeksForListedContract
+        :param DataFrame: 格式同ComputeGreeksForListedContract的输入
+        :param Greeks: 需要计算的希腊字母，取自GREEKS_ALL，默认GREEKS_DEFAULT
+        :param Tolerance: 隐含波动率误差容忍度
+        :param MaxIteration: 隐含波动率最大迭代次数
+        :return: pd.DataFrame，ImpliedVolatility及各希腊字母一列，索引与行顺序同DataFrame
+        '''
+        Greeks = OptionGreeksMethod.GREEKS_DEFAULT if Greeks is None else tuple(Greeks)
+        UnknownGreeks = set(Greeks) - set(OptionGreeksMethod.GREEKS_ALL)
+        if UnknownGreeks:
+            raise ValueError("不支持的希腊字母:" + ",".join(sorted(UnknownGreeks)))
+        Rows = len(DataFrame.index)
+        Columns = ["ImpliedVolatility"] + list(Greeks)
+        if Rows == 0:
+            return pd.DataFrame({x: pd.Series(dtype=np.float64) for x in Columns}, index=DataFrame.index)
+        Order, ShardList = self.Shards(DataFrame)
+        InputMemory = shared_memory.SharedMemory(create=True, size=len(self.INPUT_FIELDS) * Rows * 8)
+        OutputMemory = shared_memory.SharedMemory(create=True, size=len(Columns) * Rows * 8)
+        try:
+            Input = np.ndarray((len(self.INPUT_FIELDS), Rows), dtype=np.float64, buffer=InputMemory.buf)
+            Input[0] = OptionGreeksMethod.CallOrPutMaskForArray(DataFrame["call_or_put"])[Order]
+            for i, x in enumerate(["close_etf", "exercise_price", "time_to_exercise", "InterestRate", "DividendRate",
+                                   "close_op"]):
+                Input[i + 1] = DataFrame[x].to_numpy(dtype=np.float64)[Order]
+            with ProcessPoolExecutor(max_workers=self.Workers, mp_context=multiprocessing.get_context("spawn")) as \
+                    Executor:
+                Futures = [Executor.submit(ParallelGreeksEngine.ComputeShard, InputMemory.name, OutputMemory.name,
+                                           Rows, Greeks, Start, End, Tolerance, MaxIteration,
+                                           OptionGreeksMethod.Backend)
+                           for Start, End in ShardList]
+                for x in Futures:
+                    x.result()
+            Output = np.ndarray((len(Columns), Rows), dtype=np.float64, buffer=OutputMemory.buf)
+            # 按分片顺序写回的结果还原为原始行顺序
+            result = np.empty((Rows, len(Columns)), dtype=np.float64)
+            result[Order] = Output.T
+            del Input, Output
+        finally:
+            InputMemory.close()
+            InputMemory.unlink()
+            OutputMemory.close()
+            OutputMemory.unlink()
+        return pd.DataFrame(result, index=DataFrame.index, columns=Columns)
+
+
+class MinuteDataCache:
+    '''
+    分钟级行情本地缓存，按 标的/合约/交易日 分区保存在磁盘上，避免重复调用w.wsi
+    *目录结构：CacheDir/510050.SH/10001827.SH/2019-10-31.parquet，未安装pyarrow/fastparquet时使用pickle格式
+    *只缓存已经收盘的交易日（早于今天），当天数据每次都向wind请求
+    *读取时先按(合约,交易日)检查分区，只向wind请求缺失的分区；连续交易日且缺失合约相同的合并为一次请求
+    *没有成交数据的(合约,交易日)也会写入空分区，避免重复请求
+    *默认不启用：设置环境变量OPTIONALERT_CACHE_DIR，或给OptionMinuteData.MinuteCache赋值后才会写磁盘
+    '''
+
+    SessionStartTime = "09:00:00"
+    SessionEndTime = "15:30:00"
+    # 写入缓存的分钟数据必须包含的字段
+    REQUIRED_COLUMNS = ("windcode", "datetime", "close")
+
+    def __init__(self, CacheDir=None, Underlying=None):
+        '''
+        :param CacheDir: 缓存目录，默认取环境变量OPTIONALERT_CACHE_DIR，未设置时为当前目录下的cache/minute
+        :param Underlying: 标的代码，作为第一级分区，默认None取当前运行环境的标的GetContext().Underlying
+        '''
+        if CacheDir is None:
+            CacheDir = os.environ.get("OPTIONALERT_CACHE_DIR", os.path.join("cache", "minute"))
+        self.CacheDir = CacheDir
+        self.Underlying = Underlying
+        if importlib.util.find_spec("pyarrow") is not None or importlib.util.find_spec("fastparquet") is not None:
+            self.FileFormat = "parquet"
+        else:
+            self.FileFormat = "pickle"
+
+    def PartitionPath(self, WindCode, TradeDate):
+        '''
+        返回(合约,交易日)分区文件路径
+        :param WindCode: 例如"10001827.SH"
+        :param TradeDate: datetime.date
+        :return:
+        '''
+        Underlying = GetContext().Underlying if self.Underlying is None else self.Underlying
+        return os.path.join(self.CacheDir, Underlying, WindCode,
+                            TradeDate.strftime("%Y-%m-%d") + "." + self.FileFormat)
+
+    def ReadPartition(self, WindCode, TradeDate):
+        '''
+        读取分区，不存在时返回None
+        :param WindCode:
+        :param TradeDate:
+        :return: pd.DataFrame或None
+        '''
+        path = self.PartitionPath(WindCode, TradeDate)
+        if not os.path.exists(path):
+            return None
+        if self.FileFormat == "parquet":
+            return pd.read_parquet(path)
+        return pd.read_pickle(path)
+
+    def WritePartition(self, WindCode, TradeDate, Data):
+        '''
+        写入分区，先写临时文件再替换，避免进程中断留下半个文件
+        :param WindCode:
+        :param TradeDate:
+        :param Data: pd.DataFrame，不含date、time字段
+        :return:
+        '''
+        path = self.PartitionPath(WindCode, TradeDate)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        TempPath = path + ".tmp"
+        if self.FileFormat == "parquet":
+            Data.to_parquet(TempPath, index=False)
+        else:
+            Data.to_pickle(TempPath)
+        os.replace(TempPath, path)
+
+    def Load(self, WindCodeList, StartDateTime, EndDateTime, Fetcher):
+        '''
+        读取起始时间至终止时间的分钟数据，缺失的分区通过Fetcher向wind请求并写入缓存
+        :param WindCodeList: 合约代码列表
+        :param StartDateTime: %Y-%m-%d %H:%M:%S
+        :param EndDateTime: %Y-%m-%d %H:%M:%S
+        :param Fetcher: 函数Fetcher(WindCode, StartDateTime, EndDateTime)，WindCode为逗号连接的合约代码，
+                        返回含windcode、datetime、date、time字段的pd.DataFrame，如GetRawDataForGivenContractFromWind；
+                        也可以返回逐块生成pd.DataFrame的生成器，如MinuteFetchPlanner.Stream，每块到达后立即拆分写入分区
+        :return: pd.DataFrame，格式同Fetcher的返回值
+        '''
+        StartDate = StartDateTime.split(" ")[0]
+        EndDate = EndDateTime.split(" ")[0]
+        TradeDays = TradeCalendar.TradeCalendarStartToEnd(StartDate, EndDate)
+        Today = dt.date.today()
+        Partitions = []
+        MissingCodeByDay = {}
+        for TradeDate in TradeDays:
+            for WindCode in WindCodeList:
+                Partition = self.ReadPartition(WindCode, TradeDate) if TradeDate < Today else None
+                if Partition is None:
+                    MissingCodeByDay.setdefault(TradeDate, []).append(WindCode)
+                else:
+                    Partitions.append(Partition)
+        # 连续交易日缺失合约相同的合并成一次请求
+        Batches = []
+        for i, TradeDate in enumerate(TradeDays):
+            if TradeDate not in MissingCodeByDay:
+                continue
+            if Batches and Batches[-1][1][-1] == TradeDays[i - 1] and Batches[-1][0] == MissingCodeByDay[TradeDate]:
+                Batches[-1][1].append(TradeDate)
+            else:
+                Batches.append((MissingCodeByDay[TradeDate], [TradeDate]))
+        for WindCodeBatch, TradeDateBatch in Batches:
+            FetchedFrames = Fetcher(",".join(WindCodeBatch),
+                                    TradeDateBatch[0].strftime("%Y-%m-%d") + " " + self.SessionStartTime,
+                                    TradeDateBatch[-1].strftime("%Y-%m-%d") + " " + self.SessionEndTime)
+            if isinstance(FetchedFrames, pd.DataFrame):
+                FetchedFrames = [FetchedFrames]
+            Pending = {(WindCode, TradeDate) for TradeDate in TradeDateBatch for WindCode in WindCodeBatch}
+            EmptyPartition = None
+            for FetchedData in FetchedFrames:
+                if not set(self.REQUIRED_COLUMNS).issubset(FetchedData.columns):
+                    # 字段不全（如错误信息OUTMESSAGE）的结果不写入缓存，避免缺失分区被永久记为空
+                    continue
+                FetchedData = FetchedData.drop(columns=["date", "time"])
+                EmptyPartition = FetchedData.iloc[:0].reset_index(drop=True)
+                if not len(FetchedData.index):
+                    continue
+                for (WindCode, TradeDate), Partition in FetchedData.groupby(
+                        [FetchedData["windcode"], FetchedData["datetime"].dt.date], sort=False):
+                    if (WindCode, TradeDate) not in Pending:
+                        continue
+                    Pending.discard((WindCode, TradeDate))
+                    Partition = Partition.reset_index(drop=True)
+                    if TradeDate < Today:
+                        self.WritePartition(WindCode, TradeDate, Partition)
+                    Partitions.append(Partition)
+            # 没有成交数据的(合约,交易日)写入空分区
+            for WindCode, TradeDate in Pending:
+                if EmptyPartition is not None and TradeDate < Today:
+                    self.WritePartition(WindCode, TradeDate, EmptyPartition)
+        Partitions = [x for x in Partitions if len(x.index)]
+        if not Partitions:
+            return pd.DataFrame(columns=["windcode", "datetime", "date", "time"])
+        result = pd.concat(Partitions, ignore_index=True)
+        result = result[(result["datetime"] >= pd.Timestamp(StartDateTime)) & (
+                result["datetime"] <= pd.Timestamp(EndDateTime))]
+        result = result.sort_values(["datetime", "windcode"], kind="mergesort").reset_index(drop=True)
+        result['date'] = result['datetime'].dt.date
+        result['time'] = result['datetime'].dt.time
+        return result
+
+
+class GreeksResultCache:
+    '''
+    隐含波动率及希腊字母计算结果缓存，按 合约×交易日 分区，以输入内容的哈希为键，相同输入直接取结果不再计算
+    *键由 认购认沽、标的价格、执行价格、到期时间、利率、分红率、期权价格、希腊字母列表及定价代码版本 计算，与合约代码无关
+    *目录结构：CacheDir/<定价代码版本>/ab/abcdef....bin（float64按行连续存放，不带文件头），定价代码（OptionGreeksMethod及numba内核）改动后版本变化，
+     旧版本目录在第一次使用时删除
+    *磁盘按最近使用时间淘汰，总大小超过MaxBytes时删除最久未用的分区；进程内另保留最近MemoryEntries个分区
+    *通过OptionMinuteData.GreeksCache启用，ComputeGreeksForListedContract自动使用
+    '''
+
+    ModelVersion = "1"
+    # 版本目录的标记文件，Initialize只删除带此标记的旧版本目录
+    VERSION_MARKER = ".greeks-cache-version"
+    INPUT_FIELDS = ("close_etf", "exercise_price", "time_to_exercise", "InterestRate", "DividendRate", "close_op")
+    _PricingVersion = None
+
+    def __init__(self, CacheDir=None, MaxBytes=2 * 1024 ** 3, MemoryEntries=4096):
+        '''
+        :param CacheDir: 缓存目录，默认取环境变量OPTIONALERT_GREEKS_CACHE_DIR，未设置时为当前目录下的cache/greeks
+        :param MaxBytes: 磁盘缓存上限，字节
+        :param MemoryEntries: 进程内缓存的分区个数
+        '''
+        if CacheDir is None:
+            CacheDir = os.environ.get("OPTIONALERT_GREEKS_CACHE_DIR", os.path.join("cache", "greeks"))
+        self.CacheDir = CacheDir
+        self.MaxBytes = MaxBytes
+        self.MemoryEntries = MemoryEntries
+        self._Memory = OrderedDict()
+        self._Bytes = None
+        self._Lock = threading.RLock()
+
+    def __getstate__(self):
+        '''
+        传给子进程时只传目录和上限，进程内缓存和锁在子进程中重建
+        '''
+        return {"CacheDir": self.CacheDir, "MaxBytes": self.MaxBytes, "MemoryEntries": self.MemoryEntries}
+
+    def __setstate__(self, State):
+        self.__init__(**State)
+
+    @classmethod
+    def PricingVersion(cls):
+        '''
+        定价代码版本，由ModelVersion及定价代码源码计算，源码不可读时只用ModelVersion
+        :return: str
+        '''
+        if cls._PricingVersion is None:
+            Source = cls.ModelVersion
+            try:
+                Source += "".join(inspect.getsource(x) for x in (
+                    OptionGreeksMethod, KernelNormCdf, KernelNormPdf, KernelD1D2, KernelEuropeanPrice,
+                    KernelImpliedVolatility, KernelGreeks))
+            except (OSError, TypeError):
+                pass
+            cls._PricingVersion = hashlib.sha1(Source.encode("utf-8")).hexdigest()[:16]
+        return cls._PricingVersion
+
+    @property
+    def VersionDir(self):
+        return os.path.join(self.CacheDir, self.PricingVersion())
+
+    def PartitionPath(self, Key):
+        return os.path.join(self.VersionDir, Key[:2], Key + ".bin")
+
+    def Initialize(self):
+        '''
+        第一次使用时删除旧版本目录，并统计当前版本的磁盘占用
+        *版本目录内写入标记文件VERSION_MARKER，只删除带标记的目录，CacheDir下的其他目录（如分钟行情缓存、断点）不受影响
+        '''
+        with self._Lock:
+            if self._Bytes is not None:
+                return
+            os.makedirs(self.VersionDir, exist_ok=True)
+            with open(os.path.join(self.VersionDir, self.VERSION_MARKER), "w") as f:
+                f.write(self.PricingVersion())
+            for x in os.listdir(self.CacheDir):
+                path = os.path.join(self.CacheDir, x)
+                if x != self.PricingVersion() and os.path.isfile(os.path.join(path, self.VERSION_MARKER)):
+                    shutil.rmtree(path, ignore_errors=True)
+            self._Bytes = sum(os.path.getsize(x) for x, _ in self.ListPartitions())
+
+    def ListPartitions(self):
+        '''
+        当前版本的所有分区文件
+        :return: list，元素为(路径, 最近使用时间)
+        '''
+        result = []
+        if not os.path.isdir(self.VersionDir):
+            return result
+        for Root, Dirs, Files in os.walk(self.VersionDir):
+            for x in Files:
+                if x.endswith(".bin"):
+                    path = os.path.join(Root, x)
+                    result.append((path, os.path.getmtime(path)))
+        return result
+
+    def Read(self, Key):
+        '''
+        读取分区，不存在时返回None；读到时更新最近使用时间
+        :return: np.ndarray，一维，按行展开
+        '''
+        with self._Lock:
+            if Key in self._Memory:
+                self._Memory.move_to_end(Key)
+                return self._Memory[Key]
+        path = self.PartitionPath(Key)
+        try:
+            Values = np.fromfile(path, dtype=np.float64)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        self.Remember(Key, Values)
+        return Values
+
+    def Remember(self, Key, Values):
+        with self._Lock:
+            self._Memory[Key] = Values
+            self._Memory.move_to_end(Key)
+            while len(self._Memory) > self.MemoryEntries:
+                self._Memory.popitem(last=False)
+
+    def Write(self, Key, Values):
+        '''
+        写入分区，先写临时文件再替换；超过MaxBytes时淘汰
+        '''
+        self.Remember(Key, Values)
+        path = self.PartitionPath(Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        TempPath = path + ".{}.tmp".format(threading.get_ident())
+        Values.tofile(TempPath)
+        os.replace(TempPath, path)
+        with self._Lock:
+            self._Bytes += os.path.getsize(path)
+            if self._Bytes > self.MaxBytes:
+                self.Evict()
+
+    def Evict(self):
+        '''
+        按最近使用时间删除分区，直到磁盘占用不超过MaxBytes的90%
+        '''
+        with self._Lock:
+            Partitions = sorted(self.ListPartitions(), key=lambda x: x[1])
+            self._Bytes = sum(os.path.getsize(x) for x, _ in Partitions)
+            for path, _ in Partitions:
+                if self._Bytes <= self.MaxBytes * 0.9:
+                    break
+                Size = os.path.getsize(path)
+                os.remove(path)
+                self._Bytes -= Size
+
+    def Keys(self, DataFrame, Greeks):
+        '''
+        按 合约×交易日 分区计算键
+        :return: (Order, Bounds, Keys)，Order为按分区排序的行位置，第i个分区为Order[Bounds[i]:Bounds[i+1]]
+        '''
+        Codes = pd.factorize(DataFrame["windcode_op"])[0]
+        Days = TradeCalendarIndex.ToDateTime64(DataFrame["datetime"]).astype("datetime64[D]").astype(np.int64)
+        Order = np.lexsort((Days, Codes))
+        Inputs = np.column_stack([OptionGreeksMethod.CallOrPutMaskForArray(DataFrame["call_or_put"]).astype(
+            np.float64)] + [DataFrame[x].to_numpy(dtype=np.float64) for x in self.INPUT_FIELDS])[Order]
+        Bounds = np.r_[0, np.flatnonzero((np.diff(Codes[Order]) != 0) | (np.diff(Days[Order]) != 0)) + 1,
+                       len(Order)]
+        Prefix = (self.PricingVersion() + "|" + ",".join(Greeks) + "|").encode("utf-8")
+        Keys = [hashlib.blake2b(Prefix + Inputs[Bounds[i]:Bounds[i + 1]].tobytes(), digest_size=16).hexdigest()
+                for i in range(len(Bounds) - 1)]
+        return Order, Bounds, Keys
+
+    def Compute(self, DataFrame, Greeks, Function):
+        '''
+        取缓存中已有的分区，其余分区一次交给Function计算后写入缓存
+        :param DataFrame: 格式同ComputeGreeksForListedContract的输入
+        :param Greeks: 希腊字母列表
+        :param Function: Function(pd.DataFrame)，返回ImpliedVolatility及各希腊字母字段，索引与输入一致
+        :return: pd.DataFrame，索引与DataFrame一致
+        '''
+        Greeks = OptionGreeksMethod.GREEKS_DEFAULT if Greeks is None else tuple(Greeks)
+        Columns = ["ImpliedVolatility"] + list(Greeks)
+        if not len(DataFrame.index):
+            return Function(DataFrame)
+        self.Initialize()
+        Order, Bounds, Keys = self.Keys(DataFrame, Greeks)
+        Sorted = np.empty((len(Order), len(Columns)), dtype=np.float64)
+        Missing = []
+        for i, Key in enumerate(Keys):
+            Values = self.Read(Key)
+            if Values is None or len(Values) != (Bounds[i + 1] - Bounds[i]) * len(Columns):
+                Missing.append(i)
+            else:
+                Sorted[Bounds[i]:Bounds[i + 1]] = Values.reshape(-1, len(Columns))
+        if Missing:
+            if len(Missing) == len(Keys):
+                # 全部缺失时不再按行取子集
+                Rows = np.arange(len(Order))
+                Computed = Function(DataFrame)[Columns].to_numpy(dtype=np.float64)[Order]
+            else:
+                Rows = np.concatenate([np.arange(Bounds[i], Bounds[i + 1]) for i in Missing])
+                Computed = Function(DataFrame.iloc[Order[Rows]])[Columns].to_numpy(dtype=np.float64)
+            Sorted[Rows] = Computed
+            Start = 0
+            for i in Missing:
+                End = Start + Bounds[i + 1] - Bounds[i]
+                self.Write(Keys[i], np.ascontiguousarray(Computed[Start:End]).ravel())
+                Start = End
+        result = np.empty_like(Sorted)
+        result[Order] = Sorted
+        return pd.DataFrame(result, index=DataFrame.index, columns=Columns)
+
+
+class MinuteFetchPlanner:
+    '''
+    分钟行情分块并发请求，避免一次w.wsi请求所有合约导致超时、超出单次请求数据量限制
+    *按 合约批次×交易日区间 切成若干块，每块单独请求，块大小由BatchSize、DaysPerChunk控制
+    *各块在有界线程池中并发请求，网络、IO等临时错误（见IsTransient）按指数退避重试，重试Retry次后仍失败则抛出最后一次的异常；
+     参数错误、回放数据缺失等必然重复出现的错误不重试，直接抛出
+    *Iterate按完成顺序逐块返回结果，Stream只返回各块数据，MinuteDataCache.Load逐块写入分区，不拼接整段数据；
+     Fetch把各块结果拼接并按datetime、windcode排序
+    1-切块Plan
+    2-请求单块FetchChunk
+    3-逐块返回Iterate
+    4-拼接结果Fetch
+    5-逐块返回数据Stream
+    '''
+
+    # 可以重试的wind错误码，如网络超时，其余错误码重试也不会成功
+    TRANSIENT_ERROR_CODES = frozenset([-40521010])
+
+    SessionStartTime = "09:00:00"
+    SessionEndTime = "15:30:00"
+
+    def __init__(self, BatchSize=40, DaysPerChunk=5, Workers=4, Retry=3, Backoff=1.0):
+        '''
+        :param BatchSize: 每块合约数
+        :param DaysPerChunk: 每块交易日数
+        :param Workers: 并发请求数，1为逐块顺序请求
+        :param Retry: 每块失败后的重试次数
+        :param Backoff: 首次重试前等待秒数，之后每次加倍
+        '''
+        self.BatchSize = BatchSize
+        self.DaysPerChunk = DaysPerChunk
+        self.Workers = Workers
+        self.Retry = Retry
+        self.Backoff = Backoff
+
+    def Plan(self, WindCodeList, StartDateTime, EndDateTime):
+        '''
+        1-切块，首块从StartDateTime开始，末块到EndDateTime结束，中间按整个交易时段请求
+        :param WindCodeList: 合约代码列表
+        :param StartDateTime: %Y-%m-%d %H:%M:%S
+        :param EndDateTime: %Y-%m-%d %H:%M:%S
+        :return: [(逗号连接的合约代码, 起始时间, 终止时间)]
+        '''
+        TradeDays = TradeCalendar.TradeCalendarStartToEnd(StartDateTime.split(" ")[0], EndDateTime.split(" ")[0])
+        result = []
+        for i in range(0, len(TradeDays), self.DaysPerChunk):
+            TradeDateBatch = TradeDays[i:i + self.DaysPerChunk]
+            ChunkStart = TradeDateBatch[0].strftime("%Y-%m-%d") + " " + self.SessionStartTime
+            ChunkEnd = TradeDateBatch[-1].strftime("%Y-%m-%d") + " " + self.SessionEndTime
+            ChunkStart = max(ChunkStart, StartDateTime)
+            ChunkEnd = min(ChunkEnd, EndDateTime)
+            for j in range(0, len(WindCodeList), self.BatchSize):
+                result.append((",".join(WindCodeList[j:j + self.BatchSize]), ChunkStart, ChunkEnd))
+        return result
+
+    def FetchChunk(self, Fetcher, Chunk):
+        '''
+        2-请求单块，失败时按指数退避重试
+        :param Fetcher: 函数Fetcher(WindCode, StartDateTime, EndDateTime)，如GetRawDataForGivenContractFromWind
+        :param Chunk: Plan返回的一块
+        :return: pd.DataFrame
+        '''
+        for Attempt in range(self.Retry + 1):
+            try:
+                return Fetcher(*Chunk)
+            except Exception as Error:
+                if Attempt == self.Retry or not self.IsTransient(Error):
+                    raise
+                time.sleep(self.Backoff * 2 ** Attempt)
+
+    @classmethod
+    def IsTransient(cls, Error):
+        '''
+        2.1-是否为可以重试的临时错误：网络、IO错误（OSError及其子类TimeoutError、ConnectionError），
+        或错误码在TRANSIENT_ERROR_CODES中的ProviderError
+        :param Error: 异常
+        :return: bool
+        '''
+        if isinstance(Error, ProviderError):
+            return Error.ErrorCode in cls.TRANSIENT_ERROR_CODES
+        return isinstance(Error, OSError)
+
+    def Iterate(self, WindCodeList, StartDateTime, EndDateTime, Fetcher):
+        '''
+        3-并发请求各块，按完成顺序逐块返回，调用方可以边请求边处理
+        :param WindCodeList: 合约代码列表
+        :param StartDateTime: %Y-%m-%d %H:%M:%S
+        :param EndDateTime: %Y-%m-%d %H:%M:%S
+        :param Fetcher: 函数Fetcher(WindCode, StartDateTime, EndDateTime)
+        :return: 生成器，每次返回(块, pd.DataFrame)
+        '''
+        Chunks = self.Plan(WindCodeList, StartDateTime, EndDateTime)
+        if self.Workers <= 1 or len(Chunks) <= 1:
+            for Chunk in Chunks:
+                yield Chunk, self.FetchChunk(Fetcher, Chunk)
+            return
+        with ThreadPoolExecutor(max_workers=self.Workers) as Executor:
+            Futures = {Executor.submit(self.FetchChunk, Fetcher, Chunk): Chunk for Chunk in Chunks}
+            try:
+                for Future in as_completed(Futures):
+                    yield Futures[Future], Future.result()
+            finally:
+                # 出错或调用方提前结束时取消尚未开始的请求
+                for Future in Futures:
+                    Future.cancel()
+
+    def Fetch(self, WindCodeList, StartDateTime, EndDateTime, Fetcher):
+        '''
+        4-请求所有块并拼接结果
+        :param WindCodeList: 合约代码列表
+        :param StartDateTime: %Y-%m-%d %H:%M:%S
+        :param EndDateTime: %Y-%m-%d %H:%M:%S
+        :param Fetcher: 函数Fetcher(WindCode, StartDateTime, EndDateTime)
+        :return: pd.DataFrame，格式同Fetcher的返回值，按datetime、windcode排序
+        '''
+        Partitions = [Data for Chunk, Data in self.Iterate(WindCodeList, StartDateTime, EndDateTime, Fetcher)
+                      if len(Data.index)]
+        if not Partitions:
+            return pd.DataFrame(columns=["windcode", "datetime", "date", "time"])
+        result = pd.concat(Partitions, ignore_index=True)
+        return result.sort_values(["datetime", "windcode"], kind="mergesort").reset_index(drop=True)
+
+    def Stream(self, WindCodeList, StartDateTime, EndDateTime, Fetcher):
+        '''
+        5-按完成顺序逐块返回数据，不拼接，供MinuteDataCache.Load逐块写入分区
+        :param WindCodeList: 合约代码列表，也可以是逗号连接的合约代码
+        :param StartDateTime: %Y-%m-%d %H:%M:%S
+        :param EndDateTime: %Y-%m-%d %H:%M:%S
+        :param Fetcher: 函数Fetcher(WindCode, StartDateTime, EndDateTime)
+        :return: 生成器，每次返回一块pd.DataFrame
+        '''
+        if isinstance(WindCodeList, str):
+            WindCodeList = WindCodeList.split(",")
+        for Chunk, Data in self.Iterate(WindCodeList, StartDateTime, EndDateTime, Fetcher):
+            yield Data
+
+
+class OptionMinuteData(OptionContract, TradeCalendar, OptionGreeksMethod):
+    '''
+    分钟级交易数据类，通过wind接口导入分钟级行情数据，并做格式化处理
+    1-获取起始日期至终止日期指定合约数据
+    2-获取起始日期至终止日期所有曾挂牌交易过的合约数据
+    3-获取起始日期至终止日期标的ETF交易数据
+    4-匹配现货标的交易数据
+    5-计算greeks，默认计算Delta,Gamma,Vega,Theta,Rho。其余的Vomma,Vanna,Charm,Veta通过Greeks参数指定既可。
+    6-数据量大时ComputeGreeksForListedContract可按合约或交易日分片多进程计算，进程数见GreeksWorkers
+    7-压缩模式：CompactMode为True时4-匹配现货标的交易数据返回CompactDataFrame压缩后的数据，合约属性按contract_key取回
     '''
 
+    # 分钟行情本地缓存，设置环境变量OPTIONALERT_CACHE_DIR时启用，也可以直接赋值MinuteDataCache(CacheDir)；为None则每次都直接请求wind
+    MinuteCache = MinuteDataCache() if os.environ.get("OPTIONALERT_CACHE_DIR") else None
+    # 多合约分钟行情分块并发请求，设为None则所有合约合并为一次w.wsi请求
+    FetchPlanner = MinuteFetchPlanner()
+    # ComputeGreeksForListedContract的并行参数，GreeksWorkers为1时单进程计算
+    GreeksWorkers = int(os.environ.get("OPTIONALERT_GREEKS_WORKERS", "1"))
+    GreeksChunkSize = 200000
+    GreeksShardBy = "wind_code"
+    # 隐含波动率及希腊字母计算结果缓存，设置环境变量OPTIONALERT_GREEKS_CACHE_DIR时启用，设为None则每次都重新计算
+    GreeksCache = GreeksResultCache() if os.environ.get("OPTIONALERT_GREEKS_CACHE_DIR") else None
+    # 压缩模式，见CompactDataFrame
+    CompactMode = os.environ.get("OPTIONALERT_COMPACT", "0") == "1"
+    CompactContractColumns = ("limit_month", "exercise_price", "call_or_put", "exercise_date")
+    CompactDropColumns = ("date", "time", "date_op", "time_op", "date_etf", "time_etf", "StartDate")
+    # 压缩模式下的整数字段（wind返回的字段名为amount、position），成交量、持仓量用int32，成交额可能超出int32范围，用int64
+    CompactIntegerColumns = {"volume": np.int32, "amt": np.int64, "amount": np.int64, "oi": np.int32,
+                             "position": np.int32}
+
     # OptionContract.ContractSet()[OptionContract.ContractSet()['contract_state'] == "上市"].index
     # OptionContractMinuteData.DateInterVal(365).TradeCalendarData
     @classmethod
     def GetRawDataForGivenContract(cls, WindCode, StartDateTime, EndDateTime):
         '''
         1-获取起始日期至终止日期指定合约数据
+        MinuteCache不为None时先读本地缓存，只向wind请求缺失的(合约,交易日)分区；设为None则直接请求wind
+        FetchPlanner不为None时，向wind的请求按 合约批次×交易日区间 分块并发请求
+        :param WindCode:
+        :param StartDateTime:%Y-%m-%d %H:%M:%S
+        :param EndDateTime:%Y-%m-%d %H:%M:%S
+        :return:
+        '''
+        if cls.MinuteCache is not None:
+            if cls.FetchPlanner is None:
+                return cls.MinuteCache.Load(WindCode.split(","), StartDateTime, EndDateTime,
+                                            cls.GetRawDataForGivenContractFromWind)
+            return cls.MinuteCache.Load(WindCode.split(","), StartDateTime, EndDateTime,
+                                        lambda Codes, StartTime, EndTime: cls.FetchPlanner.Stream(
+                                            Codes, StartTime, EndTime, cls.GetRawDataForGivenContractFromWind))
+        return cls.GetRawDataForGivenContractFromPlanner(WindCode, StartDateTime, EndDateTime)
+
+    @classmethod
+    def GetRawDataForGivenContractFromPlanner(cls, WindCode, StartDateTime, EndDateTime):
+        '''
+        1.2-通过FetchPlanner分块并发请求指定合约数据，FetchPlanner为None时一次请求所有合约
+        :param WindCode: 逗号连接的合约代码
+        :param StartDateTime:%Y-%m-%d %H:%M:%S
+        :param EndDateTime:%Y-%m-%d %H:%M:%S
+        :return:
+        '''
+        if cls.FetchPlanner is None:
+            return cls.GetRawDataForGivenContractFromWind(WindCode, StartDateTime, EndDateTime)
+        return cls.FetchPlanner.Fetch(WindCode.split(","), StartDateTime, EndDateTime,
+                                      cls.GetRawDataForGivenContractFromWind)
+
+    @classmethod
+    def GetRawDataForGivenContractFromWind(cls, WindCode, StartDateTime, EndDateTime):
+        '''
+        1.1-通过wind接口获取起始日期至终止日期指定合约数据
         有个坑，wind接口中，如果windcode只有一个合约，是没有windcode这个字段的
+        wind返回错误码时抛出ProviderError，临时错误由FetchPlanner重试
         :param WindCode:
         :param StartDateTime:%Y-%m-%d %H:%M:%S
         :param EndDateTime:%Y-%m-%d %H:%M:%S
         :return:
         '''
         if len(WindCode.split(",")) == 1:
-            OptionContractMinuteRawData = w.wsi(WindCode,
-                                                "open,high,low,close,volume,amt,chg,pct_chg,oi",
-                                                StartDateTime, EndDateTime, "Fill=Previous;PriceAdj=F")
+            OptionContractMinuteRawData = GetContext().Provider.wsi(
+                WindCode, "open,high,low,close,volume,amt,chg,pct_chg,oi", StartDateTime, EndDateTime,
+                "Fill=Previous;PriceAdj=F")
+            if OptionContractMinuteRawData.ErrorCode != 0:
+                raise ProviderError(OptionContractMinuteRawData.ErrorCode, "w.wsi:" + WindCode)
             OptionContractMinuteData = pd.DataFrame(OptionContractMinuteRawData.Data).T
             OptionContractMinuteData.columns = OptionContractMinuteRawData.Fields
             OptionContractMinuteData.insert(0, 'windcode', OptionContractMinuteRawData.Codes[0])
@@ -1576,9 +3500,11 @@ class OptionMinuteData(OptionContract, TradeCalendar, OptionGreeksMethod):
             OptionContractMinuteData['date'] = OptionContractMinuteData['datetime'].dt.date
             OptionContractMinuteData['time'] = OptionContractMinuteData['datetime'].dt.time
         else:
-            OptionContractMinuteRawData = w.wsi(WindCode,
-                                                "open,high,low,close,volume,amt,chg,pct_chg,oi",
-                                                StartDateTime, EndDateTime, "Fill=Previous;PriceAdj=F")
+            OptionContractMinuteRawData = GetContext().Provider.wsi(
+                WindCode, "open,high,low,close,volume,amt,chg,pct_chg,oi", StartDateTime, EndDateTime,
+                "Fill=Previous;PriceAdj=F")
+            if OptionContractMinuteRawData.ErrorCode != 0:
+                raise ProviderError(OptionContractMinuteRawData.ErrorCode, "w.wsi:" + WindCode)
             OptionContractMinuteData = pd.DataFrame(OptionContractMinuteRawData.Data).T
             OptionContractMinuteData.columns = OptionContractMinuteRawData.Fields
             OptionContractMinuteData['datetime'] = OptionContractMinuteRawData.Times
@@ -1590,6 +3516,7 @@ class OptionMinuteData(OptionContract, TradeCalendar, OptionGreeksMethod):
     def GetRawDataForListedContract(cls, StartDateTime, EndDateTime):
         '''
         2-获取起始日期至终止日期所有曾挂牌交易过的合约数据
+        合约较多、区间较长时由FetchPlanner分块并发请求，不再把所有合约拼成一次w.wsi请求
         :param StartDateTime:%Y-%m-%d %H:%M:%S
         :param EndDateTime:%Y-%m-%d %H:%M:%S
         :return:
@@ -1603,14 +3530,31 @@ class OptionMinuteData(OptionContract, TradeCalendar, OptionGreeksMethod):
     @classmethod
     def GetRawDataForUnderlyingSecurity(cls, StartDateTime, EndDateTime):
         '''
-        3-获取起始日期至终止日期标的ETF交易数据
+        3-获取起始日期至终止日期标的ETF交易数据，标的取当前运行环境GetContext().Underlying，MinuteCache不为None时先读本地缓存
+        :param StartDateTime:
+        :param EndDateTime:
+        :return:
+        '''
+        if cls.MinuteCache is not None:
+            return cls.MinuteCache.Load([GetContext().Underlying], StartDateTime, EndDateTime,
+                                        lambda WindCode, StartTime, EndTime:
+                                        cls.GetRawDataForUnderlyingSecurityFromWind(StartTime, EndTime))
+        return cls.GetRawDataForUnderlyingSecurityFromWind(StartDateTime, EndDateTime)
+
+    @classmethod
+    def GetRawDataForUnderlyingSecurityFromWind(cls, StartDateTime, EndDateTime):
+        '''
+        3.1-通过wind接口获取起始日期至终止日期标的ETF交易数据，wind返回错误码时抛出ProviderError
         :param StartDateTime:
         :param EndDateTime:
         :return:
         '''
-        UnderlyingSecurityMinuteRawData = w.wsi(UnderlyingSecurity,
-                                                "open,high,low,close,volume,amt,chg,pct_chg",
-                                                StartDateTime, EndDateTime, "Fill=Previous;PriceAdj=F")
+        Context = GetContext()
+        UnderlyingSecurityMinuteRawData = Context.Provider.wsi(
+            Context.Underlying, "open,high,low,close,volume,amt,chg,pct_chg", StartDateTime, EndDateTime,
+            "Fill=Previous;PriceAdj=F")
+        if UnderlyingSecurityMinuteRawData.ErrorCode != 0:
+            raise ProviderError(UnderlyingSecurityMinuteRawData.ErrorCode, "w.wsi:" + Context.Underlying)
         UnderlyingSecurityMinuteData = pd.DataFrame(UnderlyingSecurityMinuteRawData.Data).T
         UnderlyingSecurityMinuteData.columns = UnderlyingSecurityMinuteRawData.Fields
         UnderlyingSecurityMinuteData.insert(0, 'windcode', UnderlyingSecurityMinuteRawData.Codes[0])
@@ -1620,12 +3564,15 @@ class OptionMinuteData(OptionContract, TradeCalendar, OptionGreeksMethod):
         return UnderlyingSecurityMinuteData
 
     @classmethod
-    def GetDataForGivenContractAndUnderlyingSecurity(cls, WindCode, StartDateTime, EndDateTime):
+    def GetDataForGivenContractAndUnderlyingSecurity(cls, WindCode, StartDateTime, EndDateTime, Intraday=False,
+                                                     Compact=None):
         '''
         4.1-匹配现货标的交易数据
         :param WindCode:
         :param StartDateTime:
         :param EndDateTime:
+        :param Intraday: 到期时间是否扣除当天已经过去的交易时间，默认False
+        :param Compact: 是否返回压缩后的数据，默认CompactMode
         :return:
         '''
 
@@ -1633,111 +3580,187 @@ class OptionMinuteData(OptionContract, TradeCalendar, OptionGreeksMethod):
         RawDataForUnderlyingSecurity = cls.GetRawDataForUnderlyingSecurity(StartDateTime, EndDateTime)
         OptionContractDataTemp = pd.merge(RawDataForListedContract, RawDataForUnderlyingSecurity, left_on="datetime",
                                           right_on="datetime", how="left", suffixes=("_op", "_etf"))
+        Compact = cls.CompactMode if Compact is None else Compact
+        # 压缩模式只合并定价和预警需要的合约属性
+        ContractSetData = GetContext().ContractSetData
+        if Compact:
+            ContractSetData = ContractSetData[list(cls.CompactContractColumns)]
         OptionContractData = pd.merge(OptionContractDataTemp, ContractSetData, left_on="windcode_op",
                                       right_index=True, how="left")
 
-        OptionContractData['StartDate'] = OptionContractData["date_op"].map(lambda x: x.strftime('%Y-%m-%d'))
-        # OptionContractData["time_to_exercise"] = OptionContractData.apply(cls.TradeDaysCountAnnualizedForApply, axis=1,
-        #                                                                   StartDate="StartDate", EndDate="exercise_date")
-        # 直接这么算到期时间效率太低
-        # 考虑去重，先针对不同合约不同交易日和不同到期日，实际上，同一天挂牌交易的同一个合约，其逐笔数据的到期交易日都是定的
-        IntervalTempTable1 = OptionContractData[["windcode_op", "StartDate", "exercise_date"]].drop_duplicates()
-        IntervalTempTable2 = OptionContractData[["StartDate", "exercise_date"]].drop_duplicates()
-        IntervalTempTable2["time_to_exercise"] = IntervalTempTable2.apply(
-            OptionMinuteData.TradeDaysCountAnnualizedForApply,
-            axis=1,
-            StartDate="StartDate", EndDate="exercise_date")
-        IntervalTempTable13 = pd.merge(IntervalTempTable1, IntervalTempTable2, on=["StartDate", "exercise_date"],
-                                       how="left")
-        OptionContractData = pd.merge(OptionContractData, IntervalTempTable13,
-                                      on=["windcode_op", "StartDate", "exercise_date"], how="left")
+        if not Compact:
+            OptionContractData['StartDate'] = OptionContractData["datetime"].dt.strftime('%Y-%m-%d')
+        # 到期时间由交易日历索引整列计算，交易日历只加载一次
+        OptionContractData["time_to_exercise"] = cls.TimeToExpiryForArray(OptionContractData["datetime"],
+                                                                          OptionContractData["exercise_date"],
+                                                                          Intraday=Intraday)
 
         OptionContractData["InterestRate"] = InterestRate
         OptionContractData["DividendRate"] = DividendRate
+        if Compact:
+            return cls.CompactDataFrame(OptionContractData)
         return OptionContractData
 
     @classmethod
-    def GetDataForListedContractAndUnderlyingSecurity(cls, StartDateTime, EndDateTime):
+    def GetDataForListedContractAndUnderlyingSecurity(cls, StartDateTime, EndDateTime, Intraday=False, Compact=None):
         '''
         4.2-匹配现货标的交易数据
         :param StartDateTime:
         :param EndDateTime:
+        :param Intraday: 到期时间是否扣除当天已经过去的交易时间，默认False
+        :param Compact: 是否返回压缩后的数据，默认CompactMode
         :return:
         '''
         RawDataForListedContract = cls.GetRawDataForListedContract(StartDateTime, EndDateTime)
         RawDataForUnderlyingSecurity = cls.GetRawDataForUnderlyingSecurity(StartDateTime, EndDateTime)
         OptionContractDataTemp = pd.merge(RawDataForListedContract, RawDataForUnderlyingSecurity, left_on="datetime",
                                           right_on="datetime", how="left", suffixes=("_op", "_etf"))
+        Compact = cls.CompactMode if Compact is None else Compact
+        # 压缩模式只合并定价和预警需要的合约属性
+        ContractSetData = GetContext().ContractSetData
+        if Compact:
+            ContractSetData = ContractSetData[list(cls.CompactContractColumns)]
         OptionContractData = pd.merge(OptionContractDataTemp, ContractSetData, left_on="windcode_op",
                                       right_index=True, how="left")
 
-        OptionContractData['StartDate'] = OptionContractData["date_op"].map(lambda x: x.strftime('%Y-%m-%d'))
-        # OptionContractData["time_to_exercise"] = OptionContractData.apply(cls.TradeDaysCountAnnualizedForApply, axis=1,
-        #                                                                   StartDate="StartDate", EndDate="exercise_date")
-        # 直接这么算到期时间效率太低
-        # 考虑去重，先针对不同合约不同交易日和不同到期日，实际上，同一天挂牌交易的同一个合约，其逐笔数据的到期交易日都是定的
-        IntervalTempTable1 = OptionContractData[["windcode_op", "StartDate", "exercise_date"]].drop_duplicates()
-        IntervalTempTable2 = OptionContractData[["StartDate", "exercise_date"]].drop_duplicates()
-        IntervalTempTable2["time_to_exercise"] = IntervalTempTable2.apply(
-            OptionMinuteData.TradeDaysCountAnnualizedForApply,
-            axis=1,
-            StartDate="StartDate", EndDate="exercise_date")
-        IntervalTempTable13 = pd.merge(IntervalTempTable1, IntervalTempTable2, on=["StartDate", "exercise_date"],
-                                       how="left")
-        OptionContractData = pd.merge(OptionContractData, IntervalTempTable13,
-                                      on=["windcode_op", "StartDate", "exercise_date"], how="left")
+        if not Compact:
+            OptionContractData['StartDate'] = OptionContractData["datetime"].dt.strftime('%Y-%m-%d')
+        # 到期时间由交易日历索引整列计算，交易日历只加载一次
+        OptionContractData["time_to_exercise"] = cls.TimeToExpiryForArray(OptionContractData["datetime"],
+                                                                          OptionContractData["exercise_date"],
+                                                                          Intraday=Intraday)
 
         OptionContractData["InterestRate"] = InterestRate
         OptionContractData["DividendRate"] = DividendRate
+        if Compact:
+            return cls.CompactDataFrame(OptionContractData)
         return OptionContractData
 
     @classmethod
-    def ComputeGreeksForListedContract(cls, DataSetForCompute):
+    def CompactDataFrame(cls, DataFrame):
+        '''
+        4.3-压缩分钟数据，用于数据量大时减少内存占用
+        *windcode_op、windcode_etf等字符串字段转为category
+        *数值字段见CompactNumeric：成交量、持仓量转为int32，成交额转为int64，价格、涨跌幅等转为float32，
+         datetime保持datetime64，逐行的date、time、StartDate等对象字段删除，需要时由datetime得到
+        *合约属性只保留定价和预警需要的CompactContractColumns，其余字段留在ContractSetData中，
+         按整数字段contract_key（ContractSetData中的行号）通过ContractAttributes取回
+        *exercise_price用于匹配认购认沽、期权链，保持float64
+        :param DataFrame: 由GetDataForListedContractAndUnderlyingSecurity等生成的数据
+        :return: pd.DataFrame，行顺序不变
+        '''
+        ContractSetData = GetContext().ContractSetData
+        Columns = {}
+        for x in DataFrame.columns:
+            Column = DataFrame[x]
+            if x in cls.CompactDropColumns or (x in ContractSetData.columns and x not in cls.CompactContractColumns):
+                continue
+            if pd.api.types.is_datetime64_any_dtype(Column.dtype) or x in ("exercise_date", "expire_date"):
+                Columns[x] = pd.to_datetime(Column)
+            elif x == "exercise_price":
+                Columns[x] = Column.astype(np.float64)
+            elif isinstance(Column.dtype, pd.CategoricalDtype) or pd.api.types.is_bool_dtype(Column.dtype):
+                Columns[x] = Column
+            elif pd.api.types.is_numeric_dtype(Column.dtype):
+                Columns[x] = cls.CompactNumeric(x, Column)
+            else:
+                Numeric = pd.to_numeric(Column, errors="coerce")
+                if Numeric.notna().sum() == Column.notna().sum():
+                    Columns[x] = cls.CompactNumeric(x, Numeric)
+                else:
+                    Columns[x] = Column.astype("category")
+        result = pd.DataFrame(Columns, index=DataFrame.index)
+        if "windcode_op" in result.columns:
+            result["contract_key"] = ContractSetData.index.get_indexer(result["windcode_op"].astype(object)).astype(
+                np.int32)
+        return result
+
+    @classmethod
+    def CompactNumeric(cls, Name, Column):
+        '''
+        4.3.1-压缩数值字段，成交量、成交额、持仓量不损失精度：
+        *CompactIntegerColumns中的字段（不计_op、_etf后缀）转为整数，成交额超过int32范围，用int64，其余用int32；
+         有空值或非整数值时保持float64
+        *价格、涨跌幅等其余字段转为float32
+        :param Name: 字段名
+        :param Column: pd.Series，数值类型
+        :return: pd.Series
+        '''
+        BaseName = Name.rsplit("_", 1)[0] if Name.endswith(("_op", "_etf")) else Name
+        if BaseName not in cls.CompactIntegerColumns:
+            return Column.astype(np.float32)
+        Values = Column.to_numpy(dtype=np.float64)
+        if not (np.isfinite(Values).all() and np.array_equal(Values, np.round(Values))):
+            return Column.astype(np.float64)
+        return Column.astype(cls.CompactIntegerColumns[BaseName])
+
+    @classmethod
+    def ContractAttributes(cls, DataFrame, Columns):
+        '''
+        4.4-按contract_key取回压缩时删除的合约属性
+        :param DataFrame: CompactDataFrame的结果
+        :param Columns: 合约属性字段列表，如["sec_name", "listed_date"]
+        :return: pd.DataFrame，与DataFrame行顺序、index一致，ContractSetData中没有的合约为空值
+        '''
+        ContractSetData = GetContext().ContractSetData[list(Columns)]
+        Keys = DataFrame["contract_key"].to_numpy()
+        result = ContractSetData.iloc[np.maximum(Keys, 0)].set_axis(DataFrame.index)
+        return result.where(pd.Series(Keys >= 0, index=DataFrame.index), axis=0)
+
+    @classmethod
+    def ComputeGreeksForListedContract(cls, DataSetForCompute, Greeks=None, Workers=None, ChunkSize=None,
+                                       ShardBy=None, InPlace=True):
         '''
         给出数据计算greeks，默认计算ImpliedVolatility,Delta,Gamma,Vega,Theta,Rho。
+        行数超过ChunkSize且Workers大于1时，交给ParallelGreeksEngine多进程分片计算，结果与单进程一致
+        GreeksCache不为None时，输入相同的 合约×交易日 分区直接取缓存结果，只计算缺失的分区
         :param DataForCompute: 数据集，pd.DataFrame，字段为wind格式，由GetDataForListedContractAndUnderlyingSecurity生成
+        :param Greeks: 需要计算的希腊字母，取自GREEKS_ALL，默认GREEKS_DEFAULT，如需Vomma,Vanna,Charm,Veta直接传入即可
+        :param Workers: 进程数，默认GreeksWorkers
+        :param ChunkSize: 每个分片的行数，默认GreeksChunkSize
+        :param ShardBy: 分片依据，"wind_code"/"trade_date"/"row"，默认GreeksShardBy
+        :param InPlace: 是否直接在DataSetForCompute上写入结果字段，False时不修改DataSetForCompute，返回新增字段后的新表
         :return:
         '''
-        DataSetForCompute["ImpliedVolatility"] = DataSetForCompute.apply(cls.ImpliedVolatilityForApply, axis=1,
-                                                                         Direction="call_or_put",
-                                                                         UnderlyingPrice="close_etf",
-                                                                         ExercisePrice="exercise_price",
-                                                                         Time="time_to_exercise",
-                                                                         InterestRate="InterestRate",
-                                                                         DividendRate="DividendRate",
-                                                                         Target="close_op")
-        DataSetForCompute["Delta"] = DataSetForCompute.apply(cls.DeltaValueForApply, axis=1, Direction="call_or_put",
-                                                             UnderlyingPrice="close_etf",
-                                                             ExercisePrice="exercise_price", Time="time_to_exercise",
-                                                             InterestRate="InterestRate",
-                                                             DividendRate="DividendRate",
-                                                             Volatility="ImpliedVolatility")
-        DataSetForCompute["Gamma"] = DataSetForCompute.apply(cls.GammaValueForApply, axis=1, Direction="call_or_put",
-                                                             UnderlyingPrice="close_etf",
-                                                             ExercisePrice="exercise_price", Time="time_to_exercise",
-                                                             InterestRate="InterestRate",
-                                                             DividendRate="DividendRate",
-                                                             Volatility="ImpliedVolatility")
-        DataSetForCompute["Vega"] = DataSetForCompute.apply(cls.VegaValueForApply, axis=1, Direction="call_or_put",
-                                                            UnderlyingPrice="close_etf",
-                                                            ExercisePrice="exercise_price", Time="time_to_exercise",
-                                                            InterestRate="InterestRate",
-                                                            DividendRate="DividendRate",
-                                                            Volatility="ImpliedVolatility")
-        DataSetForCompute["Theta"] = DataSetForCompute.apply(cls.ThetaValueForApply, axis=1, Direction="call_or_put",
-                                                             UnderlyingPrice="close_etf",
-                                                             ExercisePrice="exercise_price", Time="time_to_exercise",
-                                                             InterestRate="InterestRate",
-                                                             DividendRate="DividendRate",
-                                                             Volatility="ImpliedVolatility")
-        DataSetForCompute["Rho"] = DataSetForCompute.apply(cls.RhoValueForApply, axis=1, Direction="call_or_put",
-                                                           UnderlyingPrice="close_etf",
-                                                           ExercisePrice="exercise_price", Time="time_to_exercise",
-                                                           InterestRate="InterestRate",
-                                                           DividendRate="DividendRate",
-                                                           Volatility="ImpliedVolatility")
+        if cls.GreeksCache is not None:
+            GreeksData = cls.GreeksCache.Compute(
+                DataSetForCompute, Greeks, lambda Data: cls.ComputeGreeksColumns(Data, Greeks, Workers, ChunkSize,
+                                                                                 ShardBy))
+        else:
+            GreeksData = cls.ComputeGreeksColumns(DataSetForCompute, Greeks, Workers, ChunkSize, ShardBy)
+        if not InPlace:
+            return DataSetForCompute.assign(**{x: GreeksData[x] for x in GreeksData.columns})
+        for x in GreeksData.columns:
+            DataSetForCompute[x] = GreeksData[x]
         return DataSetForCompute
 
+    @classmethod
+    def ComputeGreeksColumns(cls, DataSetForCompute, Greeks=None, Workers=None, ChunkSize=None, ShardBy=None):
+        '''
+        计算隐含波动率及希腊字母，参数同ComputeGreeksForListedContract，不写入DataSetForCompute
+        :return: pd.DataFrame，ImpliedVolatility及各希腊字母一列，索引与DataSetForCompute一致
+        '''
+        Workers = cls.GreeksWorkers if Workers is None else Workers
+        ChunkSize = cls.GreeksChunkSize if ChunkSize is None else ChunkSize
+        ShardBy = cls.GreeksShardBy if ShardBy is None else ShardBy
+        if Workers > 1 and len(DataSetForCompute.index) > ChunkSize:
+            return ParallelGreeksEngine(Workers, ChunkSize, ShardBy).Compute(DataSetForCompute, Greeks=Greeks)
+        ImpliedVolatility = cls.ImpliedVolatilityForDataFrame(DataSetForCompute, Direction="call_or_put",
+                                                              UnderlyingPrice="close_etf",
+                                                              ExercisePrice="exercise_price",
+                                                              Time="time_to_exercise", InterestRate="InterestRate",
+                                                              DividendRate="DividendRate", Target="close_op")
+        GreeksData = pd.DataFrame(cls.GreeksForArray(
+            cls.CallOrPutMaskForArray(DataSetForCompute["call_or_put"]),
+            DataSetForCompute["close_etf"].to_numpy(dtype=np.float64),
+            DataSetForCompute["exercise_price"].to_numpy(dtype=np.float64),
+            DataSetForCompute["time_to_exercise"].to_numpy(dtype=np.float64),
+            DataSetForCompute["InterestRate"].to_numpy(dtype=np.float64),
+            DataSetForCompute["DividendRate"].to_numpy(dtype=np.float64),
+            ImpliedVolatility.to_numpy(dtype=np.float64), Greeks=Greeks), index=DataSetForCompute.index)
+        GreeksData.insert(0, "ImpliedVolatility", ImpliedVolatility)
+        return GreeksData
+
 
 class OptionHistoryAlertForMinuteData:
     '''
@@ -1749,16 +3772,26 @@ class OptionHistoryAlertForMinuteData:
     1.1-平价关系偏离RollAlert_OptionParityDeviate
     1.1.1-平价关系偏离原始数据RollAlert_OptionParityDeviate_RawData
     1.1.2-平价关系偏离测算结果RollAlert_OptionParityDeviate_Result
+    1.1.3-平价关系偏离原始数据精简版RollAlert_OptionParityDeviate_Compact
     1.2-隐含波动率瞬间偏离RollAlert_ImpliedVolatilityDeviate
     1.2.1-隐含波动率瞬间偏离原始数据RollAlert_ImpliedVolatilityDeviate_RawData
     1.2.2-隐含波动率瞬间偏离测算结果RollAlert_ImpliedVolatilityDeviate_Result
     1.3-价格瞬间偏离RollAlert_OptionPriceDeviate
     1.3.1-价格瞬间偏离原始数据RollAlert_OptionPriceDeviate_RawData
     1.3.2-价格瞬间偏离测算结果RollAlert_OptionPriceDeviate_Result
+    1.4-三类滚动报警并行计算RollAlert_Concurrent
     2-刷新报警类
+    *ListedContractDataWithGreeks初始化后不再修改，只读字段数组见Columns；各报警只生成自己的结果字段，
+     可以在线程池中同时计算，也可以重复计算
     ……
     '''
 
+    # 认购认沽配对索引缓存，见ParityPairIndex
+    _ParityPairIndex = None
+    # 只读字段数组缓存，见Columns
+    _Columns = None
+    _ColumnsLock = threading.Lock()
+
     def __init__(self, StartDateTime, EndDateTime):
         '''
         初始化类，得到合约交易数据和测算数据（含有希腊字母的）
@@ -1769,7 +3802,124 @@ class OptionHistoryAlertForMinuteData:
         self.EndTime = EndDateTime
         self.ListedContractData = OptionMinuteData.GetDataForListedContractAndUnderlyingSecurity(self.StartTime,
                                                                                                  self.EndTime)
-        self.ListedContractDataWithGreeks = OptionMinuteData.ComputeGreeksForListedContract(self.ListedContractData)
+        self.ListedContractDataWithGreeks = OptionMinuteData.ComputeGreeksForListedContract(self.ListedContractData,
+                                                                                            InPlace=False)
+
+    @classmethod
+    def FromListedContractData(cls, ListedContractData):
+        '''
+        由已经取好的数据初始化，不再请求数据接口，用于回放、性能测试等
+        :param ListedContractData: 格式同GetDataForListedContractAndUnderlyingSecurity的返回值，已含ImpliedVolatility字段时不再计算greeks
+        :return: OptionHistoryAlertForMinuteData
+        '''
+        result = cls.__new__(cls)
+        result.StartTime = ListedContractData["datetime"].min().strftime("%Y-%m-%d %H:%M:%S")
+        result.EndTime = ListedContractData["datetime"].max().strftime("%Y-%m-%d %H:%M:%S")
+        result.ListedContractData = ListedContractData
+        if "ImpliedVolatility" in ListedContractData.columns:
+            result.ListedContractDataWithGreeks = ListedContractData
+        else:
+            result.ListedContractDataWithGreeks = OptionMinuteData.ComputeGreeksForListedContract(ListedContractData,
+                                                                                                  InPlace=False)
+        return result
+
+    @classmethod
+    def DateTimeToString(cls, DateTimes, Format):
+        '''
+        时间字段转字符串，同一分钟的各合约共用一次strftime
+        :param DateTimes: pd.Series，datetime
+        :param Format: 例如'%Y-%m-%d'
+        :return: np.ndarray
+        '''
+        Codes, Uniques = pd.factorize(DateTimes)
+        return pd.DatetimeIndex(Uniques).strftime(Format).to_numpy()[Codes]
+
+    @property
+    def Columns(self):
+        '''
+        ListedContractDataWithGreeks的只读字段数组，每个数据集只生成一次，各报警共用
+        :return: dict，字段名 -> np.ndarray（不可写）
+        '''
+        Data = self.ListedContractDataWithGreeks
+        Columns = self._Columns
+        if Columns is None or Columns[0] is not Data:
+            with self._ColumnsLock:
+                Columns = self._Columns
+                if Columns is None or Columns[0] is not Data:
+                    Columns = (Data, self.ReadOnlyColumns(Data))
+                    self._Columns = Columns
+        return Columns[1]
+
+    @classmethod
+    def ReadOnlyColumns(cls, Data):
+        '''
+        把DataFrame各字段转为不可写的np.ndarray，数值字段尽量不复制
+        :return: dict
+        '''
+        result = {}
+        for x in Data.columns:
+            Values = Data[x].to_numpy()
+            if isinstance(Values, np.ndarray):
+                Values = Values.view()
+                Values.flags.writeable = False
+            result[x] = Values
+        return result
+
+    def WithColumns(self, Output):
+        '''
+        在ListedContractDataWithGreeks后面加上报警自己的结果字段，返回新表，不修改ListedContractDataWithGreeks
+        :param Output: dict，字段名 -> 数组
+        :return: pd.DataFrame
+        '''
+        return self.ListedContractDataWithGreeks.assign(**Output)
+
+    @property
+    def ParityPairIndex(self):
+        '''
+        认购认沽配对索引，每个数据集只计算一次，以数据集本身（is）为键，替换数据集后重新计算
+        :return: (认购行位置, 对应认沽行位置)，np.ndarray，找不到对应认沽合约时为-1
+        '''
+        Data = self.ListedContractDataWithGreeks
+        PairIndex = self._ParityPairIndex
+        if PairIndex is None or PairIndex[0] is not Data:
+            PairIndex = (Data,) + self.ParityPairIndexForDataFrame(Data)
+            self._ParityPairIndex = PairIndex
+        return PairIndex[1:]
+
+    @classmethod
+    def ParityPairIndexForDataFrame(cls, Data):
+        '''
+        按(datetime,limit_month,exercise_price)把每个认购行对应到认沽行，代替pd.merge
+        三个字段编码为一个整数键，认沽行按键排序后用searchsorted查找；同一键有多个认沽行时取第一个
+        :param Data: pd.DataFrame，格式同ListedContractDataWithGreeks
+        :return: (认购行位置, 对应认沽行位置)，np.ndarray，找不到对应认沽合约时为-1
+        '''
+        DateTimeCodes = pd.factorize(Data["datetime"])[0].astype(np.int64)
+        MonthCodes, MonthUniques = pd.factorize(Data["limit_month"])
+        PriceCodes, PriceUniques = pd.factorize(Data["exercise_price"])
+        Key = (DateTimeCodes * len(MonthUniques) + MonthCodes) * len(PriceUniques) + PriceCodes
+        Direction = Data["call_or_put"].to_numpy()
+        CallRows = np.flatnonzero(Direction == "认购")
+        PutRows = np.flatnonzero(Direction == "认沽")
+        if not len(PutRows):
+            return CallRows, np.full(len(CallRows), -1, dtype=np.int64)
+        PutOrder = np.argsort(Key[PutRows], kind="stable")
+        PutRows = PutRows[PutOrder]
+        SortedPutKey = Key[PutRows]
+        Position = np.minimum(np.searchsorted(SortedPutKey, Key[CallRows]), len(PutRows) - 1)
+        return CallRows, np.where(SortedPutKey[Position] == Key[CallRows], PutRows[Position], -1)
+
+    @classmethod
+    def TakeRows(cls, Data, Rows):
+        '''
+        按行位置取数，位置为-1的行取空值，相当于左连接没有匹配上的行
+        '''
+        result = Data.iloc[np.maximum(Rows, 0)].reset_index(drop=True)
+        Missing = Rows < 0
+        if Missing.any():
+            result = result.astype({x: np.float64 for x in result.columns if result[x].dtype.kind in "biu"})
+            result.loc[Missing] = np.nan
+        return result
 
     # todo 把数据格式处理成方便计算平价关系
     def FormatDataToParityCompute(self):
@@ -1787,19 +3937,35 @@ class OptionHistoryAlertForMinuteData:
         'windcode_etf', 'open_etf', 'high_etf', 'low_etf',
         'close_etf', 'volume_etf', 'amount_etf', 'change_etf', 'pctchange_etf',
         'date_etf', 'time_etf'
+        按ParityPairIndex取数拼接，结果同按["datetime","limit_month","exercise_price"]左连接
         :return:
         '''
         TempResult = self.ListedContractDataWithGreeks
-        TempCallResult = TempResult[TempResult["call_or_put"] == "认购"]
-        TempPutResult = TempResult[TempResult["call_or_put"] == "认沽"].drop(
-            columns=['windcode_etf', 'open_etf', 'high_etf', 'low_etf',
-                     'close_etf', 'volume_etf', 'amount_etf', 'change_etf', 'pctchange_etf',
-                     'date_etf', 'time_etf', 'option_mark_code', 'option_type', 'exercise_mode', 'contract_unit',
-                     'settle_mode', 'contract_state', 'time_to_exercise',
-                     'InterestRate', 'DividendRate'])
-        result = pd.merge(TempCallResult, TempPutResult, how="left", on=["datetime", "limit_month", "exercise_price"],
-                          suffixes=("_call", "_put"))
-        return result
+        CallRows, PutRows = self.ParityPairIndex
+        SameColumns = ['windcode_etf', 'open_etf', 'high_etf', 'low_etf',
+                       'close_etf', 'volume_etf', 'amount_etf', 'change_etf', 'pctchange_etf',
+                       'date_etf', 'time_etf', 'option_mark_code', 'option_type', 'exercise_mode', 'contract_unit',
+                       'settle_mode', 'contract_state', 'time_to_exercise',
+                       'InterestRate', 'DividendRate']
+        KeyColumns = ["datetime", "limit_month", "exercise_price"]
+        PutColumns = [x for x in TempResult.columns if x not in SameColumns and x not in KeyColumns]
+        TempCallResult = self.TakeRows(TempResult, CallRows).rename(columns={x: x + "_call" for x in PutColumns})
+        TempPutResult = self.TakeRows(TempResult[PutColumns], PutRows).rename(
+            columns={x: x + "_put" for x in PutColumns})
+        return pd.concat([TempCallResult, TempPutResult], axis=1)
+
+    @classmethod
+    def ParityRatioForArray(cls, CallClose, PutClose, UnderlyingClose, ExercisePrice, Time, Rate,
+                            CallImpliedVolatility, PutImpliedVolatility):
+        '''
+        向量化计算正向平价比、反向平价比、多空隐含波动率比
+        正向平价比=(C+K*exp(-rT))/(P+S)-1，反向平价比=(P+S)/(C+K*exp(-rT))-1，多空隐含波动率比=认购IV/认沽IV-1
+        :return: (正向平价比, 反向平价比, 多空隐含波动率比)，np.ndarray
+        '''
+        with np.errstate(divide="ignore", invalid="ignore"):
+            CallSide = CallClose + ExercisePrice * np.exp(-(Time * Rate))
+            PutSide = PutClose + UnderlyingClose
+            return CallSide / PutSide - 1, PutSide / CallSide - 1, CallImpliedVolatility / PutImpliedVolatility - 1
 
     def RollAlert_OptionParityDeviate_RawData(self):
         '''
@@ -1808,17 +3974,47 @@ class OptionHistoryAlertForMinuteData:
         :return:返回正向平价比、反向平价比、多空隐含波动率比
         '''
         TempResult = self.FormatDataToParityCompute()
-        TempResult["Forward_Parity_Ratio"] = (TempResult["close_op_call"] + TempResult["exercise_price"] * (
-                TempResult["time_to_exercise"] * TempResult["InterestRate"]).apply(lambda x: np.exp(-x))) / (
-                                                     TempResult["close_op_put"] + TempResult["close_etf"]) - 1
-        TempResult["Backward_Parity_Ratio"] = (TempResult["close_op_put"] + TempResult["close_etf"]) / (
-                TempResult["close_op_call"] + TempResult["exercise_price"] * (
-                TempResult["time_to_exercise"] * TempResult[
-            "InterestRate"]).apply(lambda x: np.exp(-x))) - 1
-        TempResult["Call_Put_ImpliedVolatility_Ratio"] = TempResult["ImpliedVolatility_call"] / TempResult[
-            "ImpliedVolatility_put"] - 1
+        TempResult["Forward_Parity_Ratio"], TempResult["Backward_Parity_Ratio"], TempResult[
+            "Call_Put_ImpliedVolatility_Ratio"] = self.ParityRatioForArray(
+            TempResult["close_op_call"].to_numpy(dtype=np.float64),
+            TempResult["close_op_put"].to_numpy(dtype=np.float64),
+            TempResult["close_etf"].to_numpy(dtype=np.float64),
+            TempResult["exercise_price"].to_numpy(dtype=np.float64),
+            TempResult["time_to_exercise"].to_numpy(dtype=np.float64),
+            TempResult["InterestRate"].to_numpy(dtype=np.float64),
+            TempResult["ImpliedVolatility_call"].to_numpy(dtype=np.float64),
+            TempResult["ImpliedVolatility_put"].to_numpy(dtype=np.float64))
         return TempResult
 
+    def RollAlert_OptionParityDeviate_Compact(self):
+        '''
+        1.1.3-平价关系偏离原始数据精简版RollAlert_OptionParityDeviate_Compact
+        只取计算和筛选需要的字段，按ParityPairIndex直接从原数据取数，不生成认购认沽拼接后的宽表，用于全年分钟数据
+        只保留找到对应认沽合约的行，结果可直接传给RollAlert_OptionParityDeviate_Result
+        :return: pd.DataFrame
+        '''
+        Data = self.Columns
+        CallRows, PutRows = self.ParityPairIndex
+        Found = PutRows >= 0
+        CallRows, PutRows = CallRows[Found], PutRows[Found]
+        result = pd.DataFrame({"datetime": Data["datetime"][CallRows],
+                               "limit_month": Data["limit_month"][CallRows],
+                               "exercise_price": Data["exercise_price"][CallRows],
+                               "windcode_op_call": Data["windcode_op"][CallRows],
+                               "windcode_op_put": Data["windcode_op"][PutRows]})
+        Columns = {x: np.asarray(Data[x], dtype=np.float64) for x in
+                   ["close_op", "close_etf", "exercise_price", "time_to_exercise", "InterestRate",
+                    "ImpliedVolatility"]}
+        result["Forward_Parity_Ratio"], result["Backward_Parity_Ratio"], result[
+            "Call_Put_ImpliedVolatility_Ratio"] = self.ParityRatioForArray(
+            Columns["close_op"][CallRows], Columns["close_op"][PutRows], Columns["close_etf"][CallRows],
+            Columns["exercise_price"][CallRows], Columns["time_to_exercise"][CallRows],
+            Columns["InterestRate"][CallRows], Columns["ImpliedVolatility"][CallRows],
+            Columns["ImpliedVolatility"][PutRows])
+        result["ImpliedVolatility_call"] = Columns["ImpliedVolatility"][CallRows]
+        result["ImpliedVolatility_put"] = Columns["ImpliedVolatility"][PutRows]
+        return result
+
     # CC = OptionHistoryAlertForMinuteData(StartDateTime, EndDateTime)
     # DD = CC.RollAlert_OptionParityDeviate_RawData()
     # DD_result = CC.RollAlert_OptionParityDeviate_Result(DD, 0.1, 0.1, 0.2)
@@ -1839,34 +4035,35 @@ class OptionHistoryAlertForMinuteData:
         return TempResult[
             (TempResult["ImpliedVolatility_call"] >= 0.0001) & (TempResult["ImpliedVolatility_put"] >= 0.0001)]
 
-    def RollAlert_ImpliedVolatilityDeviate_RawData(self, bandwith=3):
+    def RollAlert_ImpliedVolatilityDeviate_RawData(self, bandwith=3, TimeWindow=False):
         '''
         1.2.1-隐含波动率瞬间偏离原始数据RollAlert_ImpliedVolatilityDeviate_RawData
+        滚动最大值、最小值由RollingExtrema一次算出，按行顺序直接写入，不再分别groupby后merge
+        结果字段加在新表上返回，不修改ListedContractDataWithGreeks
         :param bandwith: 滚动区间，默认3min
+        :param TimeWindow: 是否按交易分钟滚动（扣除午间休市），默认False按行滚动，同rolling(bandwith)
         :return:
         '''
-        result = self.ListedContractDataWithGreeks
-        result["date_op_str"] = result["date_op"].apply(lambda x: x.strftime('%Y-%m-%d'))
-        result["time_op_str"] = result["time_op"].apply(lambda x: x.strftime('%H:%M:%S'))
-        # 计算rolling最大值
-        result_groupby = result.groupby(["windcode_op", "date_op_str"])["time_op_str", "ImpliedVolatility"]
-        result_groupby_max = result_groupby.rolling(bandwith, on="time_op_str").max()
-        result_groupby_max = result_groupby_max.reset_index()
-        result_groupby_max = result_groupby_max.drop(columns=["level_2"])
-        result_groupby_max.rename(columns={"ImpliedVolatility": "ImpliedVolatility_Rolling_Max"}, inplace=True)
-        result = pd.merge(result, result_groupby_max, how="left", on=["windcode_op", "date_op_str", "time_op_str"])
-        # 计算rolling最小值
-        result_groupby_min = result_groupby.rolling(bandwith, on="time_op_str").min()
-        result_groupby_min = result_groupby_min.reset_index()
-        result_groupby_min = result_groupby_min.drop(columns=["level_2"])
-        result_groupby_min.rename(columns={"ImpliedVolatility": "ImpliedVolatility_Rolling_Min"}, inplace=True)
-        result = pd.merge(result, result_groupby_min, how="left", on=["windcode_op", "date_op_str", "time_op_str"])
-        result["ImpliedVolatility_Rolling_Max"] = result["ImpliedVolatility_Rolling_Max"].fillna(-9999)
-        result["ImpliedVolatility_Rolling_Min"] = result["ImpliedVolatility_Rolling_Min"].fillna(-9999)
-        result["ImpliedVolatilityDeviateRatio"] = result["ImpliedVolatility_Rolling_Max"] / result[
-            "ImpliedVolatility_Rolling_Min"] - 1
-        result["ImpliedVolatilityDeviateRatio"] = result["ImpliedVolatilityDeviateRatio"].abs()
-        return result
+        return self.WithColumns(self.RollingDeviateColumns("ImpliedVolatility", bandwith, TimeWindow))
+
+    def RollingDeviateColumns(self, Column, bandwith, TimeWindow):
+        '''
+        隐含波动率、价格瞬间偏离的结果字段：date_op_str、time_op_str、<Column>_Rolling_Max/Min及偏离比例
+        算不出滚动值的行最大最小值记为-9999
+        :return: dict
+        '''
+        Data = self.ListedContractDataWithGreeks
+        RatioName = {"ImpliedVolatility": "ImpliedVolatilityDeviateRatio",
+                     "close_op": "OptionPriceDeviateRatio"}[Column]
+        # 计算rolling最大值、最小值
+        RollingMax, RollingMin = RollingExtrema.ForDataFrame(Data, Column, bandwith, TimeWindow=TimeWindow)
+        RollingMax = np.where(np.isnan(RollingMax), -9999, RollingMax)
+        RollingMin = np.where(np.isnan(RollingMin), -9999, RollingMin)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            Ratio = np.abs(RollingMax / RollingMin - 1)
+        return {"date_op_str": self.DateTimeToString(Data["datetime"], '%Y-%m-%d'),
+                "time_op_str": self.DateTimeToString(Data["datetime"], '%H:%M:%S'),
+                Column + "_Rolling_Max": RollingMax, Column + "_Rolling_Min": RollingMin, RatioName: Ratio}
 
     # CC = OptionHistoryAlertForMinuteData(StartDateTime, EndDateTime)
     # DD = CC.RollAlert_ImpliedVolatilityDeviate_RawData(bandwith=3)
@@ -1884,34 +4081,16 @@ class OptionHistoryAlertForMinuteData:
             (TempResult["ImpliedVolatility_Rolling_Max"] >= 0.0001) & (
                     TempResult["ImpliedVolatility_Rolling_Min"] >= 0.0001)]
 
-    def RollAlert_OptionPriceDeviate_RawData(self, bandwith=3):
+    def RollAlert_OptionPriceDeviate_RawData(self, bandwith=3, TimeWindow=False):
         '''
         1.3.1-价格瞬间偏离原始数据RollAlert_OptionPriceDeviate_RawData
+        滚动最大值、最小值由RollingExtrema一次算出，按行顺序直接写入，不再分别groupby后merge
+        结果字段加在新表上返回，不修改ListedContractDataWithGreeks
         :param bandwith: 滚动区间，默认3min
+        :param TimeWindow: 是否按交易分钟滚动（扣除午间休市），默认False按行滚动，同rolling(bandwith)
         :return:
         '''
-        result = self.ListedContractDataWithGreeks
-        result["date_op_str"] = result["date_op"].apply(lambda x: x.strftime('%Y-%m-%d'))
-        result["time_op_str"] = result["time_op"].apply(lambda x: x.strftime('%H:%M:%S'))
-        # 计算rolling最大值
-        result_groupby = result.groupby(["windcode_op", "date_op_str"])["time_op_str", "close_op"]
-        result_groupby_max = result_groupby.rolling(bandwith, on="time_op_str").max()
-        result_groupby_max = result_groupby_max.reset_index()
-        result_groupby_max = result_groupby_max.drop(columns=["level_2"])
-        result_groupby_max.rename(columns={"close_op": "close_op_Rolling_Max"}, inplace=True)
-        result = pd.merge(result, result_groupby_max, how="left", on=["windcode_op", "date_op_str", "time_op_str"])
-        # 计算rolling最小值
-        result_groupby_min = result_groupby.rolling(bandwith, on="time_op_str").min()
-        result_groupby_min = result_groupby_min.reset_index()
-        result_groupby_min = result_groupby_min.drop(columns=["level_2"])
-        result_groupby_min.rename(columns={"close_op": "close_op_Rolling_Min"}, inplace=True)
-        result = pd.merge(result, result_groupby_min, how="left", on=["windcode_op", "date_op_str", "time_op_str"])
-        result["close_op_Rolling_Max"] = result["close_op_Rolling_Max"].fillna(-9999)
-        result["close_op_Rolling_Min"] = result["close_op_Rolling_Min"].fillna(-9999)
-        result["OptionPriceDeviateRatio"] = result["close_op_Rolling_Max"] / result[
-            "close_op_Rolling_Min"] - 1
-        result["OptionPriceDeviateRatio"] = result["OptionPriceDeviateRatio"].abs()
-        return result
+        return self.WithColumns(self.RollingDeviateColumns("close_op", bandwith, TimeWindow))
 
     @classmethod
     def RollAlert_OptionPriceDeviate_Resultt(cls, ArrLike, Arg1_Value):
@@ -1932,72 +4111,986 @@ class OptionHistoryAlertForMinuteData:
              TempResult["close_op_Rolling_Min"]) >= 0.001]
         return Result
 
+    def RollAlert_Concurrent(self, Bandwith=3, ImpliedVolatilityThreshold=0.0001, OptionPriceThreshold=0.1,
+                             ParityThreshold=(0.1, 0.1, 0.2), TimeWindow=False, Workers=3):
+        '''
+        1.4-三类滚动报警并行计算RollAlert_Concurrent，在线程池中同时计算，只返回触发的报警
+        各报警只读ListedContractDataWithGreeks，不需要事先复制数据
+        :param Bandwith: 滚动区间，默认3min
+        :param ImpliedVolatilityThreshold: 同RollAlert_ImpliedVolatilityDeviate_Result的Arg1_Value
+        :param OptionPriceThreshold: 同RollAlert_OptionPriceDeviate_Resultt的Arg1_Value
+        :param ParityThreshold: (Arg1_Value,Arg2_Value,Arg3_Value)，同RollAlert_OptionParityDeviate_Result
+        :param TimeWindow: 是否按交易分钟滚动
+        :param Workers: 线程数，1则依次计算
+        :return: dict，OptionRealTimeAlert.ALERT_* -> 触发的报警pd.DataFrame
+        '''
+        Tasks = {
+            OptionRealTimeAlert.ALERT_IMPLIED_VOLATILITY: lambda: self.RollAlert_ImpliedVolatilityDeviate_Result(
+                self.RollAlert_ImpliedVolatilityDeviate_RawData(Bandwith, TimeWindow), ImpliedVolatilityThreshold),
+            OptionRealTimeAlert.ALERT_OPTION_PRICE: lambda: self.RollAlert_OptionPriceDeviate_Resultt(
+                self.RollAlert_OptionPriceDeviate_RawData(Bandwith, TimeWindow), OptionPriceThreshold),
+            OptionRealTimeAlert.ALERT_OPTION_PARITY: lambda: self.RollAlert_OptionParityDeviate_Result(
+                self.RollAlert_OptionParityDeviate_Compact(), *ParityThreshold)}
+        if Workers <= 1:
+            return {x: Task() for x, Task in Tasks.items()}
+        with ThreadPoolExecutor(max_workers=Workers) as Executor:
+            Futures = {x: Executor.submit(Task) for x, Task in Tasks.items()}
+            return {x: Future.result() for x, Future in Futures.items()}
+
+
+class RollingExtrema:
+    '''
+    分组滚动最大值、最小值，一次计算同时得到max和min，结果按原始行顺序返回，不需要再merge回原数据
+    *按 合约×交易日 分组，组内按行滚动，窗口跨越分组起点的行返回nan，与groupby(...).rolling(Window).max()/min()一致
+    *按时间滚动时窗口为最近Window个交易分钟，午间休市11:30-13:00不计入，如13:01的3分钟窗口包含11:29、11:30、13:00、13:01
+    *窗口内含空值时返回nan
+    1-交易分钟序号SessionMinuteForArray
+    2-滚动最大最小值ForArray
+    3-按字段名计算ForDataFrame
+    '''
+
+    @classmethod
+    def SessionMinuteForArray(cls, DateTimes):
+        '''
+        1-交易分钟序号，9:30为0，11:30为120，13:00接着11:30记为120，扣除午间休市
+        :param DateTimes: datetime数组
+        :return: np.ndarray，int64
+        '''
+        DateTimes = pd.to_datetime(pd.Series(DateTimes)).to_numpy()
+        Minutes = (DateTimes - DateTimes.astype("datetime64[D]")).astype("timedelta64[m]").astype(np.int64)
+        HalfSession = TradeCalendarIndex.SessionMinutes // 2
+        return np.where(Minutes >= TradeCalendarIndex.AfternoonOpenMinute,
+                        Minutes - TradeCalendarIndex.AfternoonOpenMinute + HalfSession,
+                        np.minimum(Minutes - TradeCalendarIndex.MorningOpenMinute, HalfSession))
+
+    @classmethod
+    def ForArray(cls, Values, Groups, Window, SessionMinutes=None):
+        '''
+        2-分组滚动最大值、最小值
+        :param Values: 数值数组
+        :param Groups: 分组编号数组（整数），同一合约同一交易日编号相同
+        :param Window: 窗口长度，按行滚动时为行数，按时间滚动时为交易分钟数
+        :param SessionMinutes: 交易分钟序号，由SessionMinuteForArray生成；不传则按行滚动
+        :return: (max, min)，np.ndarray，与Values行顺序一致
+        '''
+        Values = np.asarray(Values, dtype=np.float64)
+        Groups = np.asarray(Groups, dtype=np.int64)
+        Rows = len(Values)
+        RollingMax = np.full(Rows, np.nan)
+        RollingMin = np.full(Rows, np.nan)
+        if Rows == 0:
+            return RollingMax, RollingMin
+        if SessionMinutes is None:
+            # 组内保持原来的行顺序，各组拼成连续区间
+            Order = np.argsort(Groups, kind="stable")
+        else:
+            SessionMinutes = np.asarray(SessionMinutes, dtype=np.int64)
+            Order = np.lexsort((SessionMinutes, Groups))
+        SortedValues = Values[Order]
+        SortedGroups = Groups[Order]
+        GroupStart = np.flatnonzero(np.r_[True, SortedGroups[1:] != SortedGroups[:-1]])
+        if SessionMinutes is None:
+            if Rows < Window:
+                return RollingMax, RollingMin
+            # 定长窗口直接用跨步视图，一次得到所有窗口
+            Windows = np.lib.stride_tricks.sliding_window_view(SortedValues, Window)
+            SortedMax = np.full(Rows, np.nan)
+            SortedMin = np.full(Rows, np.nan)
+            SortedMax[Window - 1:] = Windows.max(axis=1)
+            SortedMin[Window - 1:] = Windows.min(axis=1)
+            # 组内位置不足Window的行窗口跨越了分组起点
+            Position = np.arange(Rows) - np.repeat(GroupStart, np.diff(np.r_[GroupStart, Rows]))
+            Partial = Position < Window - 1
+            SortedMax[Partial] = np.nan
+            SortedMin[Partial] = np.nan
+        else:
+            # 变长窗口：按(分组,交易分钟)找到窗口起点，用reduceat在[起点,本行]上求最大最小值
+            SortedMinutes = SessionMinutes[Order]
+            Key = SortedGroups * (SortedMinutes.max() + Window + 1) + SortedMinutes
+            Start = np.searchsorted(Key, Key - Window + 1, side="left")
+            Indices = np.empty(2 * Rows, dtype=np.int64)
+            Indices[0::2] = Start
+            Indices[1::2] = np.arange(1, Rows + 1)
+            Padded = np.r_[SortedValues, np.nan]
+            SortedMax = np.maximum.reduceat(Padded, Indices)[0::2]
+            SortedMin = np.minimum.reduceat(Padded, Indices)[0::2]
+        RollingMax[Order] = SortedMax
+        RollingMin[Order] = SortedMin
+        return RollingMax, RollingMin
+
+    @classmethod
+    def ForDataFrame(cls, DataFrame, Column, Window, GroupBy="windcode_op", TimeWindow=False):
+        '''
+        3-按字段名计算，按 GroupBy字段×datetime所在交易日 分组
+        :param DataFrame: pd.DataFrame，含datetime字段
+        :param Column: 需要滚动的字段名
+        :param Window: 窗口长度
+        :param GroupBy: 合约字段名
+        :param TimeWindow: 是否按交易分钟滚动，默认False按行滚动
+        :return: (max, min)，np.ndarray，与DataFrame行顺序一致
+        '''
+        DateTimes = DataFrame["datetime"].to_numpy(dtype="datetime64[ns]")
+        ContractCodes = pd.factorize(DataFrame[GroupBy])[0]
+        DateCodes = pd.factorize(DateTimes.astype("datetime64[D]"))[0]
+        Groups = ContractCodes.astype(np.int64) * (DateCodes.max() + 1) + DateCodes
+        SessionMinutes = cls.SessionMinuteForArray(DateTimes) if TimeWindow else None
+        return cls.ForArray(DataFrame[Column].to_numpy(dtype=np.float64), Groups, Window, SessionMinutes)
+
+
+class RollingWindow:
+    '''
+    定长滚动窗口（环形缓冲），每次写入O(1)均摊更新窗口最大值、最小值，用于实时滚动报警
+    *窗口未满或窗口内含空值时Max/Min返回nan，与pandas的rolling(Size).max()/min()一致
+    '''
+
+    def __init__(self, Size):
+        '''
+        :param Size: 窗口长度
+        '''
+        self.Size = Size
+        self.Clear()
+
+    def Clear(self):
+        '''
+        清空窗口，交易日切换时调用
+        '''
+        self.Count = 0
+        self.NanSequence = -1
+        # 单调队列，元素为(序号,值)，队首为窗口内最大值/最小值
+        self.MaxQueue = deque()
+        self.MinQueue = deque()
+
+    def Push(self, Value):
+        '''
+        写入一个值，滑出窗口的旧值自动丢弃
+        :param Value: float
+        '''
+        Sequence = self.Count
+        self.Count += 1
+        if Value != Value:
+            self.NanSequence = Sequence
+        else:
+            while self.MaxQueue and self.MaxQueue[-1][1] <= Value:
+                self.MaxQueue.pop()
+            self.MaxQueue.append((Sequence, Value))
+            while self.MinQueue and self.MinQueue[-1][1] >= Value:
+                self.MinQueue.pop()
+            self.MinQueue.append((Sequence, Value))
+        Oldest = self.Count - self.Size
+        while self.MaxQueue and self.MaxQueue[0][0] < Oldest:
+            self.MaxQueue.popleft()
+        while self.MinQueue and self.MinQueue[0][0] < Oldest:
+            self.MinQueue.popleft()
+
+    @property
+    def IsReady(self):
+        '''
+        窗口已满且不含空值
+        '''
+        return self.Count >= self.Size and self.NanSequence < self.Count - self.Size
+
+    @property
+    def Max(self):
+        return self.MaxQueue[0][1] if self.IsReady else np.nan
+
+    @property
+    def Min(self):
+        return self.MinQueue[0][1] if self.IsReady else np.nan
+
+
+class OptionRealTimeAlert:
+    '''
+    实时报警引擎，逐笔接收分钟行情，按合约维护定长滚动窗口，每个事件O(1)更新报警状态并立即返回触发的报警
+    报警口径与OptionHistoryAlertForMinuteData的滚动报警一致：
+    *隐含波动率瞬间偏离：同一合约同一交易日最近Bandwith分钟隐含波动率 |max/min-1|>=阈值，且max、min均>=0.0001
+    *价格瞬间偏离：同一合约同一交易日最近Bandwith分钟收盘价 |max/min-1|>=阈值，且max-min>=0.001
+    *平价关系偏离：同一时刻同到期月份同执行价格的认购认沽，正向平价比、反向平价比、多空隐含波动率比任一超过阈值，且两边隐含波动率均>=0.0001
+    1-逐笔更新OnBar
+    2-按分钟批量更新OnMinute，整分钟的隐含波动率向量化计算
+    3-用历史数据回放Replay
+    '''
+
+    ALERT_IMPLIED_VOLATILITY = "ImpliedVolatilityDeviate"
+    ALERT_OPTION_PRICE = "OptionPriceDeviate"
+    ALERT_OPTION_PARITY = "OptionParityDeviate"
+
+    def __init__(self, Bandwith=3, ImpliedVolatilityThreshold=0.0001, OptionPriceThreshold=0.1,
+                 ParityThreshold=(0.1, 0.1, 0.2), OnAlert=None, Context=None):
+        '''
+        :param Bandwith: 滚动区间，默认3min
+        :param ImpliedVolatilityThreshold: 隐含波动率偏离阈值，同RollAlert_ImpliedVolatilityDeviate_Result的Arg1_Value
+        :param OptionPriceThreshold: 价格偏离阈值，同RollAlert_OptionPriceDeviate_Resultt的Arg1_Value
+        :param ParityThreshold: (正向平价比,反向平价比,多空隐含波动率比)阈值，同RollAlert_OptionParityDeviate_Result
+        :param OnAlert: 报警回调函数OnAlert(报警dict)，不传则只通过返回值取得报警
+        :param Context: 运行环境，默认GetContext()
+        '''
+        self.Bandwith = Bandwith
+        self.ImpliedVolatilityThreshold = ImpliedVolatilityThreshold
+        self.OptionPriceThreshold = OptionPriceThreshold
+        self.ParityThreshold = ParityThreshold
+        self.OnAlert = OnAlert
+        self.Context = Context
+        self.ContractState = {}
+        # (到期月份,执行价格) -> {是否认购: 合约代码}，用于O(1)找到平价关系的另一方向合约
+        self.PairIndex = {}
+
+    def GetContractState(self, WindCode):
+        '''
+        取合约状态，第一次出现时从合约数据集读取认购认沽、执行价格、到期月份、行权日
+        '''
+        State = self.ContractState.get(WindCode)
+        if State is None:
+            Context = GetContext() if self.Context is None else self.Context
+            Information = Context.ContractSetData.loc[WindCode]
+            State = {"WindCode": WindCode, "IsCall": Information["call_or_put"] == "认购",
+                     "ExercisePrice": float(Information["exercise_price"]),
+                     "LimitMonth": Information["limit_month"],
+                     "ExerciseDate": Information["exercise_date"],
+                     "ImpliedVolatilityWindow": RollingWindow(self.Bandwith),
+                     "CloseWindow": RollingWindow(self.Bandwith),
+                     "Date": None, "DateTime": None, "TimeToExpiry": np.nan}
+            State["PairKey"] = (State["LimitMonth"], State["ExercisePrice"])
+            self.PairIndex.setdefault(State["PairKey"], {})[State["IsCall"]] = WindCode
+            self.ContractState[WindCode] = State
+        return State
+
+    def TimeToExpiry(self, State, DateTime):
+        '''
+        合约到期时间（年），同一交易日只计算一次
+        '''
+        Context = GetContext() if self.Context is None else self.Context
+        return float(Context.TradeCalendarIndex.TimeToExpiryForArray([DateTime], [State["ExerciseDate"]])[0])
+
+    def ImpliedVolatility(self, State, Close, UnderlyingClose, TimeToExpiry):
+        '''
+        单个合约的隐含波动率，参数同ComputeGreeksForListedContract
+        '''
+        return float(OptionGreeksMethod.ImpliedVolatilityForArray(
+            np.array([State["IsCall"]]), np.array([UnderlyingClose], dtype=np.float64), State["ExercisePrice"],
+            TimeToExpiry, InterestRate, DividendRate, np.array([Close], dtype=np.float64))[0])
+
+    def Emit(self, Alerts, Alert):
+        Alerts.append(Alert)
+        if self.OnAlert is not None:
+            self.OnAlert(Alert)
+
+    def OnBar(self, WindCode, DateTime, Close, UnderlyingClose, ImpliedVolatility=None, TimeToExpiry=None):
+        '''
+        1-逐笔更新，接收一个合约一分钟的行情，返回本事件触发的报警
+        :param WindCode: 合约代码
+        :param DateTime: pd.Timestamp或datetime.datetime
+        :param Close: 期权收盘价close_op
+        :param UnderlyingClose: 标的收盘价close_etf
+        :param ImpliedVolatility: 隐含波动率，不传则由价格计算
+        :param TimeToExpiry: 到期时间（年），不传则由交易日历计算
+        :return: list，元素为报警dict，含AlertType、datetime、windcode及相应指标
+        '''
+        State = self.GetContractState(WindCode)
+        Date = DateTime.date()
+        if Date != State["Date"]:
+            # 滚动窗口按交易日分组，与groupby(["windcode_op","date_op_str"])一致
+            State["Date"] = Date
+            State["ImpliedVolatilityWindow"].Clear()
+            State["CloseWindow"].Clear()
+            State["TimeToExpiry"] = np.nan
+        if TimeToExpiry is None:
+            if State["TimeToExpiry"] != State["TimeToExpiry"]:
+                State["TimeToExpiry"] = self.TimeToExpiry(State, DateTime)
+            TimeToExpiry = State["TimeToExpiry"]
+        if ImpliedVolatility is None:
+            ImpliedVolatility = self.ImpliedVolatility(State, Close, UnderlyingClose, TimeToExpiry)
+        State["DateTime"] = DateTime
+        State["Close"] = np.float64(Close)
+        State["UnderlyingClose"] = np.float64(UnderlyingClose)
+        State["ImpliedVolatility"] = np.float64(ImpliedVolatility)
+        State["TimeToExpiry"] = TimeToExpiry
+        Alerts = []
+        # 隐含波动率瞬间偏离
+        Window = State["ImpliedVolatilityWindow"]
+        Window.Push(ImpliedVolatility)
+        if Window.IsReady and Window.Max >= 0.0001 and Window.Min >= 0.0001:
+            Ratio = abs(Window.Max / Window.Min - 1)
+            if Ratio >= self.ImpliedVolatilityThreshold:
+                self.Emit(Alerts, {"AlertType": self.ALERT_IMPLIED_VOLATILITY, "datetime": DateTime,
+                                   "windcode": WindCode, "ImpliedVolatility_Rolling_Max": Window.Max,
+                                   "ImpliedVolatility_Rolling_Min": Window.Min,
+                                   "ImpliedVolatilityDeviateRatio": Ratio})
+        # 价格瞬间偏离
+        Window = State["CloseWindow"]
+        Window.Push(Close)
+        if Window.IsReady and Window.Max - Window.Min >= 0.001:
+            Ratio = abs(Window.Max / Window.Min - 1)
+            if Ratio >= self.OptionPriceThreshold:
+                self.Emit(Alerts, {"AlertType": self.ALERT_OPTION_PRICE, "datetime": DateTime, "windcode": WindCode,
+                                   "close_op_Rolling_Max": Window.Max, "close_op_Rolling_Min": Window.Min,
+                                   "OptionPriceDeviateRatio": Ratio})
+        # 平价关系偏离，同一时刻认购认沽都到齐时计算一次
+        Pair = self.PairState(State)
+        if Pair is not None:
+            Call, Put = (State, Pair) if State["IsCall"] else (Pair, State)
+            DiscountExercise = State["ExercisePrice"] * np.exp(-(Call["TimeToExpiry"] * InterestRate))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ForwardRatio = (Call["Close"] + DiscountExercise) / (Put["Close"] + Call["UnderlyingClose"]) - 1
+                BackwardRatio = (Put["Close"] + Call["UnderlyingClose"]) / (Call["Close"] + DiscountExercise) - 1
+                ImpliedVolatilityRatio = Call["ImpliedVolatility"] / Put["ImpliedVolatility"] - 1
+            if (ForwardRatio >= self.ParityThreshold[0] or BackwardRatio >= self.ParityThreshold[1] or
+                ImpliedVolatilityRatio >= self.ParityThreshold[2]) and Call["ImpliedVolatility"] >= 0.0001 and Put[
+                    "ImpliedVolatility"] >= 0.0001:
+                self.Emit(Alerts, {"AlertType": self.ALERT_OPTION_PARITY, "datetime": DateTime,
+                                   "windcode": Call["WindCode"], "windcode_put": Put["WindCode"],
+                                   "Forward_Parity_Ratio": ForwardRatio, "Backward_Parity_Ratio": BackwardRatio,
+                                   "Call_Put_ImpliedVolatility_Ratio": ImpliedVolatilityRatio})
+        return Alerts
+
+    def PairState(self, State):
+        '''
+        取同到期月份同执行价格的另一方向合约状态，只有同一时刻已有行情时返回
+        '''
+        PairCode = self.PairIndex[State["PairKey"]].get(not State["IsCall"])
+        if PairCode is None:
+            return None
+        Pair = self.ContractState[PairCode]
+        return Pair if Pair["DateTime"] == State["DateTime"] else None
+
+    def OnMinute(self, MinuteData):
+        '''
+        2-按分钟批量更新，MinuteData为同一分钟各合约的行情，未含ImpliedVolatility字段时整分钟向量化计算
+        :param MinuteData: pd.DataFrame，字段同GetDataForListedContractAndUnderlyingSecurity的返回值，
+                           至少包含windcode_op、datetime、close_op、close_etf，可选time_to_exercise、ImpliedVolatility
+        :return: list，本分钟触发的报警
+        '''
+        if "time_to_exercise" in MinuteData.columns:
+            TimeToExpiry = MinuteData["time_to_exercise"].to_numpy(dtype=np.float64)
+        else:
+            TimeToExpiry = [None] * len(MinuteData.index)
+        if "ImpliedVolatility" in MinuteData.columns:
+            ImpliedVolatility = MinuteData["ImpliedVolatility"].to_numpy(dtype=np.float64)
+        elif "time_to_exercise" in MinuteData.columns and "call_or_put" in MinuteData.columns:
+            ImpliedVolatility = OptionGreeksMethod.ImpliedVolatilityForArray(
+                OptionGreeksMethod.CallOrPutMaskForArray(MinuteData["call_or_put"]),
+                MinuteData["close_etf"].to_numpy(dtype=np.float64),
+                MinuteData["exercise_price"].to_numpy(dtype=np.float64), TimeToExpiry, InterestRate, DividendRate,
+                MinuteData["close_op"].to_numpy(dtype=np.float64))
+        else:
+            ImpliedVolatility = [None] * len(MinuteData.index)
+        Alerts = []
+        for WindCode, DateTime, Close, UnderlyingClose, Volatility, Time in zip(
+                MinuteData["windcode_op"], MinuteData["datetime"], MinuteData["close_op"].to_numpy(dtype=np.float64),
+                MinuteData["close_etf"].to_numpy(dtype=np.float64), ImpliedVolatility, TimeToExpiry):
+            Alerts += self.OnBar(WindCode, DateTime, Close, UnderlyingClose, Volatility, Time)
+        return Alerts
+
+    def Replay(self, ListedContractData):
+        '''
+        3-用历史数据按分钟顺序回放，用于核对实时报警与历史回测结果、测量每分钟延迟
+        :param ListedContractData: 格式同GetDataForListedContractAndUnderlyingSecurity的返回值
+        :return: pd.DataFrame，所有触发的报警
+        '''
+        Alerts = []
+        for DateTime, MinuteData in ListedContractData.groupby("datetime", sort=True):
+            Alerts += self.OnMinute(MinuteData)
+        return pd.DataFrame(Alerts)
+
 
-# todo 期权报警测算类，基于不同的参数阈值回测进行敏感性分析
+# 期权报警测算类，基于不同的参数阈值回测进行敏感性分析
 class OptionHistoryAlertMeasure(OptionHistoryAlertForMinuteData):
     '''
-    报警回测，进行敏感性分析
+    报警回测，进行敏感性分析：一次计算阈值网格（及滚动区间）所有组合的报警次数、各合约命中率和首次报警时间
+    *不再对每个阈值调用RollAlert_XXXX_Result重新筛选，每行按比值落在阈值网格中的位置编号，
+     用直方图累计计数得到所有组合的结果；多个阈值之间为"或"关系时，不报警的行数为多维累计直方图
+    *首次报警时间：各维度按"比值超过第j个阈值的最早时间"做反向累计最小值，多维时取各维度的最小值
+    1-阈值网格扫描SweepForArray
+    2-隐含波动率瞬间偏离扫描SweepImpliedVolatilityDeviate
+    3-价格瞬间偏离扫描SweepOptionPriceDeviate
+    4-平价关系偏离扫描SweepOptionParityDeviate
     '''
-    pass
+
+    NEVER = np.iinfo(np.int64).max
+
+    @classmethod
+    def SweepForArray(cls, Ratios, Grids, Eligible, Groups, Times):
+        '''
+        1-阈值网格扫描，某行在组合(j1,j2,...)下报警当且仅当存在某个维度i使Ratios[i]>=Grids[i][ji]，且Eligible为True
+        :param Ratios: 各维度的比值数组list，与阈值网格一一对应
+        :param Grids: 各维度的阈值网格list，需升序且不重复
+        :param Eligible: bool数组，除阈值以外的筛选条件，为False的行不报警
+        :param Groups: 合约编号数组（0开始的整数）
+        :param Times: 时间数组，int64（纳秒）
+        :return: dict，键为Count（各组合报警次数）、GroupCount（合约×组合报警次数）、FirstTime（各组合首次报警时间）、
+                 GroupFirstTime（合约×组合首次报警时间），形状分别为网格形状及(合约数,)+网格形状，未报警的时间为NEVER
+        '''
+        Shape = tuple(len(x) for x in Grids)
+        GroupNumber = int(Groups.max()) + 1 if len(Groups) else 0
+        Bins = []
+        for Ratio, Grid in zip(Ratios, Grids):
+            # 比值落在网格中的位置：比值>=前Bin个阈值，Bin为0表示一个阈值都不超过；空值不报警
+            Bin = np.searchsorted(Grid, Ratio, side="right")
+            Bin[~Eligible | np.isnan(Ratio)] = 0
+            Bins.append(Bin)
+        # 不报警的行数：各维度Bin都不超过组合下标，即多维累计直方图
+        HistogramShape = (GroupNumber,) + tuple(x + 1 for x in Shape)
+        Flat = np.ravel_multi_index((Groups,) + tuple(Bins), HistogramShape)
+        Histogram = np.bincount(Flat, minlength=int(np.prod(HistogramShape))).reshape(HistogramShape)
+        for Axis in range(1, len(HistogramShape)):
+            Histogram = np.cumsum(Histogram, axis=Axis)
+        GroupRows = Histogram[(slice(None),) + tuple(-1 for _ in Shape)]
+        GroupSilent = Histogram[(slice(None),) + tuple(slice(0, x) for x in Shape)]
+        GroupCount = GroupRows.reshape((-1,) + (1,) * len(Shape)) - GroupSilent
+        # 首次报警时间：维度i上比值超过第j个阈值的最早时间，取各维度最小值
+        GroupFirstTime = np.full((GroupNumber,) + Shape, cls.NEVER, dtype=np.int64)
+        for i, (Bin, n) in enumerate(zip(Bins, Shape)):
+            BinFirstTime = np.full((GroupNumber, n + 1), cls.NEVER, dtype=np.int64)
+            np.minimum.at(BinFirstTime, (Groups, Bin), Times)
+            # 超过第j个阈值即Bin>j，对Bin反向累计最小值
+            AxisFirstTime = np.minimum.accumulate(BinFirstTime[:, ::-1], axis=1)[:, ::-1][:, 1:]
+            Index = [np.newaxis] * len(Shape)
+            Index[i] = slice(None)
+            GroupFirstTime = np.minimum(GroupFirstTime, AxisFirstTime[(slice(None),) + tuple(Index)])
+        return {"Count": GroupCount.sum(axis=0), "GroupCount": GroupCount, "GroupRows": GroupRows,
+                "FirstTime": GroupFirstTime.min(axis=0, initial=cls.NEVER), "GroupFirstTime": GroupFirstTime}
+
+    @classmethod
+    def SweepToDataFrame(cls, Sweep, Grids, GridNames, GroupNames, PerContract, Extra=None):
+        '''
+        把SweepForArray的结果整理为pd.DataFrame，每个组合一行；PerContract=True时同时返回每个合约每个组合一行的明细
+        '''
+        Combinations = np.meshgrid(*Grids, indexing="ij")
+        Rows = Sweep["GroupRows"].sum()
+        result = pd.DataFrame({Name: x.ravel() for Name, x in zip(GridNames, Combinations)})
+        for Key, Value in (Extra or {}).items():
+            result.insert(0, Key, Value)
+        result["AlertCount"] = Sweep["Count"].ravel()
+        result["AlertContractCount"] = (Sweep["GroupCount"] > 0).reshape(len(GroupNames), -1).sum(axis=0)
+        result["HitRate"] = result["AlertCount"] / Rows if Rows else np.nan
+        FirstTime = Sweep["FirstTime"].ravel()
+        result["FirstFireTime"] = pd.to_datetime(np.where(FirstTime == cls.NEVER, np.iinfo(np.int64).min, FirstTime))
+        if not PerContract:
+            return result
+        Combination = len(result.index)
+        Detail = pd.DataFrame({Name: np.tile(x.ravel(), len(GroupNames)) for Name, x in zip(GridNames, Combinations)})
+        for Key, Value in (Extra or {}).items():
+            Detail.insert(0, Key, Value)
+        Detail.insert(0, "windcode", np.repeat(np.asarray(GroupNames), Combination))
+        Detail["AlertCount"] = Sweep["GroupCount"].ravel()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            Detail["HitRate"] = Detail["AlertCount"] / np.repeat(Sweep["GroupRows"], Combination)
+        FirstTime = Sweep["GroupFirstTime"].ravel()
+        Detail["FirstFireTime"] = pd.to_datetime(np.where(FirstTime == cls.NEVER, np.iinfo(np.int64).min, FirstTime))
+        return result, Detail
+
+    def SweepRollingDeviate(self, Column, Thresholds, Bandwiths, TimeWindow, PerContract, Eligible):
+        '''
+        隐含波动率、价格瞬间偏离扫描的公共部分，每个滚动区间只计算一次滚动最大最小值
+        '''
+        Data = self.ListedContractDataWithGreeks
+        Grid = np.unique(np.asarray(Thresholds, dtype=np.float64))
+        Groups, GroupNames = pd.factorize(Data["windcode_op"])
+        Times = Data["datetime"].to_numpy(dtype="datetime64[ns]").astype(np.int64)
+        Summary, Detail = [], []
+        for Bandwith in Bandwiths:
+            RollingMax, RollingMin = RollingExtrema.ForDataFrame(Data, Column, Bandwith, TimeWindow=TimeWindow)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                Ratio = np.abs(RollingMax / RollingMin - 1)
+                Mask = Eligible(RollingMax, RollingMin) & np.isfinite(RollingMax) & np.isfinite(RollingMin)
+            Sweep = self.SweepForArray([Ratio], [Grid], Mask, Groups, Times)
+            result = self.SweepToDataFrame(Sweep, [Grid], ["Arg1_Value"], GroupNames, PerContract,
+                                           {"bandwith": Bandwith})
+            if PerContract:
+                Summary.append(result[0])
+                Detail.append(result[1])
+            else:
+                Summary.append(result)
+        Summary = pd.concat(Summary, ignore_index=True)
+        if PerContract:
+            return Summary, pd.concat(Detail, ignore_index=True)
+        return Summary
+
+    def SweepImpliedVolatilityDeviate(self, Thresholds, Bandwiths=(3,), TimeWindow=False, PerContract=False):
+        '''
+        2-隐含波动率瞬间偏离扫描，结果同对每个滚动区间调用RollAlert_ImpliedVolatilityDeviate_RawData、
+        对每个阈值调用RollAlert_ImpliedVolatilityDeviate_Result
+        :param Thresholds: Arg1_Value网格
+        :param Bandwiths: 滚动区间网格
+        :param TimeWindow: 是否按交易分钟滚动
+        :param PerContract: 是否同时返回各合约明细
+        :return: pd.DataFrame，每个(bandwith,Arg1_Value)组合一行：AlertCount、AlertContractCount、HitRate、FirstFireTime；
+                 PerContract=True时返回(汇总, 各合约明细)
+        '''
+        return self.SweepRollingDeviate("ImpliedVolatility", Thresholds, Bandwiths, TimeWindow, PerContract,
+                                        lambda Max, Min: (Max >= 0.0001) & (Min >= 0.0001))
+
+    def SweepOptionPriceDeviate(self, Thresholds, Bandwiths=(3,), TimeWindow=False, PerContract=False):
+        '''
+        3-价格瞬间偏离扫描，结果同RollAlert_OptionPriceDeviate_RawData和RollAlert_OptionPriceDeviate_Resultt，参数同2
+        '''
+        return self.SweepRollingDeviate("close_op", Thresholds, Bandwiths, TimeWindow, PerContract,
+                                        lambda Max, Min: (Max - Min) >= 0.001)
+
+    def SweepOptionParityDeviate(self, Arg1Values, Arg2Values, Arg3Values, PerContract=False):
+        '''
+        4-平价关系偏离扫描，结果同对每组阈值调用RollAlert_OptionParityDeviate_Result，合约按认购合约统计
+        :param Arg1Values: 正向平价比阈值网格
+        :param Arg2Values: 反向平价比阈值网格
+        :param Arg3Values: 多空隐含波动率比阈值网格
+        :param PerContract: 是否同时返回各合约明细
+        :return: pd.DataFrame，每个(Arg1_Value,Arg2_Value,Arg3_Value)组合一行；PerContract=True时返回(汇总, 各合约明细)
+        '''
+        Data = self.RollAlert_OptionParityDeviate_Compact()
+        Grids = [np.unique(np.asarray(x, dtype=np.float64)) for x in (Arg1Values, Arg2Values, Arg3Values)]
+        Groups, GroupNames = pd.factorize(Data["windcode_op_call"])
+        Eligible = (Data["ImpliedVolatility_call"].to_numpy() >= 0.0001) & (
+                Data["ImpliedVolatility_put"].to_numpy() >= 0.0001)
+        Sweep = self.SweepForArray([Data["Forward_Parity_Ratio"].to_numpy(), Data["Backward_Parity_Ratio"].to_numpy(),
+                                    Data["Call_Put_ImpliedVolatility_Ratio"].to_numpy()], Grids, Eligible, Groups,
+                                   Data["datetime"].to_numpy(dtype="datetime64[ns]").astype(np.int64))
+        return self.SweepToDataFrame(Sweep, Grids, ["Arg1_Value", "Arg2_Value", "Arg3_Value"], GroupNames,
+                                     PerContract)
 
 
 # todo 画图
+class BacktestCheckpoint:
+    '''
+    回测断点，按 参数/交易日 分区保存每天的计算结果，进程中断后重跑时跳过已完成的交易日
+    *目录结构：CheckpointDir/greeks/<参数键>/2019-10-31.pkl、CheckpointDir/alerts/<参数键>/2019-10-31.pkl
+    *参数键为参数json的sha1前16位，同目录下params.json保存参数原文
+    *greeks分区只与取数和定价参数有关，只改报警阈值、窗宽时直接复用，不再请求wind、重算greeks
+    *只保存已经收盘的交易日（早于今天），写入时先写临时文件再替换
+    '''
+
+    def __init__(self, CheckpointDir=None):
+        '''
+        :param CheckpointDir: 断点目录，默认取环境变量OPTIONALERT_CHECKPOINT_DIR，未设置时为当前目录下的cache/backtest
+        '''
+        if CheckpointDir is None:
+            CheckpointDir = os.environ.get("OPTIONALERT_CHECKPOINT_DIR", os.path.join("cache", "backtest"))
+        self.CheckpointDir = CheckpointDir
+
+    @classmethod
+    def Key(cls, Params):
+        '''
+        参数键
+        :param Params: dict，值须可json序列化
+        :return: str
+        '''
+        return hashlib.sha1(json.dumps(Params, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+    def PartitionPath(self, Kind, Params, TradeDate):
+        '''
+        返回分区文件路径
+        :param Kind: "greeks"或"alerts"
+        :param Params: 参数dict
+        :param TradeDate: datetime.date
+        :return:
+        '''
+        return os.path.join(self.CheckpointDir, Kind, self.Key(Params), TradeDate.strftime("%Y-%m-%d") + ".pkl")
+
+    def ReadPartition(self, Kind, Params, TradeDate):
+        '''
+        读取分区，不存在时返回None
+        '''
+        path = self.PartitionPath(Kind, Params, TradeDate)
+        if not os.path.exists(path):
+            return None
+        return pd.read_pickle(path)
+
+    def WritePartition(self, Kind, Params, TradeDate, Data):
+        '''
+        写入分区，当天及以后的交易日不写
+        :param Data: pd.DataFrame或dict
+        :return:
+        '''
+        if TradeDate >= dt.date.today():
+            return
+        path = self.PartitionPath(Kind, Params, TradeDate)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        ParamsPath = os.path.join(os.path.dirname(path), "params.json")
+        if not os.path.exists(ParamsPath):
+            with open(ParamsPath, "w", encoding="utf-8") as f:
+                json.dump(Params, f, sort_keys=True, ensure_ascii=False, indent=2)
+        TempPath = path + ".tmp"
+        pd.to_pickle(Data, TempPath)
+        os.replace(TempPath, path)
+
+
+class OptionAlertBacktest:
+    '''
+    按交易日分段的历史回测，逐日取数、计算greeks、跑滚动报警，只保留触发的报警，内存占用与回测区间长度无关
+    *后台线程预取后面Prefetch个交易日的数据，当天计算时下一天的wind请求同时进行
+    *滚动窗口按 合约×交易日 分组（同RollAlert_*_RawData），跨交易日不需要携带窗口状态，当天数据算完即释放
+    *报警口径与 RollAlert_*_RawData + RollAlert_*_Result 一致，平价关系偏离用RollAlert_OptionParityDeviate_Compact
+    *传入Checkpoint时每天的greeks和报警写入断点，重跑时已完成的交易日直接读取，从第一个缺失的交易日继续；
+     只改报警参数时复用greeks断点，见BacktestCheckpoint
+    1-逐日回测Iterate，生成器，每个交易日返回一次当天的报警
+    2-整段回测Run，返回各类报警合并后的结果
+    # Backtest = OptionAlertBacktest(Prefetch=2, Compact=True)
+    # Alerts = Backtest.Run("2019-01-02", "2019-12-31")
+    # Alerts = OptionAlertBacktest(Checkpoint=BacktestCheckpoint("cache/backtest")).Run("2019-01-02", "2019-12-31")
+    '''
+
+    ALERT_TYPES = (OptionRealTimeAlert.ALERT_IMPLIED_VOLATILITY, OptionRealTimeAlert.ALERT_OPTION_PRICE,
+                   OptionRealTimeAlert.ALERT_OPTION_PARITY)
+
+    def __init__(self, Bandwith=3, ImpliedVolatilityThreshold=0.0001, OptionPriceThreshold=0.1,
+                 ParityThreshold=(0.1, 0.1, 0.2), TimeWindow=False, Prefetch=1, Compact=None, Intraday=False,
+                 Checkpoint=None, Greeks=None):
+        '''
+        :param Bandwith: 滚动区间，默认3min
+        :param ImpliedVolatilityThreshold: 隐含波动率偏离阈值，同RollAlert_ImpliedVolatilityDeviate_Result的Arg1_Value
+        :param OptionPriceThreshold: 价格偏离阈值，同RollAlert_OptionPriceDeviate_Resultt的Arg1_Value
+        :param ParityThreshold: (正向平价比,反向平价比,多空隐含波动率比)阈值，同RollAlert_OptionParityDeviate_Result
+        :param TimeWindow: 是否按交易分钟滚动，同RollAlert_*_RawData
+        :param Prefetch: 预取的交易日数，0则不预取，取数和计算依次进行
+        :param Compact: 是否使用压缩模式取数，默认OptionMinuteData.CompactMode
+        :param Intraday: 到期时间是否扣除当天已经过去的交易时间，默认False
+        :param Checkpoint: 断点BacktestCheckpoint，默认None不保存断点
+        :param Greeks: 需要计算的希腊字母，取自GREEKS_ALL，默认GREEKS_DEFAULT
+        '''
+        self.Bandwith = Bandwith
+        self.ImpliedVolatilityThreshold = ImpliedVolatilityThreshold
+        self.OptionPriceThreshold = OptionPriceThreshold
+        self.ParityThreshold = ParityThreshold
+        self.TimeWindow = TimeWindow
+        self.Prefetch = Prefetch
+        self.Compact = OptionMinuteData.CompactMode if Compact is None else Compact
+        self.Intraday = Intraday
+        self.Checkpoint = Checkpoint
+        self.Greeks = OptionGreeksMethod.GREEKS_DEFAULT if Greeks is None else tuple(Greeks)
+
+    @property
+    def GreeksParams(self):
+        '''
+        决定greeks结果的参数，用作greeks断点的键；含定价代码版本，定价或求解代码修改后不再复用旧断点
+        '''
+        return {"Underlying": GetContext().Underlying, "InterestRate": InterestRate, "DividendRate": DividendRate,
+                "Compact": bool(self.Compact), "Intraday": bool(self.Intraday), "Greeks": list(self.Greeks),
+                "PricingVersion": GreeksResultCache.PricingVersion()}
+
+    @property
+    def AlertParams(self):
+        '''
+        决定报警结果的参数，用作报警断点的键
+        '''
+        return dict(self.GreeksParams, Bandwith=self.Bandwith,
+                    ImpliedVolatilityThreshold=self.ImpliedVolatilityThreshold,
+                    OptionPriceThreshold=self.OptionPriceThreshold, ParityThreshold=list(self.ParityThreshold),
+                    TimeWindow=bool(self.TimeWindow))
+
+    def LoadDay(self, TradeDate):
+        '''
+        取一个交易日的数据
+        :param TradeDate: datetime.date
+        :return: pd.DataFrame，格式同GetDataForListedContractAndUnderlyingSecurity
+        '''
+        TradeDate = TradeDate.strftime("%Y-%m-%d")
+        return OptionMinuteData.GetDataForListedContractAndUnderlyingSecurity(
+            TradeDate + " " + MinuteDataCache.SessionStartTime, TradeDate + " " + MinuteDataCache.SessionEndTime,
+            Intraday=self.Intraday, Compact=self.Compact)
+
+    def ComputeDay(self, DayData):
+        '''
+        计算一个交易日的greeks及三类滚动报警
+        :param DayData: LoadDay的结果
+        :return: dict，ALERT_TYPES -> 当天触发的报警pd.DataFrame
+        '''
+        return self.AlertDay(self.GreeksDay(DayData))
+
+    def GreeksDay(self, DayData):
+        '''
+        计算一个交易日的greeks
+        :param DayData: LoadDay的结果
+        :return: pd.DataFrame
+        '''
+        if not len(DayData.index):
+            return DayData
+        return OptionMinuteData.ComputeGreeksForListedContract(DayData, Greeks=self.Greeks)
+
+    def AlertDay(self, GreeksData):
+        '''
+        计算一个交易日的三类滚动报警，三类报警在线程池中同时计算，不修改GreeksData
+        :param GreeksData: GreeksDay的结果
+        :return: dict，ALERT_TYPES -> 当天触发的报警pd.DataFrame
+        '''
+        if not len(GreeksData.index):
+            return {x: pd.DataFrame() for x in self.ALERT_TYPES}
+        Alert = OptionHistoryAlertForMinuteData.FromListedContractData(GreeksData)
+        return Alert.RollAlert_Concurrent(self.Bandwith, self.ImpliedVolatilityThreshold, self.OptionPriceThreshold,
+                                          self.ParityThreshold, self.TimeWindow)
+
+    def Iterate(self, StartDate, EndDate):
+        '''
+        1-逐日回测，有断点时已完成的交易日直接读取，只向wind请求没有greeks断点的交易日
+        :param StartDate: "%Y-%m-%d"
+        :param EndDate: "%Y-%m-%d"
+        :return: 生成器，每个交易日返回(datetime.date, ComputeDay的结果)
+        '''
+        TradeDays = GetContext().TradeCalendarIndex.TradeCalendarStartToEnd(StartDate, EndDate)
+        Executor = ThreadPoolExecutor(max_workers=1) if self.Prefetch > 0 else None
+        # 单线程按交易日顺序取数，最多提前Prefetch天；已有断点的交易日不取数
+        Pending = deque()
+        try:
+            for TradeDate in TradeDays:
+                Pending.append((TradeDate, self.Resume(TradeDate, Executor)))
+                while Pending and (len(Pending) > self.Prefetch or Executor is None):
+                    yield self.Finish(*Pending.popleft())
+            while Pending:
+                yield self.Finish(*Pending.popleft())
+        finally:
+            if Executor is not None:
+                for TradeDate, Future in Pending:
+                    if Future is not None and not isinstance(Future, dict):
+                        Future.cancel()
+                Executor.shutdown(wait=True)
+
+    def Resume(self, TradeDate, Executor):
+        '''
+        查找交易日的断点
+        :return: 报警断点dict；greeks断点pd.DataFrame；都没有时返回取数的Future（Executor为None时为None，由Finish取数）
+        '''
+        if self.Checkpoint is not None:
+            Alerts = self.Checkpoint.ReadPartition("alerts", self.AlertParams, TradeDate)
+            if Alerts is not None:
+                return Alerts
+            GreeksData = self.Checkpoint.ReadPartition("greeks", self.GreeksParams, TradeDate)
+            if GreeksData is not None:
+                return GreeksData
+        return None if Executor is None else Executor.submit(self.LoadDay, TradeDate)
+
+    def Finish(self, TradeDate, Resumed):
+        '''
+        完成一个交易日：计算缺失的greeks、报警并写入断点
+        :return: (datetime.date, ComputeDay的结果)
+        '''
+        if isinstance(Resumed, dict):
+            return TradeDate, Resumed
+        if isinstance(Resumed, pd.DataFrame):
+            GreeksData = Resumed
+        else:
+            GreeksData = self.GreeksDay(self.LoadDay(TradeDate) if Resumed is None else Resumed.result())
+            if self.Checkpoint is not None:
+                self.Checkpoint.WritePartition("greeks", self.GreeksParams, TradeDate, GreeksData)
+        Alerts = self.AlertDay(GreeksData)
+        if self.Checkpoint is not None:
+            self.Checkpoint.WritePartition("alerts", self.AlertParams, TradeDate, Alerts)
+        return TradeDate, Alerts
+
+    def Run(self, StartDate, EndDate):
+        '''
+        2-整段回测
+        :param StartDate: "%Y-%m-%d"
+        :param EndDate: "%Y-%m-%d"
+        :return: dict，ALERT_TYPES -> 区间内触发的报警pd.DataFrame
+        '''
+        Alerts = {x: [] for x in self.ALERT_TYPES}
+        for TradeDate, DayAlerts in self.Iterate(StartDate, EndDate):
+            for x in self.ALERT_TYPES:
+                if len(DayAlerts[x].index):
+                    Alerts[x].append(DayAlerts[x])
+        return {x: pd.concat(Alerts[x], ignore_index=True) if Alerts[x] else pd.DataFrame() for x in
+                self.ALERT_TYPES}
+
+
+class MultiUnderlyingBacktest:
+    '''
+    多标的回测，每个标的一个运行环境（合约数据集、标的行情按标的区分），各标的的 取数-greeks-报警 在独立进程中同时进行
+    *交易日历在主进程加载一次，传给各子进程，子进程不再向数据接口请求
+    *分钟行情缓存按标的分区、greeks缓存按内容寻址、断点按参数（含标的）分区，各进程共用同一套磁盘缓存
+    *数据接口每个进程各自连接；传入Provider时须可以pickle（如ReplayProvider），默认子进程由DefaultProvider()创建
+    *Workers为1时在当前进程依次运行，每个标的临时切换运行环境，结束后恢复
+    *进程池用spawn方式启动（numba并行内核不支持fork），OptionMinuteData的缓存、分块取数、并行计算、压缩模式设置
+     及计算后端在创建时记录，子进程中恢复
+    # Backtest = MultiUnderlyingBacktest(["510050.SH", "510300.SH", "159919.SZ"], Compact=True)
+    # Alerts = Backtest.Run("2019-12-02", "2019-12-31")
+    '''
+
+    # 传给子进程的OptionMinuteData类属性
+    SETTINGS = ("MinuteCache", "FetchPlanner", "GreeksWorkers", "GreeksChunkSize", "GreeksShardBy", "GreeksCache",
+                "CompactMode")
+
+    def __init__(self, Underlyings, Workers=None, Provider=None, ContractSets=None, **BacktestParams):
+        '''
+        :param Underlyings: 标的代码列表，如["510050.SH", "510300.SH"]
+        :param Workers: 进程数，默认min(标的数, os.cpu_count())
+        :param Provider: 子进程使用的数据接口，默认None由子进程自行创建
+        :param ContractSets: dict，标的代码 -> 期权合约数据集，不传的标的在子进程中第一次使用时加载
+        :param BacktestParams: OptionAlertBacktest的参数，各标的相同
+        '''
+        self.Underlyings = list(dict.fromkeys(Underlyings))
+        self.Workers = min(len(self.Underlyings), os.cpu_count() if Workers is None else Workers)
+        self.Provider = Provider
+        self.ContractSets = {} if ContractSets is None else ContractSets
+        self.BacktestParams = BacktestParams
+        self.Settings = {x: getattr(OptionMinuteData, x) for x in self.SETTINGS}
+        self.Backend = OptionGreeksMethod.Backend
+
+    def Context(self, Underlying, TradeDays=None):
+        '''
+        标的的运行环境，TradeDays为None时与当前运行环境共用数据接口和交易日历
+        :param Underlying: 标的代码
+        :param TradeDays: 交易日列表，用于子进程预加载交易日历
+        :return: OptionContext
+        '''
+        if TradeDays is None:
+            return GetContext().ForUnderlying(Underlying, ContractSetData=self.ContractSets.get(Underlying))
+        return OptionContext(ContractSetData=self.ContractSets.get(Underlying), Provider=self.Provider,
+                             TradeDays=TradeDays, Underlying=Underlying)
+
+    def RunUnderlying(self, Underlying, StartDate, EndDate, TradeDays=None):
+        '''
+        在标的的运行环境中跑OptionAlertBacktest，结束后恢复原运行环境
+        :param Underlying: 标的代码
+        :param StartDate: "%Y-%m-%d"
+        :param EndDate: "%Y-%m-%d"
+        :param TradeDays: 交易日列表，子进程中传入
+        :return: dict，ALERT_TYPES -> 区间内触发的报警pd.DataFrame
+        '''
+        if TradeDays is not None:
+            for x in self.SETTINGS:
+                setattr(OptionMinuteData, x, self.Settings[x])
+            OptionGreeksMethod.Backend = self.Backend
+        PreviousContext = GetContext()
+        SetContext(self.Context(Underlying, TradeDays))
+        try:
+            return OptionAlertBacktest(**self.BacktestParams).Run(StartDate, EndDate)
+        finally:
+            SetContext(PreviousContext)
+
+    def TradeDays(self, StartDate, EndDate):
+        '''
+        当前运行环境已加载的交易日（至少覆盖回测区间），传给子进程预加载交易日历
+        :param StartDate: "%Y-%m-%d"
+        :param EndDate: "%Y-%m-%d"
+        :return: list，datetime.date
+        '''
+        Index = GetContext().TradeCalendarIndex
+        Index.EnsureRange(dt.datetime.strptime(StartDate, "%Y-%m-%d").date().toordinal(),
+                          dt.datetime.strptime(EndDate, "%Y-%m-%d").date().toordinal())
+        return [dt.date.fromordinal(int(x)) for x in Index.Ordinals]
+
+    def Run(self, StartDate, EndDate):
+        '''
+        各标的同时回测
+        :param StartDate: "%Y-%m-%d"
+        :param EndDate: "%Y-%m-%d"
+        :return: dict，标的代码 -> OptionAlertBacktest.Run的结果
+        '''
+        if self.Workers <= 1:
+            return {x: self.RunUnderlying(x, StartDate, EndDate) for x in self.Underlyings}
+        TradeDays = self.TradeDays(StartDate, EndDate)
+        with ProcessPoolExecutor(max_workers=self.Workers, mp_context=multiprocessing.get_context("spawn")) as Executor:
+            Futures = {x: Executor.submit(self.RunUnderlying, x, StartDate, EndDate, TradeDays)
+                       for x in self.Underlyings}
+            return {x: Futures[x].result() for x in self.Underlyings}
+
+
 class OptionPlot:
     '''
     期权图形
     1-隐含波动率曲面
+    2-曲面网格SurfaceGrid，把隐含波动率（或任一希腊字母）按 执行价格×到期月份 一次整理成二维数组，供画图及其他计算共用
     '''
 
     @staticmethod
-    def ImpliedVolatilitySurfacePlot(GivenDateTime, Direction="认购"):
+    def SurfaceData(GivenDateTime):
         '''
-        画给定时刻50ETF隐含波动率曲面
+        取给定时刻所有挂牌合约的数据并计算greeks
         :param GivenDateTime:'%Y-%m-%d %H:%M:%S'
-        :return:隐含波动率曲面
+        :return: pd.DataFrame
         '''
         StartDateTime = GivenDateTime
         EndDateTime = dt.datetime.strptime(GivenDateTime, '%Y-%m-%d %H:%M:%S') + dt.timedelta(seconds=1)
         EndDateTime = EndDateTime.strftime('%Y-%m-%d %H:%M:%S')
         OptionRawData = OptionMinuteData.GetDataForListedContractAndUnderlyingSecurity(StartDateTime, EndDateTime)
-        OptionRawData = OptionMinuteData.ComputeGreeksForListedContract(OptionRawData)
-        OptionDataForPlot = OptionRawData[OptionRawData["call_or_put"] == Direction]
-        OptionDataForPlot_LimitMonth = OptionDataForPlot["limit_month"].drop_duplicates().sort_values()
-        OptionDataForPlot_ExercisePrice = OptionDataForPlot["exercise_price"].drop_duplicates().sort_values()
-        # 画隐含波动率曲面
-        OptionDataForPlot_LimitMonth_Range = np.arange(len(OptionDataForPlot_LimitMonth))
-        OptionDataForPlo_ExercisePrice_Range = np.arange(len(OptionDataForPlot_ExercisePrice))
-        ImpliedVolatilitySurfacePlot_Array = np.empty(
-            [len(OptionDataForPlot_ExercisePrice), len(OptionDataForPlot_LimitMonth)])
-        OptionDataForPlot_LimitMonth_Range, OptionDataForPlo_ExercisePrice_Range = np.meshgrid(
-            OptionDataForPlot_LimitMonth_Range, OptionDataForPlo_ExercisePrice_Range)
-        for i in range(len(OptionDataForPlot_ExercisePrice)):
-            for j in range(len(OptionDataForPlot_LimitMonth)):
-                temp = OptionDataForPlot[
-                    (OptionDataForPlot["limit_month"] == OptionDataForPlot_LimitMonth.iloc[j]) & (
-                            OptionDataForPlot["exercise_price"] == OptionDataForPlot_ExercisePrice.iloc[i])]
-                if not len(temp.index == 0):
-                    ImpliedVolatilitySurfacePlot_Array[i, j] = 0
-                else:
-                    ImpliedVolatilitySurfacePlot_Array[i, j] = temp["ImpliedVolatility"].values[0]
+        return OptionMinuteData.ComputeGreeksForListedContract(OptionRawData)
+
+    @staticmethod
+    def AxisPosition(Axis, Values, Sorted=True):
+        '''
+        各值在坐标轴上的位置
+        :param Axis: 坐标轴，Sorted为True时须升序
+        :param Values: 待定位的值
+        :param Sorted: 坐标轴是否升序，否则逐个匹配，适用于认购认沽这样很短的坐标轴
+        :return: (Position, Valid)，Valid为False表示该值不在坐标轴上，此时Position无意义
+        '''
+        Axis = np.asarray(Axis)
+        Values = np.asarray(Values)
+        if not Sorted:
+            Position = np.zeros(len(Values), dtype=np.int64)
+            Valid = np.zeros(len(Values), dtype=bool)
+            for i, x in enumerate(Axis):
+                Position[Values == x] = i
+                Valid |= Values == x
+            return Position, Valid
+        Position = np.searchsorted(Axis, Values)
+        Valid = Position < len(Axis)
+        Valid[Valid] = Axis[Position[Valid]] == Values[Valid]
+        return Position, Valid
 
+    @staticmethod
+    def SurfaceGrid(Data, Value="ImpliedVolatility", Direction="认购", ExercisePrices=None, LimitMonths=None):
+        '''
+        2-曲面网格，一次向量化赋值，不再逐个格子筛选整个数据集
+        同一格子有多行时取第一行，与原来的temp["ImpliedVolatility"].values[0]一致
+        :param Data: pd.DataFrame，同一时刻的数据，含exercise_price、limit_month、call_or_put及Value字段
+        :param Value: 取值字段，如"ImpliedVolatility"、"Delta"
+        :param Direction: "认购"/"认沽"，None则不区分
+        :param ExercisePrices: 行对应的执行价格，默认Data中所有执行价格升序
+        :param LimitMonths: 列对应的到期月份，默认Data中所有到期月份升序
+        :return: (Grid, Mask, ExercisePrices, LimitMonths)，Grid为np.ndarray，形状(执行价格数,到期月份数)，
+                 没有数据的格子为nan，Mask为bool数组，有数据的格子为True
+        '''
+        if Direction is not None:
+            Data = Data[Data["call_or_put"] == Direction]
+        ExercisePrices = np.sort(Data["exercise_price"].unique()) if ExercisePrices is None else np.asarray(
+            ExercisePrices)
+        LimitMonths = np.sort(Data["limit_month"].unique()) if LimitMonths is None else np.asarray(LimitMonths)
+        Grid = np.full((len(ExercisePrices), len(LimitMonths)), np.nan)
+        Mask = np.zeros(Grid.shape, dtype=bool)
+        if not len(ExercisePrices) or not len(LimitMonths) or not len(Data.index):
+            return Grid, Mask, ExercisePrices, LimitMonths
+        Row, RowValid = OptionPlot.AxisPosition(ExercisePrices, Data["exercise_price"].to_numpy())
+        Column, ColumnValid = OptionPlot.AxisPosition(LimitMonths, Data["limit_month"].to_numpy())
+        # 不在给定执行价格、到期月份中的行不画
+        Valid = RowValid & ColumnValid
+        Cell, First = np.unique(Row[Valid] * len(LimitMonths) + Column[Valid], return_index=True)
+        Grid.flat[Cell] = Data[Value].to_numpy(dtype=np.float64)[Valid][First]
+        Mask.flat[Cell] = True
+        return Grid, Mask, ExercisePrices, LimitMonths
+
+    @staticmethod
+    def SurfacePlot(Grid, ExercisePrices, LimitMonths, GivenDateTime, Value="ImpliedVolatility"):
+        '''
+        画曲面，Grid由SurfaceGrid生成，没有数据的格子按0画
+        '''
+        LimitMonth_Range, ExercisePrice_Range = np.meshgrid(np.arange(len(LimitMonths)),
+                                                            np.arange(len(ExercisePrices)))
         fig = plt.figure(figsize=(15, 12))
-        ax = fig.gca(projection='3d')
-        surf = ax.plot_surface(OptionDataForPlo_ExercisePrice_Range, OptionDataForPlot_LimitMonth_Range,
-                               ImpliedVolatilitySurfacePlot_Array,
+        ax = fig.add_subplot(111, projection='3d')
+        surf = ax.plot_surface(ExercisePrice_Range, LimitMonth_Range, np.nan_to_num(Grid, nan=0.0),
                                rstride=2, cstride=2, cmap=plt.cm.coolwarm,
                                linewidth=0.5, antialiased=True)
         ax.set_xlabel('ExercisePrice')
         ax.set_ylabel('limit_month')
-        ax.set_zlabel('ImpliedVolatility')
-        ax.set_title('ImpliedVolatility Surface at {}'.format(GivenDateTime))
+        ax.set_zlabel(Value)
+        ax.set_title('{} Surface at {}'.format(Value, GivenDateTime))
         # ax.set_yticks([0, 1, 2, 3], list(OptionDataForPlot_LimitMonth.values))
         plt.ylim([0, 3])
-        plt.xticks(list(range(len(OptionDataForPlo_ExercisePrice_Range))),
-                   list(OptionDataForPlot_ExercisePrice.values))
-        plt.yticks(list(range(len(OptionDataForPlot_LimitMonth))), list(OptionDataForPlot_LimitMonth.values))
+        plt.xticks(list(range(len(ExercisePrices))), list(ExercisePrices))
+        plt.yticks(list(range(len(LimitMonths))), list(LimitMonths))
 
         fig.colorbar(surf, shrink=0.5, aspect=5)
 
+    @staticmethod
+    def ImpliedVolatilitySurfacePlot(GivenDateTime, Direction="认购"):
+        '''
+        画给定时刻50ETF隐含波动率曲面
+        :param GivenDateTime:'%Y-%m-%d %H:%M:%S'
+        :return:隐含波动率曲面
+        '''
+        OptionRawData = OptionPlot.SurfaceData(GivenDateTime)
+        Grid, Mask, ExercisePrices, LimitMonths = OptionPlot.SurfaceGrid(OptionRawData, "ImpliedVolatility",
+                                                                         Direction)
+        OptionPlot.SurfacePlot(Grid, ExercisePrices, LimitMonths, GivenDateTime)
+
     @staticmethod
     def ImpliedVolatilitySurfacePlot_dropzero(GivenDateTime, Direction="认购"):
         '''
@@ -2006,53 +5099,14 @@ class OptionPlot:
         :param GivenDateTime:'%Y-%m-%d %H:%M:%S'
         :return:隐含波动率曲面
         '''
-        StartDateTime = GivenDateTime
-        EndDateTime = dt.datetime.strptime(GivenDateTime, '%Y-%m-%d %H:%M:%S') + dt.timedelta(seconds=1)
-        EndDateTime = EndDateTime.strftime('%Y-%m-%d %H:%M:%S')
-        OptionRawData = OptionMinuteData.GetDataForListedContractAndUnderlyingSecurity(StartDateTime, EndDateTime)
-        OptionRawData = OptionMinuteData.ComputeGreeksForListedContract(OptionRawData)
+        OptionRawData = OptionPlot.SurfaceData(GivenDateTime)
         OptionDataForPlot = OptionRawData[OptionRawData["call_or_put"] == Direction]
-        OptionDataForPlot_LimitMonth = OptionDataForPlot["limit_month"].drop_duplicates().sort_values()
-
         # 剔除隐含波动率为0的价格
         temp = OptionDataForPlot.groupby("exercise_price")["ImpliedVolatility"].min() > 0.001
-        temp = temp.reset_index()
-        tempresult = temp[temp["ImpliedVolatility"] == True]
-        OptionDataForPlot_ExercisePrice = tempresult["exercise_price"].drop_duplicates().sort_values()
-        # 画隐含波动率曲面
-        OptionDataForPlot_LimitMonth_Range = np.arange(len(OptionDataForPlot_LimitMonth))
-        OptionDataForPlo_ExercisePrice_Range = np.arange(len(OptionDataForPlot_ExercisePrice))
-        ImpliedVolatilitySurfacePlot_Array = np.empty(
-            [len(OptionDataForPlot_ExercisePrice), len(OptionDataForPlot_LimitMonth)])
-        OptionDataForPlot_LimitMonth_Range, OptionDataForPlo_ExercisePrice_Range = np.meshgrid(
-            OptionDataForPlot_LimitMonth_Range, OptionDataForPlo_ExercisePrice_Range)
-        for i in range(len(OptionDataForPlot_ExercisePrice)):
-            for j in range(len(OptionDataForPlot_LimitMonth)):
-                temp = OptionDataForPlot[
-                    (OptionDataForPlot["limit_month"] == OptionDataForPlot_LimitMonth.iloc[j]) & (
-                            OptionDataForPlot["exercise_price"] == OptionDataForPlot_ExercisePrice.iloc[i])]
-                if not len(temp.index == 0):
-                    ImpliedVolatilitySurfacePlot_Array[i, j] = 0
-                else:
-                    ImpliedVolatilitySurfacePlot_Array[i, j] = temp["ImpliedVolatility"].values[0]
-
-        fig = plt.figure(figsize=(15, 12))
-        ax = fig.gca(projection='3d')
-        surf = ax.plot_surface(OptionDataForPlo_ExercisePrice_Range, OptionDataForPlot_LimitMonth_Range,
-                               ImpliedVolatilitySurfacePlot_Array,
-                               rstride=2, cstride=2, cmap=plt.cm.coolwarm,
-                               linewidth=0.5, antialiased=True)
-        ax.set_xlabel('ExercisePrice')
-        ax.set_ylabel('limit_month')
-        ax.set_zlabel('ImpliedVolatility')
-        ax.set_title('ImpliedVolatility Surface at {}'.format(GivenDateTime))
-        # ax.set_yticks([0, 1, 2, 3], list(OptionDataForPlot_LimitMonth.values))
-        plt.ylim([0, 3])
-        plt.xticks(list(range(len(OptionDataForPlo_ExercisePrice_Range))),
-                   list(OptionDataForPlot_ExercisePrice.values))
-        plt.yticks(list(range(len(OptionDataForPlot_LimitMonth))), list(OptionDataForPlot_LimitMonth.values))
-
-        fig.colorbar(surf, shrink=0.5, aspect=5)
+        OptionDataForPlot_ExercisePrice = np.sort(temp.index[temp.to_numpy()].to_numpy())
+        Grid, Mask, ExercisePrices, LimitMonths = OptionPlot.SurfaceGrid(
+            OptionDataForPlot, "ImpliedVolatility", Direction, ExercisePrices=OptionDataForPlot_ExercisePrice)
+        OptionPlot.SurfacePlot(Grid, ExercisePrices, LimitMonths, GivenDateTime)
 
     @staticmethod
     def ImpliedVolatilitySurfacePlot_dropzero_limitmonth(GivenDateTime, Direction="认购"):
@@ -2061,54 +5115,188 @@ class OptionPlot:
         :param GivenDateTime:'%Y-%m-%d %H:%M:%S'
         :return:隐含波动率曲面
         '''
-        StartDateTime = GivenDateTime
-        EndDateTime = dt.datetime.strptime(GivenDateTime, '%Y-%m-%d %H:%M:%S') + dt.timedelta(seconds=1)
-        EndDateTime = EndDateTime.strftime('%Y-%m-%d %H:%M:%S')
-        OptionRawData = OptionMinuteData.GetDataForListedContractAndUnderlyingSecurity(StartDateTime, EndDateTime)
-        OptionRawData = OptionMinuteData.ComputeGreeksForListedContract(OptionRawData)
+        OptionRawData = OptionPlot.SurfaceData(GivenDateTime)
         OptionDataForPlot = OptionRawData[OptionRawData["call_or_put"] == Direction]
-        OptionDataForPlot_LimitMonth = OptionDataForPlot["limit_month"].drop_duplicates().sort_values()
-
         # 剔除隐含波动率为0的价格
         temp = (OptionDataForPlot.groupby("exercise_price")["ImpliedVolatility"].min() > 0.001) & (
                 OptionDataForPlot.groupby("exercise_price")["ImpliedVolatility"].count() == 4)
-        temp = temp.reset_index()
-        tempresult = temp[temp["ImpliedVolatility"] == True]
-        OptionDataForPlot_ExercisePrice = tempresult["exercise_price"].drop_duplicates().sort_values()
-        # 画隐含波动率曲面
-        OptionDataForPlot_LimitMonth_Range = np.arange(len(OptionDataForPlot_LimitMonth))
-        OptionDataForPlo_ExercisePrice_Range = np.arange(len(OptionDataForPlot_ExercisePrice))
-        ImpliedVolatilitySurfacePlot_Array = np.empty(
-            [len(OptionDataForPlot_ExercisePrice), len(OptionDataForPlot_LimitMonth)])
-        OptionDataForPlot_LimitMonth_Range, OptionDataForPlo_ExercisePrice_Range = np.meshgrid(
-            OptionDataForPlot_LimitMonth_Range, OptionDataForPlo_ExercisePrice_Range)
-        for i in range(len(OptionDataForPlot_ExercisePrice)):
-            for j in range(len(OptionDataForPlot_LimitMonth)):
-                temp = OptionDataForPlot[
-                    (OptionDataForPlot["limit_month"] == OptionDataForPlot_LimitMonth.iloc[j]) & (
-                            OptionDataForPlot["exercise_price"] == OptionDataForPlot_ExercisePrice.iloc[i])]
-                if not len(temp.index == 0):
-                    ImpliedVolatilitySurfacePlot_Array[i, j] = 0
-                else:
-                    ImpliedVolatilitySurfacePlot_Array[i, j] = temp["ImpliedVolatility"].values[0]
+        OptionDataForPlot_ExercisePrice = np.sort(temp.index[temp.to_numpy()].to_numpy())
+        Grid, Mask, ExercisePrices, LimitMonths = OptionPlot.SurfaceGrid(
+            OptionDataForPlot, "ImpliedVolatility", Direction, ExercisePrices=OptionDataForPlot_ExercisePrice)
+        OptionPlot.SurfacePlot(Grid, ExercisePrices, LimitMonths, GivenDateTime)
 
-        fig = plt.figure(figsize=(15, 12))
-        ax = fig.gca(projection='3d')
-        surf = ax.plot_surface(OptionDataForPlo_ExercisePrice_Range, OptionDataForPlot_LimitMonth_Range,
-                               ImpliedVolatilitySurfacePlot_Array,
-                               rstride=2, cstride=2, cmap=plt.cm.coolwarm,
-                               linewidth=0.5, antialiased=True)
-        ax.set_xlabel('ExercisePrice')
-        ax.set_ylabel('limit_month')
-        ax.set_zlabel('ImpliedVolatility')
-        ax.set_title('ImpliedVolatility Surface at {}'.format(GivenDateTime))
-        # ax.set_yticks([0, 1, 2, 3], list(OptionDataForPlot_LimitMonth.values))
-        plt.ylim([0, 3])
-        plt.xticks(list(range(len(OptionDataForPlo_ExercisePrice_Range))),
-                   list(OptionDataForPlot_ExercisePrice.values))
-        plt.yticks(list(range(len(OptionDataForPlot_LimitMonth))), list(OptionDataForPlot_LimitMonth.values))
 
-        fig.colorbar(surf, shrink=0.5, aspect=5)
+class OptionSurfaceSeries:
+    '''
+    分钟级隐含波动率曲面序列，按 时间×执行价格×到期月份×认购认沽 存成四维数组，落盘为.npy并以内存映射方式打开，
+    切片时只读取用到的部分，不需要把整段数据载入内存，也不需要再逐分钟向wind请求数据重建曲面
+    *目录结构：Path/values.npy（数值，没有数据的格子为nan）、Path/coords.json（各维坐标及取值字段）
+    *时间轴为区间内每个交易日09:30-11:30、13:00-15:00的每一分钟，每天242个时点，没有成交的分钟为nan
+    *执行价格、到期月份取区间内曾挂牌交易过的全部合约
+    1-建立序列Build，按交易日分批取数、计算、写入，每批写完即刷新到磁盘
+    2-打开已有序列OptionSurfaceSeries(Path)
+    3-取某一时刻的曲面Surface，返回值与OptionPlot.SurfaceGrid一致，可直接交给OptionPlot.SurfacePlot
+    4-取单个合约的时间序列Series，取一段时间TimeSlice
+    '''
+
+    ValuesFile = "values.npy"
+    CoordsFile = "coords.json"
+    TimeFormat = "%Y-%m-%d %H:%M"
+    Directions = ("认购", "认沽")
+
+    def __init__(self, Path, Mode="r"):
+        '''
+        :param Path: 序列目录
+        :param Mode: 内存映射模式，"r"只读，"r+"可写
+        '''
+        self.Path = Path
+        with open(os.path.join(Path, self.CoordsFile), "r", encoding="utf-8") as f:
+            Coords = json.load(f)
+        self.Value = Coords["value"]
+        self.Times = np.array(Coords["times"], dtype="datetime64[m]")
+        self.ExercisePrices = np.array(Coords["exercise_prices"], dtype=np.float64)
+        self.LimitMonths = np.array(Coords["limit_months"], dtype=object)
+        self.Directions = tuple(Coords["directions"])
+        self.Values = np.load(os.path.join(Path, self.ValuesFile), mmap_mode=Mode)
+
+    @classmethod
+    def SessionTimes(cls, TradeDates):
+        '''
+        交易日内每一分钟的时点，09:30-11:30、13:00-15:00，两端都包含
+        :param TradeDates: 交易日列表，datetime.date
+        :return: np.ndarray，datetime64[m]
+        '''
+        Open = TradeCalendarIndex.MorningOpenMinute
+        HalfSession = TradeCalendarIndex.SessionMinutes // 2
+        Minutes = np.r_[np.arange(Open, Open + HalfSession + 1), np.arange(TradeCalendarIndex.AfternoonOpenMinute,
+                                                                        TradeCalendarIndex.AfternoonOpenMinute +
+                                                                        HalfSession + 1)]
+        Days = np.array([x.isoformat() for x in TradeDates], dtype="datetime64[D]").astype("datetime64[m]")
+        return (Days[:, None] + Minutes[None, :].astype("timedelta64[m]")).ravel()
+
+    @classmethod
+    def Create(cls, Path, Times, ExercisePrices, LimitMonths, Value="ImpliedVolatility", Dtype=np.float32):
+        '''
+        新建空序列，所有格子为nan
+        :param Dtype: 存储精度，默认float32，隐含波动率及希腊字母足够，文件大小为float64的一半
+        :return: OptionSurfaceSeries，可写
+        '''
+        os.makedirs(Path, exist_ok=True)
+        Shape = (len(Times), len(ExercisePrices), len(LimitMonths), len(cls.Directions))
+        Values = np.lib.format.open_memmap(os.path.join(Path, cls.ValuesFile), mode="w+", dtype=Dtype, shape=Shape)
+        Values[:] = np.nan
+        Values.flush()
+        del Values
+        Coords = {"value": Value,
+                  "times": [str(x) for x in np.asarray(Times, dtype="datetime64[m]")],
+                  "exercise_prices": [float(x) for x in ExercisePrices],
+                  "limit_months": [str(x) for x in LimitMonths],
+                  "directions": list(cls.Directions)}
+        with open(os.path.join(Path, cls.CoordsFile), "w", encoding="utf-8") as f:
+            json.dump(Coords, f, ensure_ascii=False)
+        return cls(Path, Mode="r+")
+
+    def Write(self, Data):
+        '''
+        把计算好greeks的数据一次写入对应格子，同一格子有多行时取第一行，不在坐标轴上的行忽略
+        :param Data: pd.DataFrame，含datetime、exercise_price、limit_month、call_or_put及取值字段
+        :return: 写入的格子数
+        '''
+        if not len(Data.index):
+            return 0
+        Times = pd.to_datetime(Data["datetime"]).to_numpy().astype("datetime64[m]")
+        TimePosition, TimeValid = OptionPlot.AxisPosition(self.Times, Times)
+        PricePosition, PriceValid = OptionPlot.AxisPosition(self.ExercisePrices, Data["exercise_price"].to_numpy())
+        MonthPosition, MonthValid = OptionPlot.AxisPosition(self.LimitMonths,
+                                                            Data["limit_month"].astype(str).to_numpy())
+        DirectionPosition, DirectionValid = OptionPlot.AxisPosition(np.array(self.Directions, dtype=object),
+                                                                    Data["call_or_put"].to_numpy(), Sorted=False)
+        Valid = TimeValid & PriceValid & MonthValid & DirectionValid
+        Shape = self.Values.shape
+        Cell = ((TimePosition[Valid] * Shape[1] + PricePosition[Valid]) * Shape[2] + MonthPosition[Valid]) * Shape[
+            3] + DirectionPosition[Valid]
+        Cell, First = np.unique(Cell, return_index=True)
+        self.Values.reshape(-1)[Cell] = Data[self.Value].to_numpy(dtype=np.float64)[Valid][First]
+        return len(Cell)
+
+    def Flush(self):
+        '''
+        把已写入的数据刷新到磁盘
+        '''
+        if isinstance(self.Values, np.memmap):
+            self.Values.flush()
+
+    @classmethod
+    def Build(cls, Path, StartDate, EndDate, Value="ImpliedVolatility", Dtype=np.float32, Intraday=False):
+        '''
+        1-建立序列，按交易日逐日取数并计算greeks后写入，内存中只保留一天的数据
+        # OptionSurfaceSeries.Build("surface/2019-10", "2019-10-08", "2019-10-31")
+        :param Path: 序列目录，已存在则覆盖
+        :param StartDate: "%Y-%m-%d"
+        :param EndDate: "%Y-%m-%d"
+        :param Value: 取值字段，"ImpliedVolatility"或GREEKS_ALL中的希腊字母，如"Delta"、"Vomma"
+        :param Intraday: 到期时间是否扣除当天已经过去的交易时间，默认False
+        :return: OptionSurfaceSeries，只读
+        '''
+        if Value != "ImpliedVolatility" and Value not in OptionGreeksMethod.GREEKS_ALL:
+            raise ValueError("不支持的取值字段:" + str(Value))
+        # 只计算需要的希腊字母，Vomma、Vanna等不在默认列表中的也能取到
+        Greeks = [Value] if Value in OptionGreeksMethod.GREEKS_ALL else None
+        TradeDates = GetContext().TradeCalendarIndex.TradeCalendarStartToEnd(StartDate, EndDate)
+        ContractSetData = GetContext().ContractSetData
+        Listed = ContractSetData[(ContractSetData["listed_date"] <= dt.datetime.strptime(EndDate, "%Y-%m-%d")) & (
+                ContractSetData["expire_date"] >= dt.datetime.strptime(StartDate, "%Y-%m-%d"))]
+        SurfaceSeries = cls.Create(Path, cls.SessionTimes(TradeDates), np.sort(Listed["exercise_price"].unique()),
+                            np.sort(Listed["limit_month"].astype(str).unique()), Value=Value, Dtype=Dtype)
+        for TradeDate in TradeDates:
+            TradeDate = TradeDate.strftime("%Y-%m-%d")
+            DayData = OptionMinuteData.GetDataForListedContractAndUnderlyingSecurity(
+                TradeDate + " " + MinuteDataCache.SessionStartTime, TradeDate + " " + MinuteDataCache.SessionEndTime,
+                Intraday=Intraday)
+            SurfaceSeries.Write(OptionMinuteData.ComputeGreeksForListedContract(DayData, Greeks=Greeks))
+            SurfaceSeries.Flush()
+        del SurfaceSeries
+        return cls(Path)
+
+    def TimePosition(self, GivenDateTime):
+        '''
+        给定时刻在时间轴上的位置，不在时间轴上时报错
+        :param GivenDateTime: '%Y-%m-%d %H:%M:%S'或'%Y-%m-%d %H:%M'
+        '''
+        Position = np.searchsorted(self.Times, np.datetime64(pd.Timestamp(GivenDateTime), "m"))
+        if Position >= len(self.Times) or self.Times[Position] != np.datetime64(pd.Timestamp(GivenDateTime), "m"):
+            raise KeyError("{}不在序列时间轴上".format(GivenDateTime))
+        return int(Position)
+
+    def Surface(self, GivenDateTime, Direction="认购"):
+        '''
+        3-取某一时刻的曲面
+        :return: (Grid, Mask, ExercisePrices, LimitMonths)，与OptionPlot.SurfaceGrid一致
+        '''
+        Grid = np.asarray(self.Values[self.TimePosition(GivenDateTime), :, :, self.Directions.index(Direction)],
+                          dtype=np.float64)
+        return Grid, ~np.isnan(Grid), self.ExercisePrices, self.LimitMonths
+
+    def Series(self, ExercisePrice, LimitMonth, Direction="认购"):
+        '''
+        4-取单个合约的分钟序列
+        :return: pd.Series，index为时间
+        '''
+        PricePosition = int(np.searchsorted(self.ExercisePrices, ExercisePrice))
+        if PricePosition >= len(self.ExercisePrices) or self.ExercisePrices[PricePosition] != ExercisePrice:
+            raise KeyError("执行价格{}不在序列中".format(ExercisePrice))
+        MonthPosition = list(self.LimitMonths).index(str(LimitMonth))
+        return pd.Series(np.asarray(self.Values[:, PricePosition, MonthPosition, self.Directions.index(Direction)],
+                                    dtype=np.float64), index=pd.DatetimeIndex(self.Times), name=self.Value)
+
+    def TimeSlice(self, StartDateTime, EndDateTime):
+        '''
+        4-取一段时间，两端都包含，返回内存映射数组的视图及对应时间
+        :return: (Values, Times)
+        '''
+        Left = np.searchsorted(self.Times, np.datetime64(pd.Timestamp(StartDateTime), "m"), side="left")
+        Right = np.searchsorted(self.Times, np.datetime64(pd.Timestamp(EndDateTime), "m"), side="right")
+        return self.Values[Left:Right], self.Times[Left:Right]
 
 # (OptionDataForPlot.groupby("exercise_price")["ImpliedVolatility"].min()>0.001)
 # (OptionDataForPlot.groupby("exercise_price")["ImpliedVolatility"].count()<4)
@@ -0,0 +1,400 @@
+# 性能测试：合成50ETF期权链数据，测试定价、隐含波动率、希腊字母、平价关系、滚动报警及波动率曲面的耗时、吞吐量和内存峰值
+# 用法：python option_benchmark.py --rows 10000 1000000 10000000 --output bench.json
+# 不需要wind终端，合成数据通过SyntheticProvider提供给option模块
+
+import argparse
+import datetime as dt
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import option
+
+# wsi请求字段与wind返回字段的对应关系
+WSI_FIELD_NAME = {"open": "open", "high": "high", "low": "low", "close": "close", "volume": "volume",
+                  "amt": "amount", "chg": "change", "pct_chg": "pctchange", "oi": "position"}
+TRADE_MINUTES = [dt.time(m // 60, m % 60) for m in
+                 list(range(9 * 60 + 31, 11 * 60 + 31)) + list(range(13 * 60 + 1, 15 * 60 + 1))]
+
+
+class SyntheticOptionChain:
+    '''
+    合成50ETF期权链，结果可复现（给定Seed）
+    *标的：从3.0开始按年化20%波动率的几何布朗运动逐分钟生成
+    *合约：Expiries个到期月份（均在数据区间之后到期，月份第四个星期三）×Strikes个执行价格（步长0.05，以3.0为中心）×认购认沽
+    *期权价格：Black-Scholes价格，隐含波动率带微笑（0.18+0.8*ln(K/S)^2），按0.0001取整，最低0.0001
+    数据行数=合约数×Minutes×Days
+    '''
+
+    def __init__(self, Strikes=12, Expiries=4, Days=1, Minutes=240, StartDate="2019-10-08", Seed=0):
+        '''
+        :param Strikes: 每个到期月份的执行价格个数
+        :param Expiries: 到期月份个数
+        :param Days: 交易日天数
+        :param Minutes: 每个交易日的分钟数，最多240
+        :param StartDate: 起始日期
+        :param Seed: 随机数种子
+        '''
+        self.Rng = np.random.default_rng(Seed)
+        StartDate = dt.datetime.strptime(StartDate, "%Y-%m-%d").date()
+        # 交易日历取工作日
+        Calendar = [StartDate + dt.timedelta(days=x) for x in range(-120, Days * 2 + 500)]
+        self.Calendar = [x for x in Calendar if x.weekday() < 5]
+        FirstIndex = self.Calendar.index(StartDate) if StartDate in self.Calendar else \
+            [i for i, x in enumerate(self.Calendar) if x > StartDate][0]
+        self.TradeDays = self.Calendar[FirstIndex:FirstIndex + Days]
+        self.Times = pd.DatetimeIndex([dt.datetime.combine(d, t) for d in self.TradeDays
+                                       for t in TRADE_MINUTES[:Minutes]])
+        self.UnderlyingCode = option.UnderlyingSecurity
+        MinuteVolatility = 0.2 / np.sqrt(252 * 240)
+        self.UnderlyingClose = np.round(
+            3.0 * np.exp(np.cumsum(self.Rng.normal(0, MinuteVolatility, len(self.Times)))), 3)
+        self.ContractSetData = self.BuildContractSet(Strikes, Expiries)
+        self.CalendarIndex = option.TradeCalendarIndex(TradeDays=self.Calendar)
+        self.OptionClose = self.BuildOptionClose()
+
+    def BuildContractSet(self, Strikes, Expiries):
+        '''
+        生成合约数据集，格式同option.ContractSet()
+        :return: pd.DataFrame
+        '''
+        LastDay = self.TradeDays[-1]
+        rows = []
+        ExercisePrices = np.round(3.0 + 0.05 * (np.arange(Strikes) - Strikes // 2), 2)
+        for i in range(Expiries):
+            Year = LastDay.year + (LastDay.month + i) // 12
+            Month = (LastDay.month + i) % 12 + 1
+            Wednesdays = [dt.date(Year, Month, x) for x in range(1, 29) if dt.date(Year, Month, x).weekday() == 2]
+            ExpireDate = Wednesdays[3]
+            for ExercisePrice in ExercisePrices:
+                for CallOrPut in ["认购", "认沽"]:
+                    Code = str(10002000 + len(rows))
+                    PriceCode = str(int(round(ExercisePrice * 1000)))
+                    rows.append({"wind_code": Code + "." + self.UnderlyingCode.split(".")[1],
+                                 "trade_code": "510050" + ("C" if CallOrPut == "认购" else "P") + ExpireDate.strftime(
+                                     "%y%m") + "M0" + PriceCode,
+                                 "sec_name": "50ETF" + CallOrPut[1] + str(Month) + "月" + PriceCode,
+                                 "option_mark_code": self.UnderlyingCode, "option_type": "ETF期权",
+                                 "call_or_put": CallOrPut, "exercise_mode": "欧式", "exercise_price": ExercisePrice,
+                                 "contract_unit": 10000, "limit_month": ExpireDate.strftime("%Y-%m"),
+                                 "listed_date": dt.datetime.combine(self.TradeDays[0] - dt.timedelta(days=60),
+                                                                    dt.time()),
+                                 "expire_date": dt.datetime.combine(ExpireDate, dt.time()),
+                                 "exercise_date": ExpireDate.strftime("%Y-%m-%d"),
+                                 "settlement_date": (ExpireDate + dt.timedelta(days=1)).strftime("%Y-%m-%d"),
+                                 "reference_price": 0.0, "settle_mode": "实物交割", "contract_state": "上市"})
+        result = pd.DataFrame(rows)
+        result.index = result["wind_code"]
+        result.index.name = None
+        return result
+
+    def BuildOptionClose(self):
+        '''
+        生成每分钟每个合约的收盘价，矩阵形状为(分钟数, 合约数)
+        :return: np.ndarray
+        '''
+        UnderlyingPrice = self.UnderlyingClose[:, None]
+        ExercisePrice = self.ContractSetData["exercise_price"].to_numpy()[None, :]
+        Time = self.CalendarIndex.TimeToExpiryForArray(
+            np.repeat(self.Times.to_numpy(), len(self.ContractSetData.index)),
+            np.tile(self.ContractSetData["exercise_date"].to_numpy(), len(self.Times))).reshape(
+            len(self.Times), -1)
+        Volatility = 0.18 + 0.8 * np.log(ExercisePrice / UnderlyingPrice) ** 2 + self.Rng.normal(
+            0, 0.005, (1, len(self.ContractSetData.index)))
+        IsCall = (self.ContractSetData["call_or_put"] == "认购").to_numpy()[None, :]
+        Price = option.OptionGreeksMethod.EuropeanPriceForArray(IsCall, UnderlyingPrice, ExercisePrice, Time,
+                                                                option.InterestRate, option.DividendRate,
+                                                                Volatility)
+        return np.maximum(np.round(Price, 4), 0.0001)
+
+    def MinuteData(self):
+        '''
+        生成合约与标的合并后的分钟数据，格式同OptionMinuteData.GetDataForListedContractAndUnderlyingSecurity的返回值
+        :return: pd.DataFrame
+        '''
+        ContractCount = len(self.ContractSetData.index)
+        MinuteIndex = np.repeat(np.arange(len(self.Times)), ContractCount)
+        ContractIndex = np.tile(np.arange(ContractCount), len(self.Times))
+        Close = self.OptionClose.ravel()
+        DateValues = np.array(self.Times.date, dtype=object)
+        TimeValues = np.array(self.Times.time, dtype=object)
+        Datetime = self.Times.to_numpy()[MinuteIndex]
+        result = {"windcode_op": self.ContractSetData["wind_code"].to_numpy()[ContractIndex],
+                  "open_op": Close, "high_op": Close, "low_op": Close, "close_op": Close,
+                  "volume_op": np.full(len(Close), 10.0), "amount_op": Close * 100000,
+                  "change_op": np.zeros(len(Close)), "pctchange_op": np.zeros(len(Close)),
+                  "position": np.full(len(Close), 1000.0), "datetime": Datetime,
+                  "date_op": DateValues[MinuteIndex], "time_op": TimeValues[MinuteIndex],
+                  "windcode_etf": np.full(len(Close), self.UnderlyingCode, dtype=object)}
+        UnderlyingClose = self.UnderlyingClose[MinuteIndex]
+        for x in ["open_etf", "high_etf", "low_etf", "close_etf"]:
+            result[x] = UnderlyingClose
+        result.update({"volume_etf": np.full(len(Close), 1e5), "amount_etf": UnderlyingClose * 1e5,
+                       "change_etf": np.zeros(len(Close)), "pctchange_etf": np.zeros(len(Close)),
+                       "date_etf": result["date_op"], "time_etf": result["time_op"]})
+        for x in self.ContractSetData.columns:
+            result[x] = self.ContractSetData[x].to_numpy()[ContractIndex]
+        result = pd.DataFrame(result)
+        result["StartDate"] = result["datetime"].dt.strftime("%Y-%m-%d")
+        result["time_to_exercise"] = self.CalendarIndex.TimeToExpiryForArray(result["datetime"],
+                                                                             result["exercise_date"])
+        result["InterestRate"] = option.InterestRate
+        result["DividendRate"] = option.DividendRate
+        return result
+
+    def Provider(self):
+        '''
+        返回提供本合成数据的数据接口
+        :return: SyntheticProvider
+        '''
+        return SyntheticProvider(self)
+
+
+class SyntheticProvider(option.MarketDataProvider):
+    '''
+    合成数据接口，按wind接口的返回格式提供SyntheticOptionChain的合约数据集、交易日历和分钟行情
+    '''
+
+    def __init__(self, Chain):
+        self.Chain = Chain
+
+    def wset(self, TableName, Options=""):
+        Data = self.Chain.ContractSetData.copy()
+        Data["wind_code"] = Data["wind_code"].str.split(".").str[0]
+        return option.ProviderResult(Data=[list(Data[x]) for x in Data.columns], Fields=list(Data.columns))
+
+    def tdays(self, BeginTime, EndTime, Options=""):
+        BeginTime = dt.datetime.strptime(BeginTime[:10], "%Y-%m-%d").date()
+        EndTime = dt.datetime.strptime(EndTime[:10], "%Y-%m-%d").date()
+        Times = [x for x in self.Chain.Calendar if BeginTime <= x <= EndTime]
+        return option.ProviderResult(Data=[Times], Times=Times)
+
+    def wsi(self, Codes, Fields, BeginTime, EndTime, Options=""):
+        Codes = Codes.split(",")
+        Fields = [WSI_FIELD_NAME[x] for x in Fields.split(",")]
+        Mask = (self.Chain.Times >= pd.Timestamp(BeginTime)) & (self.Chain.Times <= pd.Timestamp(EndTime))
+        Times = list(self.Chain.Times[Mask].to_pydatetime())
+        Columns = []
+        for Code in Codes:
+            if Code == self.Chain.UnderlyingCode:
+                Close = self.Chain.UnderlyingClose[Mask]
+            else:
+                Close = self.Chain.OptionClose[Mask, self.Chain.ContractSetData.index.get_loc(Code)]
+            Columns.append(Close)
+        Close = np.column_stack(Columns).ravel()
+        Values = {"open": Close, "high": Close, "low": Close, "close": Close, "volume": np.full(len(Close), 10.0),
+                  "amount": Close * 1e5, "change": np.zeros(len(Close)), "pctchange": np.zeros(len(Close)),
+                  "position": np.full(len(Close), 1000.0)}
+        Data = [list(Values[x]) for x in Fields]
+        if len(Codes) == 1:
+            return option.ProviderResult(Data=Data, Fields=Fields, Codes=Codes, Times=Times)
+        return option.ProviderResult(Data=[Codes * len(Times)] + Data, Fields=["windcode"] + Fields, Codes=Codes,
+                                     Times=[x for x in Times for _ in Codes])
+
+
+def ChainForRows(Rows, Strikes=12, Expiries=4, Seed=0):
+    '''
+    按目标行数生成期权链：合约数固定为Strikes*Expiries*2，不足一天时截取分钟数，否则按整天数
+    :param Rows: 目标行数
+    :return: SyntheticOptionChain
+    '''
+    ContractCount = Strikes * Expiries * 2
+    MinutesTotal = max(1, int(np.ceil(Rows / ContractCount)))
+    if MinutesTotal <= 240:
+        return SyntheticOptionChain(Strikes, Expiries, Days=1, Minutes=MinutesTotal, Seed=Seed)
+    return SyntheticOptionChain(Strikes, Expiries, Days=int(np.ceil(MinutesTotal / 240)), Minutes=240, Seed=Seed)
+
+
+def RunCase(Name, Function, Rows, Repeat=1, Memory=True):
+    '''
+    运行一个测试用例：计时取Repeat次中的最小值，再用tracemalloc单独运行一次测内存峰值
+    :return: dict
+    '''
+    result = {"case": Name, "rows": Rows}
+    try:
+        Seconds = []
+        for _ in range(Repeat):
+            StartTime = time.perf_counter()
+            Function()
+            Seconds.append(time.perf_counter() - StartTime)
+        result["seconds"] = min(Seconds)
+        result["rows_per_second"] = Rows / result["seconds"] if result["seconds"] else float("inf")
+        if Memory:
+            tracemalloc.start()
+            Function()
+            result["peak_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+    except Exception as e:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        result["error"] = "{}: {}".format(type(e).__name__, e)
+    return result
+
+
+def KernelCases(Data):
+    '''
+    定价、隐含波动率、希腊字母等计算用例
+    '''
+    Greeks = option.OptionGreeksMethod
+    Arrays = dict(IsCall=Greeks.CallOrPutMaskForArray(Data["call_or_put"]),
+                  UnderlyingPrice=Data["close_etf"].to_numpy(dtype=np.float64),
+                  ExercisePrice=Data["exercise_price"].to_numpy(dtype=np.float64),
+                  Time=Data["time_to_exercise"].to_numpy(dtype=np.float64),
+                  InterestRate=Data["InterestRate"].to_numpy(dtype=np.float64),
+                  DividendRate=Data["DividendRate"].to_numpy(dtype=np.float64))
+    Target = Data["close_op"].to_numpy(dtype=np.float64)
+    Volatility = Greeks.ImpliedVolatilityForArray(Target=Target, **Arrays)
+    return [
+        ("pricing", lambda: Greeks.EuropeanPriceForArray(Volatility=Volatility, **Arrays)),
+        ("implied_volatility", lambda: Greeks.ImpliedVolatilityForArray(Target=Target, **Arrays)),
+        ("greeks_default", lambda: Greeks.GreeksForArray(Volatility=Volatility, **Arrays)),
+        ("greeks_all", lambda: Greeks.GreeksForArray(Volatility=Volatility, Greeks=Greeks.GREEKS_ALL, **Arrays)),
+        ("compute_greeks", lambda: option.OptionMinuteData.ComputeGreeksForListedContract(Data.copy())),
+        ("compute_greeks_parallel", lambda: option.OptionMinuteData.ComputeGreeksForListedContract(
+            Data.copy(), Workers=os.cpu_count(), ChunkSize=max(len(Data.index) // (4 * os.cpu_count()), 1))),
+    ]
+
+
+def AlertCases(Data):
+    '''
+    平价关系及滚动报警用例
+    '''
+    Alert = option.OptionHistoryAlertForMinuteData.FromListedContractData(
+        option.OptionMinuteData.ComputeGreeksForListedContract(Data.copy()))
+    return [
+        ("format_parity", Alert.FormatDataToParityCompute),
+        ("roll_parity_deviate", Alert.RollAlert_OptionParityDeviate_RawData),
+        ("roll_parity_compact", Alert.RollAlert_OptionParityDeviate_Compact),
+        ("roll_iv_deviate", lambda: Alert.RollAlert_ImpliedVolatilityDeviate_RawData(3)),
+        ("roll_price_deviate", lambda: Alert.RollAlert_OptionPriceDeviate_RawData(3)),
+    ]
+
+
+def StreamCases(Chain, Data):
+    '''
+    实时报警引擎用例，按分钟回放全部数据
+    '''
+    Data = option.OptionMinuteData.ComputeGreeksForListedContract(Data.copy())
+    Context = option.OptionContext(ContractSetData=Chain.ContractSetData, TradeDays=Chain.Calendar)
+    return [
+        ("stream_replay", lambda: option.OptionRealTimeAlert(Context=Context).Replay(Data)),
+    ]
+
+
+def CompactCases(Chain, Data):
+    '''
+    压缩模式用例，合约属性从合成期权链的合约数据集取
+    '''
+    Context = option.OptionContext(ContractSetData=Chain.ContractSetData, TradeDays=Chain.Calendar)
+
+    def Compact():
+        Previous = option.GetContext()
+        option.SetContext(Context)
+        try:
+            return option.OptionMinuteData.CompactDataFrame(Data)
+        finally:
+            option.SetContext(Previous)
+
+    return [
+        ("compact_frame", Compact),
+    ]
+
+
+def SurfaceCases(Chain, Data):
+    '''
+    曲面序列用例，按行数计：OptionSurfaceSeries新建内存映射文件，把全部数据的隐含波动率一次写入各时点的曲面
+    '''
+    Data = option.OptionMinuteData.ComputeGreeksForListedContract(Data, Greeks=(), InPlace=False)
+    Times = option.OptionSurfaceSeries.SessionTimes(Chain.TradeDays)
+    ExercisePrices = np.sort(Chain.ContractSetData["exercise_price"].unique())
+    LimitMonths = np.sort(Chain.ContractSetData["limit_month"].astype(str).unique())
+
+    def Build():
+        Path = tempfile.mkdtemp()
+        try:
+            SurfaceSeries = option.OptionSurfaceSeries.Create(Path, Times, ExercisePrices, LimitMonths)
+            SurfaceSeries.Write(Data)
+            SurfaceSeries.Flush()
+            del SurfaceSeries
+        finally:
+            shutil.rmtree(Path, ignore_errors=True)
+
+    return [
+        ("surface_series_write", Build),
+    ]
+
+
+def SurfacePlotCases(Chain):
+    '''
+    波动率曲面作图用例，每次取单个时点的数据画一个曲面，行数记为1（曲面数）
+    '''
+    import matplotlib.pyplot as plt
+    GivenDateTime = Chain.Times[len(Chain.Times) // 2].strftime("%Y-%m-%d %H:%M:%S")
+
+    def Surface(Function):
+        def Run():
+            Function(GivenDateTime)
+            plt.close("all")
+
+        return Run
+
+    return [
+        ("surface_plot", Surface(option.OptionPlot.ImpliedVolatilitySurfacePlot)),
+        ("surface_plot_dropzero", Surface(option.OptionPlot.ImpliedVolatilitySurfacePlot_dropzero)),
+        ("surface_plot_dropzero_limitmonth",
+         Surface(option.OptionPlot.ImpliedVolatilitySurfacePlot_dropzero_limitmonth)),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="optionalert性能测试")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 1000000, 10000000], help="测试数据行数")
+    parser.add_argument("--cases", nargs="+", default=None, help="只运行指定用例，默认全部")
+    parser.add_argument("--repeat", type=int, default=1, help="每个用例计时次数，取最小值")
+    parser.add_argument("--no-memory", action="store_true", help="不测内存峰值")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backend", choices=["numpy", "numba"], default="numpy", help="定价、隐含波动率、希腊字母的计算后端")
+    parser.add_argument("--output", default=None, help="结果保存为json文件")
+    args = parser.parse_args()
+
+    import matplotlib
+    matplotlib.use("Agg")
+    option.OptionMinuteData.MinuteCache = None
+    option.OptionGreeksMethod.Backend = args.backend
+    # 预先触发numba编译，编译耗时不计入用例
+    KernelCases(ChainForRows(1, Seed=args.seed).MinuteData())
+    Results = []
+    for Rows in args.rows:
+        Chain = ChainForRows(Rows, Seed=args.seed)
+        Data = Chain.MinuteData()
+        Cases = KernelCases(Data) + AlertCases(Data) + StreamCases(Chain, Data) + CompactCases(Chain, Data) + \
+            SurfaceCases(Chain, Data)
+        if Rows == min(args.rows):
+            # 作图用例与数据量无关，只运行一次
+            SurfaceChain = ChainForRows(1, Seed=args.seed)
+            option.SetContext(option.OptionContext(Provider=SurfaceChain.Provider(), TradeDays=SurfaceChain.Calendar))
+            Cases += SurfacePlotCases(SurfaceChain)
+        for Name, Function in Cases:
+            if args.cases is not None and Name not in args.cases:
+                continue
+            CaseRows = 1 if Name.startswith("surface_plot") else len(Data.index)
+            result = RunCase(Name, Function, CaseRows, args.repeat, not args.no_memory)
+            Results.append(result)
+            if "error" in result:
+                print("{case:<34}{rows:>12,d}  error: {error}".format(**result))
+            else:
+                print("{case:<34}{rows:>12,d}{seconds:>10.3f}s{rows_per_second:>16,.0f} rows/s".format(**result) + (
+                    "{:>10.1f} MB".format(result["peak_mb"]) if "peak_mb" in result else ""))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(Results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# 用合成期权链和回放数据接口核对各优化实现与原始pandas写法的结果一致，不需要wind终端
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import option
+from option_benchmark import SyntheticOptionChain, SyntheticProvider
+
+
+@pytest.fixture
+def Chain(monkeypatch):
+    '''
+    3个交易日、每天60分钟、6个执行价格×2个到期月份的合成期权链，测试期间作为当前运行环境
+    '''
+    Chain = SyntheticOptionChain(Strikes=6, Expiries=2, Days=3, Minutes=60, Seed=1)
+    monkeypatch.setattr(option.OptionMinuteData, "MinuteCache", None)
+    monkeypatch.setattr(option.OptionMinuteData, "GreeksCache", None)
+    Previous = option.GetContext()
+    option.SetContext(option.OptionContext(ContractSetData=Chain.ContractSetData,
+                                           Provider=SyntheticProvider(Chain)))
+    yield Chain
+    option.SetContext(Previous)
+
+
+@pytest.fixture
+def GreeksData(Chain):
+    return option.OptionMinuteData.ComputeGreeksForListedContract(Chain.MinuteData(), InPlace=False)
+
+
+def test_rolling_extrema_matches_groupby_rolling(GreeksData):
+    Data = GreeksData.sample(frac=1, random_state=0).reset_index(drop=True)
+    Data.loc[Data.index[::17], "ImpliedVolatility"] = np.nan
+    Grouped = Data.groupby([Data["windcode_op"], Data["datetime"].dt.date])["ImpliedVolatility"]
+    for Window in (1, 3, 5):
+        RollingMax, RollingMin = option.RollingExtrema.ForDataFrame(Data, "ImpliedVolatility", Window)
+        ExpectedMax = Grouped.rolling(Window).max().reset_index(level=[0, 1], drop=True).sort_index()
+        ExpectedMin = Grouped.rolling(Window).min().reset_index(level=[0, 1], drop=True).sort_index()
+        np.testing.assert_array_equal(RollingMax, ExpectedMax.to_numpy())
+        np.testing.assert_array_equal(RollingMin, ExpectedMin.to_numpy())
+
+
+def test_rolling_extrema_time_window_without_gaps(GreeksData):
+    # 合成数据每天从9:31起连续60分钟，没有午间休市，按交易分钟滚动与按行滚动一致
+    RowMax, RowMin = option.RollingExtrema.ForDataFrame(GreeksData, "close_op", 3)
+    TimeMax, TimeMin = option.RollingExtrema.ForDataFrame(GreeksData, "close_op", 3, TimeWindow=True)
+    First = GreeksData.groupby([GreeksData["windcode_op"], GreeksData["datetime"].dt.date]).cumcount().to_numpy() < 2
+    np.testing.assert_array_equal(RowMax[~First], TimeMax[~First])
+    np.testing.assert_array_equal(RowMin[~First], TimeMin[~First])
+
+
+def test_parity_pair_index_matches_merge(GreeksData):
+    Data = GreeksData.sample(frac=1, random_state=2).reset_index(drop=True)
+    Data = Data.drop(index=Data.index[Data["call_or_put"] == "认沽"][::7]).reset_index(drop=True)
+    Data["row"] = np.arange(len(Data.index))
+    Keys = ["datetime", "limit_month", "exercise_price"]
+    Expected = pd.merge(Data.loc[Data["call_or_put"] == "认购", Keys + ["row"]],
+                        Data.loc[Data["call_or_put"] == "认沽", Keys + ["row"]], on=Keys, how="left",
+                        suffixes=("_call", "_put"))
+    CallRows, PutRows = option.OptionHistoryAlertForMinuteData.ParityPairIndexForDataFrame(Data)
+    np.testing.assert_array_equal(CallRows, Expected["row_call"].to_numpy())
+    np.testing.assert_array_equal(PutRows, Expected["row_put"].fillna(-1).to_numpy(dtype=np.int64))
+
+
+def test_sweep_counts_match_result_calls(GreeksData):
+    Measure = option.OptionHistoryAlertMeasure.FromListedContractData(GreeksData)
+    Thresholds = [0.0001, 0.002, 0.01, 0.05]
+    Bandwiths = (3, 5)
+    Sweep = Measure.SweepImpliedVolatilityDeviate(Thresholds, Bandwiths).set_index(["bandwith", "Arg1_Value"])
+    for Bandwith in Bandwiths:
+        RawData = Measure.RollAlert_ImpliedVolatilityDeviate_RawData(Bandwith)
+        for Threshold in Thresholds:
+            Expected = len(Measure.RollAlert_ImpliedVolatilityDeviate_Result(RawData, Threshold).index)
+            assert Sweep.loc[(Bandwith, Threshold), "AlertCount"] == Expected
+    Sweep = Measure.SweepOptionPriceDeviate(Thresholds, Bandwiths).set_index(["bandwith", "Arg1_Value"])
+    for Bandwith in Bandwiths:
+        RawData = Measure.RollAlert_OptionPriceDeviate_RawData(Bandwith)
+        for Threshold in Thresholds:
+            Expected = len(Measure.RollAlert_OptionPriceDeviate_Resultt(RawData, Threshold).index)
+            assert Sweep.loc[(Bandwith, Threshold), "AlertCount"] == Expected
+    Grid = [0.001, 0.01, 0.1]
+    Sweep = Measure.SweepOptionParityDeviate(Grid, Grid, Grid).set_index(["Arg1_Value", "Arg2_Value", "Arg3_Value"])
+    RawData = Measure.RollAlert_OptionParityDeviate_RawData()
+    for Arg1 in Grid:
+        for Arg2 in Grid:
+            for Arg3 in Grid:
+                Expected = len(Measure.RollAlert_OptionParityDeviate_Result(RawData, Arg1, Arg2, Arg3).index)
+                assert Sweep.loc[(Arg1, Arg2, Arg3), "AlertCount"] == Expected
+
+
+def AssertAlertsEqual(Left, Right):
+    assert set(Left) == set(Right)
+    for x in Left:
+        pd.testing.assert_frame_equal(Left[x], Right[x])
+
+
+def test_backtest_resume_gives_same_alerts(Chain, tmp_path):
+    StartDate = Chain.TradeDays[0].strftime("%Y-%m-%d")
+    EndDate = Chain.TradeDays[-1].strftime("%Y-%m-%d")
+    # 录制一次完整回测的数据请求，之后的回测都从回放数据取数
+    option.SetContext(option.OptionContext(ContractSetData=Chain.ContractSetData, Provider=option.RecordingProvider(
+        SyntheticProvider(Chain), str(tmp_path / "record"))))
+    Expected = option.OptionAlertBacktest().Run(StartDate, EndDate)
+    option.SetContext(option.OptionContext(ContractSetData=Chain.ContractSetData,
+                                           Provider=option.ReplayProvider(str(tmp_path / "record"))))
+    Checkpoint = option.BacktestCheckpoint(str(tmp_path / "checkpoint"))
+    AssertAlertsEqual(option.OptionAlertBacktest(Checkpoint=Checkpoint).Run(StartDate, EndDate), Expected)
+    # 删除最后一天的断点，模拟中断：前两天读断点，最后一天重新取数计算
+    Backtest = option.OptionAlertBacktest(Checkpoint=Checkpoint)
+    for Kind, Params in (("greeks", Backtest.GreeksParams), ("alerts", Backtest.AlertParams)):
+        os.remove(Checkpoint.PartitionPath(Kind, Params, Chain.TradeDays[-1]))
+    AssertAlertsEqual(Backtest.Run(StartDate, EndDate), Expected)
+    # 只改报警阈值时复用greeks断点
+    Backtest = option.OptionAlertBacktest(ImpliedVolatilityThreshold=0.01, Checkpoint=Checkpoint)
+    AssertAlertsEqual(Backtest.Run(StartDate, EndDate),
+                      option.OptionAlertBacktest(ImpliedVolatilityThreshold=0.01).Run(StartDate, EndDate))
+
+
+@pytest.mark.parametrize("Greeks", [None, ("Delta", "Vanna", "Charm")])
+def test_greeks_cache_matches_uncached(Chain, tmp_path, monkeypatch, Greeks):
+    Data = Chain.MinuteData()
+    Expected = option.OptionMinuteData.ComputeGreeksForListedContract(Data, Greeks=Greeks, InPlace=False)
+    monkeypatch.setattr(option.OptionMinuteData, "GreeksCache", option.GreeksResultCache(str(tmp_path)))
+    for _ in range(2):
+        # 第一次全部未命中写入缓存，第二次全部从缓存读取
+        pd.testing.assert_frame_equal(
+            option.OptionMinuteData.ComputeGreeksForListedContract(Data, Greeks=Greeks, InPlace=False), Expected)
+    # 改动部分行的价格后，缓存结果仍与不使用缓存时一致
+    Changed = Data.copy()
+    Changed.loc[Changed.index[::11], "close_op"] *= 1.01
+    Result = option.OptionMinuteData.ComputeGreeksForListedContract(Changed, Greeks=Greeks, InPlace=False)
+    monkeypatch.setattr(option.OptionMinuteData, "GreeksCache", None)
+    pd.testing.assert_frame_equal(
+        Result, option.OptionMinuteData.ComputeGreeksForListedContract(Changed, Greeks=Greeks, InPlace=False))